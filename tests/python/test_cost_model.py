@@ -0,0 +1,96 @@
+import json
+import random
+import zipfile
+import pytest
+from tools.make.cost_model import (
+    FEATURES,
+    ChunkCostModel,
+    calibrate,
+    chunk_features,
+    load_pie_samples,
+    resource_limits,
+)
+from tools.py.mmr import leaf_count_to_mmr_size
+
+TRUE_COEFFICIENTS = {
+    "n_steps": [1200, 900, 40, 60, 300],
+    "range_check_builtin": [50, 30, 2, 0, 4],
+    "bitwise_builtin": [10, 0, 3, 5, 20],
+    "keccak_builtin": [0, 0, 0, 1, 1],
+    "poseidon_builtin": [20, 1, 1, 0, 1],
+}
+
+
+def write_pie(directory, name, bytes_lens, mmr_size):
+    features = chunk_features(bytes_lens, mmr_size)
+    resources = {
+        resource: sum(c * features[f] for c, f in zip(coefs, FEATURES))
+        for resource, coefs in TRUE_COEFFICIENTS.items()
+    }
+    with open(directory / f"{name}_input.json", "w") as f:
+        json.dump({"bytes_len_array": bytes_lens, "mmr_last_len": mmr_size}, f)
+    with zipfile.ZipFile(directory / f"{name}_pie.zip", "w") as zipf:
+        zipf.writestr(
+            "execution_resources.json",
+            json.dumps(
+                {
+                    "n_steps": resources.pop("n_steps"),
+                    "builtin_instance_counter": resources,
+                }
+            ),
+        )
+
+
+def test_calibration_from_pie_objects(tmp_path):
+    rng = random.Random(0)
+    for i in range(12):
+        bytes_lens = [rng.randint(500, 650) for _ in range(rng.randint(1, 300))]
+        mmr_size = leaf_count_to_mmr_size(rng.randint(1, 10**6))
+        write_pie(tmp_path, f"blocks_{i}", bytes_lens, mmr_size)
+    samples = load_pie_samples(str(tmp_path))
+    assert len(samples) == 12
+    model = calibrate(samples)
+    model.save(str(tmp_path / "calibration.json"))
+    model = ChunkCostModel.load(str(tmp_path / "calibration.json"))
+    for features, resources in samples:
+        for resource, value in model.predict(features).items():
+            assert value == pytest.approx(resources[resource], rel=1e-6, abs=1e-3)
+
+
+def test_max_batch_size_is_the_largest_fitting_batch():
+    rng = random.Random(1)
+    bytes_lens = [rng.randint(500, 650) for _ in range(1700)]
+    mmr_size = leaf_count_to_mmr_size(12345)
+    models = [
+        ChunkCostModel.load("missing_calibration.json"),
+        ChunkCostModel(
+            {r: dict(zip(FEATURES, c)) for r, c in TRUE_COEFFICIENTS.items()}, 0.02
+        ),
+    ]
+    for model in models:
+        batch_size = model.max_batch_size(bytes_lens, mmr_size)
+        assert 0 < batch_size < len(bytes_lens)
+        assert model.fits(chunk_features(bytes_lens[:batch_size], mmr_size))
+        assert not model.fits(chunk_features(bytes_lens[: batch_size + 1], mmr_size))
+    # Without calibration, keccak_builtin is the only constraint.
+    batch_size = models[0].max_batch_size(bytes_lens, mmr_size)
+    keccak = models[0].predict(chunk_features(bytes_lens[:batch_size], mmr_size))
+    assert keccak["keccak_builtin"] <= resource_limits()["keccak_builtin"]
+
+
+def test_max_batch_size_raises_if_a_block_does_not_fit():
+    rng = random.Random(2)
+    limit = resource_limits()["n_steps"]
+    samples = []
+    for _ in range(12):
+        features = chunk_features(
+            [rng.randint(500, 650) for _ in range(rng.randint(1, 300))],
+            leaf_count_to_mmr_size(rng.randint(1, 10**6)),
+        )
+        resources = {resource: 0 for resource in resource_limits()}
+        resources["n_steps"] = limit + 900 * features["n_blocks"]
+        samples.append((features, resources))
+    # The fitted constant alone, with the safety margin, is over the n_steps limit.
+    model = calibrate(samples)
+    with pytest.raises(ValueError, match="single block"):
+        model.max_batch_size([600] * 10, leaf_count_to_mmr_size(12345))
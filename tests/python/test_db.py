@@ -0,0 +1,104 @@
+import sqlite3
+from tools.py.mmr import MMR, KeccakHasher, PoseidonHasher
+from tools.make.db import (
+    BlockWindow,
+    fetch_block_range_from_db,
+    setup_db,
+    open_mmr_node_stores,
+    commit_node_stores,
+    setup_checkpoints_table,
+    save_mmr_checkpoint,
+    get_nearest_mmr_checkpoint,
+)
+
+
+def test_persistent_node_stores(tmp_path):
+    db_path = tmp_path / "blocks.db"
+    conn = sqlite3.connect(db_path)
+    stores = open_mmr_node_stores(conn)
+    mmrs = [
+        MMR(PoseidonHasher(), stores["poseidon"]),
+        MMR(KeccakHasher(), stores["keccak"]),
+    ]
+    for mmr in mmrs:
+        mmr.extend(list(range(1, 12)))
+    commit_node_stores(conn, list(stores.values()), next_block=88)
+    roots = [mmr.get_root() for mmr in mmrs]
+
+    # Uncommitted nodes are lost, the trees reopen at their last committed size.
+    for mmr in mmrs:
+        mmr.add(12)
+    conn.close()
+
+    conn = sqlite3.connect(db_path)
+    stores = open_mmr_node_stores(conn)
+    reopened = [
+        MMR(PoseidonHasher(), stores["poseidon"]),
+        MMR(KeccakHasher(), stores["keccak"]),
+    ]
+    assert [mmr.get_root() for mmr in reopened] == roots
+    assert len(stores["poseidon"]) == len(stores["keccak"]) == 19
+    assert stores["poseidon"].next_block == stores["keccak"].next_block == 88
+
+    reference = MMR(KeccakHasher())
+    reference.extend(list(range(1, 13)))
+    reopened[1].add(12)
+    commit_node_stores(conn, list(stores.values()), next_block=87)
+    assert reopened[1].get_root() == reference.get_root()
+    assert reopened[1].get_proof(3) == reference.get_proof(3)
+    conn.close()
+
+
+def test_mmr_checkpoints(tmp_path):
+    conn = sqlite3.connect(tmp_path / "blocks.db")
+    setup_checkpoints_table(conn)
+    state = {
+        "mmr_peaks": {"poseidon": [2**251, 3], "keccak": [2**255, 5]},
+        "mmr_size": 4,
+        "mmr_roots": {"poseidon": 7, "keccak": 2**256 - 1},
+    }
+    origin = (300, dict(state, mmr_size=1))
+    save_mmr_checkpoint(conn, origin, 100, state)
+    save_mmr_checkpoint(conn, origin, 200, dict(state, mmr_size=10))
+    assert get_nearest_mmr_checkpoint(conn, 100, origin[1]) == (origin, 100, state)
+    assert get_nearest_mmr_checkpoint(conn, 42, origin[1]) == (origin, 100, state)
+    assert get_nearest_mmr_checkpoint(conn, 150, origin[1])[1] == 200
+    assert get_nearest_mmr_checkpoint(conn, 201, origin[1]) is None
+
+    # Runs from other initial states or start blocks neither overwrite nor match them.
+    other_state = dict(state, mmr_roots={"poseidon": 8, "keccak": 9})
+    save_mmr_checkpoint(conn, (300, other_state), 100, dict(state, mmr_size=7))
+    save_mmr_checkpoint(conn, (120, origin[1]), 110, dict(state, mmr_size=8))
+    assert get_nearest_mmr_checkpoint(conn, 100, origin[1]) == (origin, 100, state)
+    assert get_nearest_mmr_checkpoint(conn, 105, origin[1])[0] == (120, origin[1])
+    # A run started at 120 cannot be continued from above 120.
+    assert get_nearest_mmr_checkpoint(conn, 121, origin[1])[:2] == (origin, 200)
+    assert get_nearest_mmr_checkpoint(conn, 100, other_state)[2]["mmr_size"] == 7
+    assert get_nearest_mmr_checkpoint(conn, 150, other_state) is None
+    conn.close()
+
+
+def test_block_window():
+    conn = sqlite3.connect(":memory:")
+    setup_db(conn)
+    with conn:
+        conn.executemany(
+            "INSERT INTO blocks VALUES (?, ?)",
+            [(i, i.to_bytes(4, "big")) for i in range(5000) if i % 97 != 5],
+        )
+    window = BlockWindow(conn, window_size=500, max_blocks=800)
+    for start, end in [(4000, 4100), (4050, 4101), (10, 20), (3900, 4300), (-5, 3)]:
+        assert window.fetch_block_range(start, end) == fetch_block_range_from_db(
+            start, end, conn
+        )
+
+    # Descending scan with overlapping requests, as in chunk preparation.
+    window = BlockWindow(conn, window_size=5000)
+    high = 4998
+    while high >= 0:
+        window.fetch_block_range(high - 1699, high)
+        low = max(high - 1400, 0)
+        window.fetch_block_range(low, high + 1)
+        high = low - 1
+    assert window.rows_read == len(fetch_block_range_from_db(0, 4999, conn))
+    assert window.hit_rate() > 0.7
@@ -0,0 +1,338 @@
+import random
+import sqlite3
+import asyncio
+import threading
+from aiohttp import web
+from tools.py.block_header import build_block_header
+from tools.py.fetch_block_headers_async import AsyncBlockFetcher
+from tools.py.rpc_endpoints import (
+    AdaptiveBatchSize,
+    BREAKER_COOLDOWN,
+    BREAKER_FAILURE_THRESHOLD,
+    Endpoint,
+    EndpointPool,
+    TokenBucket,
+)
+from tools.make.db import (
+    setup_db,
+    fetch_and_insert_blocks,
+    fetch_block_range_from_db,
+    check_db_integrity,
+)
+
+# Larger batches are rejected by the mock server, as by most RPC providers.
+SERVER_MAX_BATCH_SIZE = 64
+# One request out of FAILURE_PERIOD gets an HTTP error.
+FAILURE_PERIOD = 7
+BREAKER_TEST_COOLDOWN = 0.05
+
+
+def rpc_block(number: int) -> dict:
+    word = lambda tag: "0x" + (number * 1000 + tag).to_bytes(32, "big").hex()
+    return {
+        "parentHash": word(1),
+        "sha3Uncles": word(2),
+        "miner": "0x" + (number % 256).to_bytes(20, "big").hex(),
+        "stateRoot": word(3),
+        "transactionsRoot": word(4),
+        "receiptsRoot": word(5),
+        "logsBloom": "0x" + bytes(256).hex(),
+        "difficulty": hex(number * 3),
+        "number": hex(number),
+        "gasLimit": hex(30000000),
+        "gasUsed": hex(number * 7),
+        "timestamp": hex(1438269973 + number * 12),
+        "extraData": "0x" + bytes(number % 32).hex(),
+        "mixHash": word(6),
+        "nonce": "0x" + number.to_bytes(8, "big").hex(),
+        "baseFeePerGas": hex(number + 1),
+    }
+
+
+def expected_rows(start: int, end: int):
+    return [
+        (n, build_block_header(rpc_block(n)).raw_rlp()) for n in range(start, end + 1)
+    ]
+
+
+class MockRpcServer:
+    """
+    JSON-RPC server answering eth_getBlockByNumber batches in a background thread, with shuffled
+    responses, random latencies (up to max_latency seconds), HTTP errors (one request out of
+    failure_period, or invalid answers with a 200 status if invalid_answers is set) and a batch size limit.
+    """
+
+    def __init__(
+        self,
+        max_latency: float = 0.02,
+        failure_period: int = FAILURE_PERIOD,
+        invalid_answers: bool = False,
+    ):
+        self.rng = random.Random(0)
+        self.max_latency = max_latency
+        self.failure_period = failure_period
+        self.invalid_answers = invalid_answers
+        self.requests = 0
+        self.blocks = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.rejected = 0
+        self.encodings = set()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            self.encodings.add(
+                (
+                    request.headers.get("Content-Encoding"),
+                    request.headers.get("Accept-Encoding"),
+                )
+            )
+            calls = await request.json()
+            await asyncio.sleep(self.rng.uniform(0, self.max_latency))
+            if self.failure_period and self.requests % self.failure_period == 0:
+                self.rejected += 1
+                if not self.invalid_answers:
+                    return web.Response(status=503, text="Service unavailable")
+                if self.rejected % 2:
+                    return web.Response(text="<html>Bad gateway</html>")
+                return web.json_response([42])
+            if len(calls) > SERVER_MAX_BATCH_SIZE:
+                self.rejected += 1
+                return web.json_response(
+                    {
+                        "jsonrpc": "2.0",
+                        "id": None,
+                        "error": {"message": "batch too large"},
+                    }
+                )
+            responses = [
+                {
+                    "jsonrpc": "2.0",
+                    "id": call["id"],
+                    "result": rpc_block(int(call["params"][0], 16)),
+                }
+                for call in calls
+            ]
+            self.rng.shuffle(responses)
+            self.blocks += len(responses)
+            response = web.json_response(responses)
+            response.enable_compression()
+            return response
+        finally:
+            self.in_flight -= 1
+
+    async def _start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f"http://127.0.0.1:{port}/"
+
+    def __enter__(self) -> "MockRpcServer":
+        self.thread.start()
+        self.url = asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return self
+
+    def __exit__(self, *_):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def small_batches() -> AdaptiveBatchSize:
+    return AdaptiveBatchSize(initial=16, maximum=256, step=16)
+
+
+def pool(*servers: MockRpcServer) -> EndpointPool:
+    return EndpointPool(
+        [
+            Endpoint(
+                server.url, batch_size=small_batches(), cooldown=BREAKER_TEST_COOLDOWN
+            )
+            for server in servers
+        ]
+    )
+
+
+def test_adaptive_batch_size():
+    batch_size = AdaptiveBatchSize(initial=100, minimum=10, maximum=200, step=50)
+    batch_size.on_success(100, 0.1)
+    assert batch_size.size == 150
+    # Partial batches (end of the range) do not grow it.
+    batch_size.on_success(20, 0.1)
+    assert batch_size.size == 150
+    batch_size.on_success(150, 0.1)
+    batch_size.on_success(200, 0.1)
+    assert batch_size.size == 200
+    batch_size.on_success(200, 60.0)
+    assert batch_size.size == 100
+    for _ in range(5):
+        batch_size.on_error()
+    assert batch_size.size == 10
+
+
+def test_async_fetcher_orders_blocks():
+    calls = []
+    with MockRpcServer() as server:
+        endpoints = pool(server)
+        fetcher = AsyncBlockFetcher(endpoints, concurrency=4, retry_delay=0.01)
+        asyncio.run(fetcher.fetch_range(100, 1099, calls.append))
+
+    # Consecutive ranges in ascending order, whatever the order of the responses.
+    assert [row for rows in calls for row in rows] == expected_rows(100, 1099)
+    assert server.max_in_flight > 1
+    assert fetcher.errors == server.rejected > 0
+    assert endpoints.endpoints[0].batch_size.size <= SERVER_MAX_BATCH_SIZE + 16
+
+
+def test_async_fetcher_compression():
+    calls = []
+    with MockRpcServer(failure_period=None) as server:
+        fetcher = AsyncBlockFetcher(pool(server), compress_requests=True)
+        asyncio.run(fetcher.fetch_range(0, 99, calls.append))
+
+    assert [row for rows in calls for row in rows] == expected_rows(0, 99)
+    assert server.encodings == {("gzip", "gzip")}
+
+
+def test_async_fetcher_retries_invalid_answers():
+    calls = []
+    with MockRpcServer(failure_period=None) as valid, MockRpcServer(
+        failure_period=1, invalid_answers=True
+    ) as invalid:
+        fetcher = AsyncBlockFetcher(
+            pool(valid, invalid), concurrency=4, retry_delay=0.01
+        )
+        asyncio.run(fetcher.fetch_range(0, 299, calls.append))
+
+    assert [row for rows in calls for row in rows] == expected_rows(0, 299)
+    assert fetcher.errors == invalid.rejected > 1
+
+
+def test_fetch_and_insert_blocks(tmp_path):
+    conn = sqlite3.connect(tmp_path / "blocks.db")
+    setup_db(conn)
+    with MockRpcServer() as server:
+        fetch_and_insert_blocks(
+            conn,
+            0,
+            499,
+            endpoints=pool(server),
+            concurrency=3,
+            retry_delay=0.01,
+        )
+        fetch_and_insert_blocks(
+            conn,
+            500,
+            799,
+            endpoints=pool(server),
+            concurrency=3,
+            retry_delay=0.01,
+        )
+    assert fetch_block_range_from_db(0, 799, conn) == expected_rows(0, 799)
+    check_db_integrity(conn)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=100, burst=50, clock=clock)
+    assert bucket.delay(50) == 0
+    bucket.take(50)
+    assert bucket.delay(10) == 0.1
+    clock.now = 0.1
+    assert bucket.delay(10) == 0
+    # Batches larger than the burst wait for a full bucket, then leave it in debt.
+    assert bucket.delay(80) == 0.4
+    clock.now = 0.5
+    bucket.take(80)
+    assert bucket.delay(1) == 0.31
+    assert TokenBucket(None).delay(10**6) == 0
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    endpoint = Endpoint("http://127.0.0.1/key", clock=clock)
+    assert endpoint.name == "127.0.0.1"
+    for _ in range(BREAKER_FAILURE_THRESHOLD - 1):
+        endpoint.on_failure()
+    assert endpoint.is_available()
+    endpoint.on_failure()
+    assert not endpoint.is_available()
+
+    # A single trial batch after the cooldown, doubling it if it fails.
+    clock.now = BREAKER_COOLDOWN
+    assert endpoint.is_available()
+    endpoint.reserve()
+    assert not endpoint.is_available()
+    endpoint.on_failure()
+    endpoint.release()
+    clock.now = 2 * BREAKER_COOLDOWN
+    assert not endpoint.is_available()
+    clock.now = 3 * BREAKER_COOLDOWN
+    endpoint.reserve()
+    # A trial batch ending without an outcome lets another one be sent.
+    endpoint.release()
+    assert endpoint.is_available()
+    endpoint.reserve()
+    endpoint.on_success(10, 0.5)
+    endpoint.release()
+    assert endpoint.is_available()
+    assert endpoint.latency_per_block == 0.05
+    assert endpoint.cooldown == BREAKER_COOLDOWN
+
+    # Rate limited batches empty the bucket without opening the circuit.
+    endpoint = Endpoint("http://127.0.0.1/key", rate=10, clock=clock)
+    for _ in range(BREAKER_FAILURE_THRESHOLD):
+        endpoint.on_rate_limited()
+    assert endpoint.is_available()
+    assert endpoint.bucket.delay(10) == 1
+
+
+def test_endpoint_pool():
+    pool = EndpointPool.parse(" http://a/key|100, http://b ,")
+    assert [(e.url, e.bucket.rate) for e in pool.endpoints] == [
+        ("http://a/key", 100),
+        ("http://b", None),
+    ]
+    fast, slow = pool.endpoints
+    fast.on_success(100, 1.0)
+    slow.on_success(100, 4.0)
+    assert pool.best() is fast
+    assert pool.best(exclude=[fast]) is slow
+    # The latency of the fast endpoint is shared by its batches in flight.
+    for _ in range(4):
+        fast.reserve()
+    assert pool.best() is slow
+
+
+def test_fetch_from_several_endpoints():
+    with MockRpcServer(max_latency=0.005, failure_period=None) as fast, MockRpcServer(
+        max_latency=0.5, failure_period=None
+    ) as slow, MockRpcServer(failure_period=1) as failing:
+        endpoints = pool(fast, slow, failing)
+        calls = []
+        fetcher = AsyncBlockFetcher(endpoints, concurrency=6, retry_delay=0.01)
+        asyncio.run(fetcher.fetch_range(0, 1999, calls.append))
+
+    assert [row for rows in calls for row in rows] == expected_rows(0, 1999)
+    assert fast.blocks + slow.blocks == 2000
+    assert fast.blocks > slow.blocks > 0
+    # The failing endpoint is cut off once its circuit opens, its batches going to the others.
+    assert failing.blocks == 0
+    assert failing.requests < fetcher.requests / 4
@@ -0,0 +1,17 @@
+import random
+from tools.make.hashing_service import HashingService, compute_hashes
+
+
+def test_hashing_service_matches_compute_hashes():
+    rng = random.Random(0)
+    blocks = [rng.randbytes(rng.randint(500, 650)) for _ in range(20)]
+    expected = [compute_hashes(block) for block in blocks]
+    with HashingService(max_workers=2) as hashing:
+        assert hashing.batch_size(len(blocks)) == 3
+        for _ in range(2):
+            poseidon_hashes, keccak_hashes = hashing.hash_blocks(blocks)
+            assert list(zip(keccak_hashes, poseidon_hashes)) == expected
+        assert hashing.hash_blocks([]) == ([], [])
+        # Every worker is listed, the idle ones at 0.
+        assert list(hashing.utilization()) == hashing.workers
+        assert len(set(hashing.workers)) == 2
@@ -0,0 +1,251 @@
+import pytest
+import tools.py.mmr
+from tools.py.mmr import (
+    MMR,
+    MMRFrontier,
+    DualMMRFrontier,
+    CompactNodeStore,
+    PoseidonHasher,
+    KeccakHasher,
+    MockedHasher,
+    append_hash_count,
+    get_peaks,
+    get_peaks_heights,
+    is_valid_mmr_size,
+    leaf_count_to_mmr_size,
+    leaf_index_to_pos,
+    mmr_size_to_leaf_count,
+    pos_to_leaf_index,
+    split_perfect_subtrees,
+    tree_pos_height,
+    verify_proof,
+)
+
+N_LEAVES = 100
+
+
+@pytest.mark.parametrize("hasher_class", [PoseidonHasher, KeccakHasher])
+def test_compact_store_matches_dict_store(hasher_class):
+    dict_mmr = MMR(hasher_class())
+    compact_mmr = MMR(hasher_class(), CompactNodeStore())
+    for i in range(N_LEAVES):
+        leaf = (i + 1) * 0x1234567890ABCDEF
+        assert dict_mmr.add(leaf) == compact_mmr.add(leaf)
+        assert dict_mmr.get_peaks() == compact_mmr.get_peaks()
+        assert dict_mmr.get_root() == compact_mmr.get_root()
+    assert len(compact_mmr.pos_hash) == dict_mmr.last_pos + 1
+
+
+def test_compact_store_resumes_from_its_size():
+    store = CompactNodeStore(capacity=4)
+    mmr = MMR(KeccakHasher(), store)
+    for i in range(7):
+        mmr.add(i)
+    resumed = MMR(KeccakHasher(), store)
+    assert resumed.last_pos == mmr.last_pos
+    assert resumed.get_root() == mmr.get_root()
+    with pytest.raises(KeyError):
+        store[len(store)]
+
+
+def test_compact_store_packs_its_tail():
+    store = CompactNodeStore()
+    store.TAIL_SIZE = 4
+    mmr, reference = MMR(KeccakHasher(), store), MMR(KeccakHasher())
+    for leaves in ([1, 2, 3], [4], list(range(5, 18)), [18, 19]):
+        mmr.extend(leaves)
+        reference.extend(leaves)
+        assert mmr.get_peaks() == reference.get_peaks()
+    mmr.add(20)
+    reference.add(20)
+    assert [store[pos] for pos in range(len(store))] == [
+        reference.pos_hash[pos] for pos in range(len(store))
+    ]
+    # Overwriting a packed node read back before does not leave a stale value.
+    store[0] = (2**256 - 1).to_bytes(32, "big")
+    assert store[0] == 2**256 - 1
+
+
+@pytest.mark.parametrize("hasher_class", [PoseidonHasher, KeccakHasher])
+def test_frontier_matches_mmr(hasher_class):
+    mmr = MMR(hasher_class())
+    frontier = MMRFrontier(hasher_class())
+    for i in range(N_LEAVES):
+        assert mmr.add(i) == frontier.add(i)
+        assert mmr.last_pos + 1 == frontier.mmr_size
+        assert mmr.get_peaks() == frontier.get_peaks()
+        assert mmr.get_root() == frontier.get_root()
+
+
+@pytest.mark.parametrize("initial_leaves", [1, 2, 7, 8, 42])
+def test_frontier_resumes_from_peaks(initial_leaves):
+    mmr = MMR(KeccakHasher())
+    for i in range(initial_leaves):
+        mmr.add(i)
+    frontier = MMRFrontier(KeccakHasher(), mmr.get_peaks(), mmr.last_pos + 1)
+    for i in range(N_LEAVES):
+        mmr.add(i)
+        frontier.add(i)
+    assert mmr.get_peaks() == frontier.get_peaks()
+    assert mmr.get_root() == frontier.get_root()
+
+
+def test_frontier_rejects_inconsistent_peaks():
+    with pytest.raises(ValueError):
+        MMRFrontier(KeccakHasher(), [1, 2], 3)
+    with pytest.raises(ValueError):
+        MMRFrontier(KeccakHasher(), [1], 2)
+
+
+def test_position_arithmetic():
+    mmr = MMR(MockedHasher())
+    heights = {}
+    for leaf_index in range(1000):
+        pos = mmr.add(0)
+        assert leaf_index_to_pos(leaf_index) == pos
+        assert pos_to_leaf_index(pos) == leaf_index
+        heights[pos] = 0
+        for p in range(pos + 1, mmr.last_pos + 1):
+            heights[p] = heights[p - 1] + 1
+        mmr_size = mmr.last_pos + 1
+        assert leaf_count_to_mmr_size(leaf_index + 1) == mmr_size
+        assert mmr_size_to_leaf_count(mmr_size) == leaf_index + 1
+        assert is_valid_mmr_size(mmr_size)
+        assert get_peaks_heights(mmr_size) == [heights[p] for p in get_peaks(mmr_size)]
+    assert all(tree_pos_height(p) == h for p, h in heights.items())
+    assert [n for n in range(20) if is_valid_mmr_size(n)] == [
+        0,
+        1,
+        3,
+        4,
+        7,
+        8,
+        10,
+        11,
+        15,
+        16,
+        18,
+        19,
+    ]
+    with pytest.raises(ValueError):
+        pos_to_leaf_index(2)
+
+
+@pytest.mark.parametrize("hasher_class", [PoseidonHasher, KeccakHasher])
+@pytest.mark.parametrize("initial_leaves", [0, 1, 3, 8, 11])
+@pytest.mark.parametrize("store_class", [dict, CompactNodeStore])
+def test_extend_matches_add(hasher_class, initial_leaves, store_class):
+    mmr = MMR(hasher_class())
+    extended = MMR(hasher_class(), store_class())
+    frontier = MMRFrontier(hasher_class())
+    for i in range(initial_leaves):
+        mmr.add(i)
+        extended.add(i)
+        frontier.add(i)
+    for batch_size in [1, 2, 5, 16, 0, 33]:
+        leaves = [(i + 1) * 0xABCDEF for i in range(batch_size)]
+        for leaf in leaves:
+            mmr.add(leaf)
+        extended.extend(leaves)
+        frontier.extend(leaves)
+        assert extended.last_pos == mmr.last_pos
+        assert frontier.mmr_size == mmr.last_pos + 1
+        assert extended.get_peaks() == frontier.get_peaks() == mmr.get_peaks()
+        assert extended.get_root() == frontier.get_root() == mmr.get_root()
+    assert [extended.pos_hash[p] for p in range(mmr.last_pos + 1)] == [
+        mmr.pos_hash[p] for p in range(mmr.last_pos + 1)
+    ]
+    # add keeps working after extend
+    extended.add(42)
+    mmr.add(42)
+    assert extended.get_root() == mmr.get_root()
+
+
+@pytest.mark.parametrize("leaf_count", [1, 2, 7, 8, 1000])
+def test_append_hash_count(leaf_count):
+    mmr_size = leaf_count_to_mmr_size(leaf_count)
+    for n_leaves in [0, 1, 5, 64, 333]:
+        mmr = MMR(MockedHasher())
+        mmr.last_pos = mmr_size - 1
+        mmr.pos_hash = {pos: 0 for pos in get_peaks(mmr_size)}
+        mmr.get_root()
+        mmr.extend([0] * n_leaves)
+        mmr.get_root()
+        assert append_hash_count(mmr_size, n_leaves) == mmr._hasher.hash_count
+
+
+def test_split_perfect_subtrees():
+    assert split_perfect_subtrees(0, 11, 8) == [(0, 3), (8, 1), (10, 0)]
+    assert split_perfect_subtrees(0, 11, 2) == [(0, 2), (4, 2), (8, 1), (10, 0)]
+    # 6 leaves : the first sub tree is aligned on 2
+    assert split_perfect_subtrees(6, 12, 8) == [(0, 1), (2, 3), (10, 1)]
+    assert split_perfect_subtrees(5, 0, 8) == []
+
+
+@pytest.mark.parametrize("hasher_class", [PoseidonHasher, KeccakHasher])
+@pytest.mark.parametrize("initial_leaves", [0, 3, 8])
+def test_extend_parallel_matches_extend(monkeypatch, hasher_class, initial_leaves):
+    # Small sub trees to have several of them per extension.
+    monkeypatch.setattr(tools.py.mmr, "MIN_PARALLEL_SUBTREE_HEIGHT", 1)
+    leaves = [(i + 1) * 0xABCDEF for i in range(initial_leaves + 45)]
+    mmr, parallel = MMR(hasher_class()), MMR(hasher_class(), CompactNodeStore())
+    frontier = MMRFrontier(hasher_class())
+    for tree in (mmr, parallel, frontier):
+        tree.extend(leaves[:initial_leaves])
+    mmr.extend(leaves[initial_leaves:])
+    parallel.extend_parallel(leaves[initial_leaves:], max_workers=2)
+    frontier.extend_parallel(leaves[initial_leaves:], max_workers=2)
+    assert parallel.last_pos == mmr.last_pos == frontier.mmr_size - 1
+    assert [parallel.pos_hash[p] for p in range(mmr.last_pos + 1)] == [
+        mmr.pos_hash[p] for p in range(mmr.last_pos + 1)
+    ]
+    assert parallel.get_root() == frontier.get_root() == mmr.get_root()
+
+
+@pytest.mark.parametrize("hasher_class", [PoseidonHasher, KeccakHasher])
+@pytest.mark.parametrize("leaf_count", [1, 2, 7, 8, 19])
+def test_proofs(hasher_class, leaf_count):
+    mmr = MMR(hasher_class(), CompactNodeStore())
+    leaves = [(i + 1) * 0xFEDCBA for i in range(leaf_count)]
+    mmr.extend(leaves)
+    root, mmr_size = mmr.get_root(), mmr.last_pos + 1
+    proofs = mmr.get_proofs(range(leaf_count))
+    for leaf_index, leaf in enumerate(leaves):
+        proof = mmr.get_proof(leaf_index)
+        assert proof == proofs[leaf_index]
+        assert verify_proof(root, mmr_size, leaf, proof, hasher_class())
+        assert not verify_proof(root, mmr_size, leaf + 1, proof, hasher_class())
+        assert not verify_proof(root + 1, mmr_size, leaf, proof, hasher_class())
+        if leaf_count > 1:
+            assert not verify_proof(
+                root,
+                mmr_size,
+                leaf,
+                proof._replace(leaf_index=(leaf_index + 1) % leaf_count),
+                hasher_class(),
+            )
+    with pytest.raises(IndexError):
+        mmr.get_proof(leaf_count)
+
+
+@pytest.mark.parametrize("keccak_thread", [False, True])
+@pytest.mark.parametrize("initial_leaves", [1, 6, 16])
+def test_dual_frontier_matches_separate_mmrs(keccak_thread, initial_leaves):
+    poseidon_mmr, keccak_mmr = MMR(PoseidonHasher()), MMR(KeccakHasher())
+    poseidon_mmr.extend([i + 1 for i in range(initial_leaves)])
+    keccak_mmr.extend([i + 2 for i in range(initial_leaves)])
+    dual = DualMMRFrontier(
+        poseidon_mmr.get_peaks(),
+        keccak_mmr.get_peaks(),
+        poseidon_mmr.last_pos + 1,
+        keccak_thread=keccak_thread,
+    )
+    for batch_size in [1, 3, 0, 24]:
+        poseidon_leaves = [(i + 1) * 0x123 for i in range(batch_size)]
+        keccak_leaves = [(i + 1) * 0x456 for i in range(batch_size)]
+        poseidon_mmr.extend(poseidon_leaves)
+        keccak_mmr.extend(keccak_leaves)
+        dual.extend(poseidon_leaves, keccak_leaves)
+        assert dual.mmr_size == poseidon_mmr.last_pos + 1
+        assert dual.get_peaks() == (poseidon_mmr.get_peaks(), keccak_mmr.get_peaks())
+        assert dual.get_roots() == (poseidon_mmr.get_root(), keccak_mmr.get_root())
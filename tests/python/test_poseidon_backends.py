@@ -0,0 +1,40 @@
+import os
+import sys
+import subprocess
+from tools.py.poseidon_backends import (
+    PoseidonBackend,
+    REFERENCE_BACKEND,
+    available_backends,
+    get_poseidon_backend,
+    load_backend,
+    self_test,
+)
+
+
+def test_reference_backend_is_always_available():
+    assert REFERENCE_BACKEND in [backend.name for backend in available_backends()]
+    assert self_test(load_backend(REFERENCE_BACKEND))
+    assert self_test(get_poseidon_backend())
+    # The first passing backend by order of preference, not the fastest on this run.
+    assert get_poseidon_backend().name == available_backends()[0].name
+
+
+def test_self_test_rejects_wrong_backend():
+    reference = load_backend(REFERENCE_BACKEND)
+    wrong = reference._replace(name="wrong", hash_many=lambda values: 0)
+    assert not self_test(wrong)
+    failing = PoseidonBackend("failing", None, None, None)
+    assert not self_test(failing)
+
+
+def test_backend_is_not_selected_at_import():
+    # An unknown backend only fails once a hash is computed.
+    subprocess.run(
+        [sys.executable, "-c", "import tools.py.mmr, tools.make.prepare_inputs_api"],
+        env={
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(sys.path),
+            "POSEIDON_BACKEND": "unknown",
+        },
+        check=True,
+    )
@@ -0,0 +1,316 @@
+import os
+import sys
+import gzip
+import json
+import random
+import sqlite3
+import threading
+import subprocess
+import pytest
+from tools.py.mmr import leaf_count_to_mmr_size
+from tools.make.db import setup_db
+from tools.make.hashing_service import HashingService
+import tools.make.prepare_inputs_api as api
+from tools.make.prepare_inputs_api import ChunkFiles, prepare_full_chain_inputs
+from tools.make.run_manifest import MANIFEST_FILENAME
+
+N_BLOCKS = 120
+DATA_PATH = "src/single_chunk_processor/data/"
+
+
+@pytest.fixture
+def blocks_db(tmp_path, monkeypatch):
+    rng = random.Random(0)
+    conn = sqlite3.connect(tmp_path / "blocks.db")
+    setup_db(conn)
+    with conn:
+        conn.executemany(
+            "INSERT INTO blocks VALUES (?, ?)",
+            [(i, rng.randbytes(rng.randint(500, 650))) for i in range(N_BLOCKS)],
+        )
+    conn.close()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def run(**kwargs) -> tuple:
+    output = prepare_full_chain_inputs(
+        from_block_number_high=N_BLOCKS - 2, to_block_number_low=1, **kwargs
+    )
+    files = {}
+    for filename in sorted(os.listdir(DATA_PATH)):
+        if filename.startswith("blocks_"):
+            with open(DATA_PATH + filename, "rb") as f:
+                files[filename] = f.read()
+        os.remove(DATA_PATH + filename)
+    return output, files
+
+
+def test_pipelined_run_matches_sequential_run(blocks_db):
+    output, files = run(batch_size=25)
+    assert len(files) == 10
+    assert run(batch_size=25, pipelined=True) == (output, files)
+    assert run(dynamic=True) == run(dynamic=True, pipelined=True)
+
+
+def test_pipelined_run_stops_on_mmr_errors(blocks_db, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("MMR stage failed")
+
+    def fail_write(*args):
+        raise OSError("Disk full")
+
+    threads = threading.active_count()
+    monkeypatch.setattr(api, "extend_with_checkpoints", fail)
+    monkeypatch.setattr(ChunkFiles, "write", fail_write)
+    # The reader thread, blocked with chunks read ahead, is stopped and the write error
+    # does not hide the one of the MMR stage.
+    with pytest.raises(RuntimeError, match="MMR stage failed"):
+        run(batch_size=5, pipelined=True)
+    assert threading.active_count() == threads
+
+
+def test_block_hashes_cache(blocks_db, monkeypatch):
+    hashed = []
+    hash_blocks = HashingService.hash_blocks
+    monkeypatch.setattr(
+        HashingService,
+        "hash_blocks",
+        lambda self, blocks: hashed.extend(blocks) or hash_blocks(self, blocks),
+    )
+    output, files = run(batch_size=25, cache_hashes=False)
+    assert run(batch_size=25) == (output, files)
+    assert len(hashed) == 2 * (N_BLOCKS - 2)
+
+    # Every hash is cached : re-preparing with another batch size hashes nothing.
+    hashed.clear()
+    assert run(batch_size=40)[0] == output
+    assert hashed == []
+
+    conn = sqlite3.connect("blocks.db")
+    with conn:
+        conn.execute(
+            "UPDATE block_hashes SET keccak = ? WHERE block_number = 7", (bytes(32),)
+        )
+    conn.close()
+    with pytest.raises(ValueError, match="block 7"):
+        run(batch_size=25, verify_hash_sample=N_BLOCKS)
+
+
+def test_two_phase_run_matches_sequential_run(blocks_db):
+    output, files = run(batch_size=25, cache_hashes=False)
+    assert run(batch_size=25, two_phase=True) == (output, files)
+    assert run(dynamic=True, two_phase=True) == run(dynamic=True)
+    with pytest.raises(ValueError, match="cache_hashes=False"):
+        run(batch_size=25, two_phase=True, cache_hashes=False)
+
+
+def pop_checkpoints() -> list:
+    conn = sqlite3.connect("blocks.db")
+    with conn:
+        checkpoints = conn.execute(
+            "SELECT * FROM mmr_checkpoints ORDER BY block_number"
+        ).fetchall()
+        conn.execute("DELETE FROM mmr_checkpoints")
+    conn.close()
+    return checkpoints
+
+
+def test_streaming_run_matches_sequential_run(blocks_db, monkeypatch):
+    # Slices of 7 blocks
+    monkeypatch.setattr(api, "STREAMING_BYTES_PER_BLOCK", 1)
+    output, files = run(batch_size=50, checkpoint_interval=20)
+    checkpoints = pop_checkpoints()
+    assert run(
+        batch_size=50, checkpoint_interval=20, streaming=True, memory_budget=7
+    ) == (output, files)
+    # Checkpoints at the chunk ends and the multiples of 20, not at the slices ends.
+    assert pop_checkpoints() == checkpoints
+    assert [row[4] for row in checkpoints] == [0, 18, 20, 40, 60, 68, 80, 100]
+    assert run(dynamic=True, streaming=True, memory_budget=7) == run(dynamic=True)
+
+
+def test_persistent_mmrs_continue_from_their_next_block(blocks_db):
+    output, _ = run(batch_size=25)
+    prepare_full_chain_inputs(
+        from_block_number_high=N_BLOCKS - 2,
+        to_block_number_low=60,
+        batch_size=25,
+        persistent_mmr=True,
+    )
+    # The blocks already appended are not appended again.
+    with pytest.raises(ValueError, match="waiting for block 59"):
+        run(batch_size=25, persistent_mmr=True)
+    assert (
+        prepare_full_chain_inputs(
+            from_block_number_high=59,
+            to_block_number_low=1,
+            batch_size=25,
+            persistent_mmr=True,
+        )
+        == output
+    )
+
+
+def test_resume_from_checkpoints_of_the_same_run(blocks_db):
+    output, _ = run(batch_size=25, checkpoint_interval=20)
+    # Checkpoints of the same blocks, appended to another initial state.
+    other_output, _ = run(batch_size=25, checkpoint_interval=20, initial_params=output)
+    for initial_params, expected in ((None, output), (output, other_output)):
+        assert (
+            prepare_full_chain_inputs(
+                from_block_number_high=50,
+                to_block_number_low=1,
+                batch_size=25,
+                initial_params=initial_params,
+                resume=True,
+            )
+            == expected
+        )
+
+
+def test_json_formats(blocks_db):
+    output, files = run(batch_size=50)
+    assert not any(b" " in content or b"\n" in content for content in files.values())
+    decoded = {filename: json.loads(content) for filename, content in files.items()}
+
+    indented_output, indented_files = run(batch_size=50, compact_json=False)
+    assert indented_output == output
+    assert {
+        filename: json.loads(content) for filename, content in indented_files.items()
+    } == decoded
+
+    compressed_output, compressed_files = run(batch_size=50, compress_json=True)
+    assert compressed_output == output
+    assert {
+        filename.removesuffix(".gz"): json.loads(gzip.decompress(content))
+        for filename, content in compressed_files.items()
+    } == decoded
+
+
+@pytest.mark.parametrize(
+    "mode", [{}, {"pipelined": True}, {"two_phase": True}, {"streaming": True}]
+)
+def test_resume_from_manifest(blocks_db, monkeypatch, mode):
+    output, files = run(batch_size=25)
+
+    # Interrupted while writing the input file of the 3rd chunk
+    written = []
+    write = ChunkFiles.write
+
+    def failing_write(self, high, low, kind, data):
+        if len(written) == 4:
+            raise KeyboardInterrupt
+        written.append(kind)
+        write(self, high, low, kind, data)
+
+    monkeypatch.setattr(ChunkFiles, "write", failing_write)
+    with pytest.raises(KeyboardInterrupt):
+        prepare_full_chain_inputs(
+            from_block_number_high=N_BLOCKS - 2, to_block_number_low=1, batch_size=25
+        )
+    monkeypatch.setattr(ChunkFiles, "write", write)
+    with open(DATA_PATH + MANIFEST_FILENAME) as f:
+        assert len(f.read().splitlines()) == 1 + 2
+
+    # Only the remaining chunks go through the MMRs
+    extended = []
+    save_checkpoint = api.save_checkpoint
+    monkeypatch.setattr(
+        api,
+        "save_checkpoint",
+        lambda *args: extended.append(args[2]) or save_checkpoint(*args),
+    )
+    assert run(batch_size=25, resume_manifest=True, **mode) == (output, files)
+    assert extended == [43, 18, 0]
+
+
+def test_resume_from_manifest_checks_files_and_run(blocks_db):
+    output, files = run(batch_size=25)
+    prepare_full_chain_inputs(
+        from_block_number_high=N_BLOCKS - 2, to_block_number_low=1, batch_size=25
+    )
+    with pytest.raises(ValueError, match="another run"):
+        prepare_full_chain_inputs(
+            from_block_number_high=N_BLOCKS - 2,
+            to_block_number_low=1,
+            batch_size=30,
+            resume_manifest=True,
+        )
+    # A modified file : the chunks from its own are prepared again
+    with open(DATA_PATH + "blocks_68_44_output.json", "w") as f:
+        f.write("{}")
+    assert run(batch_size=25, resume_manifest=True) == (output, files)
+
+
+# Prepares one chunk of every block of blocks.db in streaming mode and prints the increase of the peak
+# RSS over the one after the imports, of the process and of its hashing workers. Poseidon (in the MMR
+# and in the workers, forked with the stand-in) uses a cheap stand-in hash to keep the run short.
+STREAMING_RSS_SCRIPT = """
+import resource, sys
+import tools.py.mmr as mmr
+import tools.make.hashing_service as hashing_service
+from tools.py.poseidon_backends import PoseidonBackend, STARK_PRIME
+from tools.make.prepare_inputs_api import prepare_full_chain_inputs
+
+h = lambda x, y: (31 * x + y + 1) % STARK_PRIME
+stand_in = lambda: PoseidonBackend(
+    "stand-in", h, lambda x: h(x, 0), lambda values: sum(values) % STARK_PRIME
+)
+mmr.get_poseidon_backend = hashing_service.get_poseidon_backend = stand_in
+peak_rss = lambda who: resource.getrusage(who).ru_maxrss * 1024
+baseline = peak_rss(resource.RUSAGE_SELF)
+prepare_full_chain_inputs(
+    from_block_number_high=int(sys.argv[1]) - 2,
+    to_block_number_low=0,
+    batch_size=int(sys.argv[1]),
+    streaming=True,
+    memory_budget=int(sys.argv[2]),
+)
+print(peak_rss(resource.RUSAGE_SELF) - baseline)
+print(peak_rss(resource.RUSAGE_CHILDREN) - baseline)
+"""
+# Memory used by the streaming mode whatever the slice size (SQLite cache, hashing service, JSON writer).
+STREAMING_RSS_OVERHEAD = 16 * 2**20
+
+
+@pytest.mark.parametrize(
+    "n_blocks",
+    [
+        10**5,
+        pytest.param(
+            10**6,
+            marks=pytest.mark.skipif(
+                not os.getenv("RUN_SLOW_TESTS"),
+                reason="prepares 10^6 blocks, set RUN_SLOW_TESTS=1 to run it",
+            ),
+        ),
+    ],
+)
+def test_streaming_peak_rss_is_bounded(tmp_path, n_blocks):
+    memory_budget = 32 * 2**20
+    rng = random.Random(0)
+    conn = sqlite3.connect(tmp_path / "blocks.db")
+    setup_db(conn)
+    with conn:
+        conn.executemany(
+            "INSERT INTO blocks VALUES (?, ?)",
+            ((i, rng.randbytes(rng.randint(500, 650))) for i in range(n_blocks)),
+        )
+    conn.close()
+
+    result = subprocess.run(
+        [sys.executable, "-c", STREAMING_RSS_SCRIPT, str(n_blocks), str(memory_budget)],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    peak_rss, workers_peak_rss = map(int, result.stdout.splitlines()[-2:])
+    assert peak_rss <= memory_budget + STREAMING_RSS_OVERHEAD
+    assert workers_peak_rss <= memory_budget + STREAMING_RSS_OVERHEAD
+
+    with open(tmp_path / DATA_PATH / f"blocks_{n_blocks - 2}_0_output.json") as f:
+        chunk_output = json.load(f)
+    assert chunk_output["new_mmr_len"] == leaf_count_to_mmr_size(n_blocks)
@@ -0,0 +1,164 @@
+import gzip
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tools.py.utils import (
+    HeaderWords,
+    RpcClient,
+    rpc_request,
+    plain_json_file,
+    read_json,
+    bytes_to_8_bytes_chunks,
+    bytes_to_8_bytes_chunks_little,
+    headers_to_8_bytes_chunks_little,
+    write_to_json,
+    write_to_json_streaming,
+)
+
+
+def reference_chunks(input_bytes, byteorder):
+    return [
+        int.from_bytes(input_bytes[i : i + 8], byteorder=byteorder)
+        for i in range(0, len(input_bytes), 8)
+    ]
+
+
+def test_8_bytes_chunks():
+    rng = random.Random(0)
+    headers = [rng.randbytes(n) for n in range(41)] + [b"\xff" * 13]
+    for header in headers:
+        assert bytes_to_8_bytes_chunks_little(header) == reference_chunks(
+            header, "little"
+        )
+        assert bytes_to_8_bytes_chunks(header) == reference_chunks(header, "big")
+        assert bytes_to_8_bytes_chunks_little(bytearray(header)) == reference_chunks(
+            header, "little"
+        )
+    assert headers_to_8_bytes_chunks_little(headers) == [
+        reference_chunks(header, "little") for header in headers
+    ]
+    # The tail word is not shifted : 0x01 02 -> 0x0201 little, 0x0102 big.
+    assert bytes_to_8_bytes_chunks_little(bytes(8) + b"\x01\x02") == [0, 0x0201]
+    assert bytes_to_8_bytes_chunks(bytes(8) + b"\x01\x02") == [0, 0x0102]
+
+
+def test_header_words():
+    rng = random.Random(0)
+    headers = [rng.randbytes(n) for n in range(41)] + [b"\xff" * 13]
+    header_words = HeaderWords(headers[:20])
+    header_words.extend(headers[20:])
+    assert len(header_words) == len(headers)
+    assert list(header_words) == headers_to_8_bytes_chunks_little(headers)
+    assert header_words[-1] == reference_chunks(headers[-1], "little")
+    assert header_words.words.itemsize == 8
+
+
+def test_write_to_json_streaming(tmp_path):
+    rng = random.Random(0)
+    headers = [rng.randbytes(rng.randint(0, 40)) for _ in range(10)]
+    data = {
+        "mmr_last_len": 3,
+        "keccak_mmr_last_peaks": [[1, 2], [3, 4]],
+        "empty": [],
+        "block_headers_array": headers_to_8_bytes_chunks_little(headers),
+        "bytes_len_array": [len(header) for header in headers],
+    }
+    write_to_json(tmp_path / "expected.json", data)
+    for streamed in (
+        data,
+        {**data, "block_headers_array": HeaderWords(headers)},
+        {
+            **data,
+            "empty": iter([]),
+            "block_headers_array": iter(
+                [HeaderWords(headers[:4]), HeaderWords(headers[4:])]
+            ),
+            "bytes_len_array": iter(data["bytes_len_array"]),
+        },
+    ):
+        write_to_json_streaming(tmp_path / "streamed.json", streamed)
+        assert (tmp_path / "streamed.json").read_text() == (
+            tmp_path / "expected.json"
+        ).read_text()
+
+
+def test_compact_and_compressed_json(tmp_path):
+    headers = [bytes(range(n)) for n in (0, 7, 8, 20)]
+    data = {
+        "mmr_last_len": 3,
+        "keccak_mmr_last_peaks": [[1, 2], [3, 4]],
+        "empty": [],
+        "block_headers_array": headers_to_8_bytes_chunks_little(headers),
+    }
+    streamed = {**data, "block_headers_array": HeaderWords(headers), "empty": iter([])}
+    write_to_json_streaming(tmp_path / "compact.json", streamed, compact=True)
+    assert (tmp_path / "compact.json").read_text() == json.dumps(
+        data, separators=(",", ":")
+    )
+    write_to_json_streaming(tmp_path / "empty.json", {}, compact=True)
+    assert read_json(tmp_path / "empty.json") == {}
+
+    for compact in (False, True):
+        path = str(tmp_path / "data.json.gz")
+        write_to_json_streaming(path, {**data, "empty": iter([])}, compact)
+        assert read_json(path) == data
+        with plain_json_file(path) as plain:
+            with open(plain) as f:
+                assert json.load(f) == data
+        assert not (tmp_path / plain).exists()
+
+
+class EchoRpcHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    encodings = []
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.encodings.append(self.headers.get("Content-Encoding"))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        calls = json.loads(body)
+        response = json.dumps(
+            [{"jsonrpc": "2.0", "id": c["id"], "result": c["params"]} for c in calls]
+        ).encode()
+        self.send_response(200)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            response = gzip.compress(response)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *_):
+        pass
+
+
+def test_rpc_client():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EchoRpcHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    calls = [
+        {"jsonrpc": "2.0", "method": "echo", "params": [i, "x" * 100], "id": i}
+        for i in range(50)
+    ]
+    expected = [
+        {"jsonrpc": "2.0", "id": i, "result": [i, "x" * 100]} for i in range(50)
+    ]
+    try:
+        with RpcClient(url) as client:
+            for _ in range(5):
+                assert client.request(calls) == expected
+        # The connection is kept alive across requests.
+        assert EchoRpcHandler.connections == 1
+        with RpcClient(url, compress_requests=True) as client:
+            assert client.request(calls) == expected
+        assert EchoRpcHandler.encodings == [None] * 5 + ["gzip"]
+        assert rpc_request(url, calls) == expected
+    finally:
+        server.shutdown()
@@ -0,0 +1,54 @@
+#!venv/bin/python3
+"""
+Benchmark of the chunk input headers words kept as HeaderWords and written by write_to_json_streaming,
+against lists of Python ints written by write_to_json : memory held and time to build and write.
+Usage : python tools/bench/bench_chunk_input_serialization.py [n_headers]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import tracemalloc
+from tools.py.utils import (
+    HeaderWords,
+    headers_to_8_bytes_chunks_little,
+    write_to_json,
+    write_to_json_streaming,
+)
+
+N_HEADERS = 20000
+
+
+def measure(build, write, headers, path) -> tuple:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    chunk_input = {
+        "block_headers_array": build(headers),
+        "bytes_len_array": [len(header) for header in headers],
+    }
+    t1 = time.perf_counter()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    write(path, chunk_input)
+    return memory, t1 - t0, time.perf_counter() - t1
+
+
+if __name__ == "__main__":
+    n_headers = int(sys.argv[1]) if len(sys.argv) > 1 else N_HEADERS
+    headers = [random.randbytes(random.randint(500, 650)) for _ in range(n_headers)]
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for name, build, write in (
+            ("lists", headers_to_8_bytes_chunks_little, write_to_json),
+            ("HeaderWords", HeaderWords, write_to_json_streaming),
+        ):
+            path = os.path.join(directory, f"{name}.json")
+            memory, t_build, t_write = measure(build, write, headers, path)
+            with open(path, "rb") as f:
+                results[name] = f.read()
+            print(
+                f"{name:>12} : {memory / 2**20:.1f} MiB held | build {t_build:.3f}s | write {t_write:.3f}s"
+            )
+        assert results["lists"] == results["HeaderWords"]
@@ -0,0 +1,49 @@
+#!venv/bin/python3
+"""
+Benchmark of the persistent HashingService against one process pool per chunk mapping
+compute_hashes block by block.
+Usage : python tools/bench/bench_hashing_service.py [n_chunks] [blocks_per_chunk]
+"""
+
+import sys
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor
+from tools.make.hashing_service import HashingService, compute_hashes
+
+N_CHUNKS = 10
+BLOCKS_PER_CHUNK = 500
+
+
+def random_chunk(n_blocks: int) -> list:
+    return [random.randbytes(random.randint(500, 650)) for _ in range(n_blocks)]
+
+
+def pool_per_chunk(chunks: list):
+    for blocks in chunks:
+        with ProcessPoolExecutor() as executor:
+            list(executor.map(compute_hashes, blocks))
+
+
+def persistent_service(chunks: list) -> HashingService:
+    with HashingService() as hashing:
+        for blocks in chunks:
+            hashing.hash_blocks(blocks)
+    return hashing
+
+
+if __name__ == "__main__":
+    n_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else N_CHUNKS
+    blocks_per_chunk = int(sys.argv[2]) if len(sys.argv) > 2 else BLOCKS_PER_CHUNK
+    chunks = [random_chunk(blocks_per_chunk) for _ in range(n_chunks)]
+    t0 = time.perf_counter()
+    pool_per_chunk(chunks)
+    t_pool = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    hashing = persistent_service(chunks)
+    t_service = time.perf_counter() - t0
+    print(f"{n_chunks} chunks of {blocks_per_chunk} blocks")
+    print(
+        f"pool per chunk {t_pool:.3f}s | persistent service {t_service:.3f}s | speedup {t_pool / t_service:.2f}x"
+    )
+    print(hashing.report())
@@ -0,0 +1,46 @@
+#!venv/bin/python3
+"""
+Benchmark of the struct based bytes_to_8_bytes_chunks(_little) against the slice and int.from_bytes loop.
+Usage : python tools/bench/bench_header_chunking.py [n_headers]
+"""
+
+import sys
+import time
+import random
+from tools.py.utils import (
+    bytes_to_8_bytes_chunks,
+    bytes_to_8_bytes_chunks_little,
+    headers_to_8_bytes_chunks_little,
+)
+
+N_HEADERS = 100000
+
+
+def legacy_chunks(input_bytes, byteorder):
+    byte_chunks = [input_bytes[i : i + 8] for i in range(0, len(input_bytes), 8)]
+    return [int.from_bytes(chunk, byteorder=byteorder) for chunk in byte_chunks]
+
+
+def timed(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    n_headers = int(sys.argv[1]) if len(sys.argv) > 1 else N_HEADERS
+    headers = [random.randbytes(random.randint(500, 650)) for _ in range(n_headers)]
+    for byteorder, fn in (
+        ("little", bytes_to_8_bytes_chunks_little),
+        ("big", bytes_to_8_bytes_chunks),
+    ):
+        assert [fn(h) for h in headers[:1000]] == [
+            legacy_chunks(h, byteorder) for h in headers[:1000]
+        ]
+        t_legacy = timed(lambda: [legacy_chunks(h, byteorder) for h in headers])
+        t_new = timed(lambda: [fn(h) for h in headers])
+        print(
+            f"{byteorder:>6} : legacy {t_legacy:.3f}s | struct {t_new:.3f}s | speedup {t_legacy / t_new:.2f}x"
+        )
+    t_batch = timed(lambda: headers_to_8_bytes_chunks_little(headers))
+    print(f" batch : headers_to_8_bytes_chunks_little {t_batch:.3f}s")
@@ -0,0 +1,79 @@
+#!venv/bin/python3
+"""
+Benchmark of the chunk files formats on a chunk of random headers : json.dump(indent=4) of lists
+(write_to_json), against write_to_json_streaming indented, compact, and compact and gzip compressed.
+Reports the write time, the file size and the time to load the file back (read_json).
+Usage : python tools/bench/bench_json_serialization.py [n_blocks]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+from tools.py.utils import (
+    HeaderWords,
+    headers_to_8_bytes_chunks_little,
+    read_json,
+    write_to_json,
+    write_to_json_streaming,
+)
+
+N_BLOCKS = 1700
+REPEATS = 5
+
+
+def chunk_input(headers: list, header_words) -> dict:
+    return {
+        "mmr_last_root_poseidon": random.getrandbits(251),
+        "mmr_last_len": 2 * 10**7,
+        "poseidon_mmr_last_peaks": [random.getrandbits(251) for _ in range(12)],
+        "keccak_mmr_last_peaks": [
+            [random.getrandbits(128), random.getrandbits(128)] for _ in range(12)
+        ],
+        "block_headers_array": header_words,
+        "bytes_len_array": [len(header) for header in headers],
+    }
+
+
+def timed(fn) -> float:
+    """Best time of REPEATS runs."""
+    times = []
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+if __name__ == "__main__":
+    n_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else N_BLOCKS
+    headers = [random.randbytes(random.randint(500, 650)) for _ in range(n_blocks)]
+    lists_input = chunk_input(headers, headers_to_8_bytes_chunks_little(headers))
+    compact_input = {**lists_input, "block_headers_array": HeaderWords(headers)}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, filename, write in (
+            ("write_to_json", "indent.json", write_to_json),
+            (
+                "streaming indented",
+                "streaming.json",
+                lambda path, data: write_to_json_streaming(path, compact_input),
+            ),
+            (
+                "streaming compact",
+                "compact.json",
+                lambda path, data: write_to_json_streaming(path, compact_input, True),
+            ),
+            (
+                "streaming compact gzip",
+                "compact.json.gz",
+                lambda path, data: write_to_json_streaming(path, compact_input, True),
+            ),
+        ):
+            path = os.path.join(directory, filename)
+            t_write = timed(lambda: write(path, lists_input))
+            t_read = timed(lambda: read_json(path))
+            assert read_json(path) == lists_input
+            print(
+                f"{name:>22} : write {t_write:.3f}s | {os.path.getsize(path) / 2**20:6.2f} MiB | load {t_read:.3f}s"
+            )
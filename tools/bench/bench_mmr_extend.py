@@ -0,0 +1,47 @@
+#!venv/bin/python3
+"""
+Benchmark of MMR.extend / MMRFrontier.extend (level-batched hashing) against repeated add.
+Usage : python tools/bench/bench_mmr_extend.py [n_leaves]
+"""
+
+import sys
+import time
+import random
+from tools.py.mmr import MMR, MMRFrontier, PoseidonHasher, KeccakHasher
+
+N_LEAVES = 5000
+# Size of the MMR before the extension, close to a mainnet sized MMR.
+INITIAL_LEAF_COUNT = 1000
+
+
+def timed(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def bench(hasher_class, mmr_class, n_leaves: int):
+    initial = [random.getrandbits(250) for _ in range(INITIAL_LEAF_COUNT)]
+    leaves = [random.getrandbits(250) for _ in range(n_leaves)]
+    mmr_add, mmr_extend = mmr_class(hasher_class()), mmr_class(hasher_class())
+    mmr_add.extend(initial)
+    mmr_extend.extend(initial)
+
+    def add_all():
+        for leaf in leaves:
+            mmr_add.add(leaf)
+
+    t_add = timed(add_all)
+    t_extend = timed(lambda: mmr_extend.extend(leaves))
+    assert mmr_add.get_root() == mmr_extend.get_root()
+    print(
+        f"{hasher_class.__name__:>14} {mmr_class.__name__:>11} : add {t_add:.3f}s | extend {t_extend:.3f}s | speedup {t_add / t_extend:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    n_leaves = int(sys.argv[1]) if len(sys.argv) > 1 else N_LEAVES
+    print(f"Appending {n_leaves} leaves to an MMR of {INITIAL_LEAF_COUNT} leaves")
+    for hasher_class in (KeccakHasher, PoseidonHasher):
+        for mmr_class in (MMR, MMRFrontier):
+            bench(hasher_class, mmr_class, n_leaves)
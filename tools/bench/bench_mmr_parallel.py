@@ -0,0 +1,48 @@
+#!venv/bin/python3
+"""
+Benchmark of MMR.extend_parallel / MMRFrontier.extend_parallel (perfect sub trees built in a
+process pool) against the single process extend.
+Usage : python tools/bench/bench_mmr_parallel.py [n_leaves] [max_workers]
+"""
+
+import os
+import sys
+import time
+import random
+from tools.py.mmr import MMR, MMRFrontier, PoseidonHasher, KeccakHasher
+
+N_LEAVES = 2**16
+# Size of the MMR before the extension, not aligned on a large power of 2.
+INITIAL_LEAF_COUNT = 1000
+
+
+def timed(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def bench(hasher_class, mmr_class, n_leaves: int, max_workers: int):
+    initial = [random.getrandbits(250) for _ in range(INITIAL_LEAF_COUNT)]
+    leaves = [random.getrandbits(250) for _ in range(n_leaves)]
+    mmr_extend, mmr_parallel = mmr_class(hasher_class()), mmr_class(hasher_class())
+    mmr_extend.extend(initial)
+    mmr_parallel.extend(initial)
+
+    t_extend = timed(lambda: mmr_extend.extend(leaves))
+    t_parallel = timed(lambda: mmr_parallel.extend_parallel(leaves, max_workers))
+    assert mmr_extend.get_root() == mmr_parallel.get_root()
+    print(
+        f"{hasher_class.__name__:>14} {mmr_class.__name__:>11} : extend {t_extend:.3f}s | extend_parallel {t_parallel:.3f}s | speedup {t_extend / t_parallel:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    n_leaves = int(sys.argv[1]) if len(sys.argv) > 1 else N_LEAVES
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    print(
+        f"Appending {n_leaves} leaves to an MMR of {INITIAL_LEAF_COUNT} leaves with {max_workers} workers"
+    )
+    for hasher_class in (KeccakHasher, PoseidonHasher):
+        for mmr_class in (MMR, MMRFrontier):
+            bench(hasher_class, mmr_class, n_leaves, max_workers)
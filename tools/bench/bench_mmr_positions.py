@@ -0,0 +1,123 @@
+#!venv/bin/python3
+"""
+Micro-benchmarks of the MMR position arithmetic in tools/py/mmr.py against the
+bit by bit loops it replaced (kept below as legacy_* for reference).
+Usage : python tools/bench/bench_mmr_positions.py [n_calls]
+"""
+
+import sys
+import time
+from typing import List, Tuple
+from tools.py.mmr import (
+    get_peaks,
+    left_peak_height_pos,
+    leaf_index_to_pos,
+    tree_pos_height,
+    trailing_zeros,
+    MMR,
+    MockedHasher,
+)
+
+N_CALLS = 10**7
+# Mainnet sized MMR, ~18M leaves.
+BASE_LEAF_INDEX = 18_000_000
+
+
+def legacy_tree_pos_height(pos: int) -> int:
+    pos += 1
+    bit_length = pos.bit_length()
+    while not (1 << bit_length) - 1 == pos:
+        most_significant_bits = 1 << bit_length - 1
+        pos -= most_significant_bits - 1
+        bit_length = pos.bit_length()
+    return bit_length - 1
+
+
+def legacy_left_peak_height_pos(mmr_size: int) -> Tuple[int, int]:
+    height = 0
+    prev_pos = 0
+    pos = (1 << height + 1) - 2
+    while pos < mmr_size:
+        height += 1
+        prev_pos = pos
+        pos = (1 << height + 1) - 2
+    return (height - 1, prev_pos)
+
+
+def legacy_get_peaks(mmr_size) -> List[int]:
+    def get_right_peak(height, pos, mmr_size):
+        pos += (2 << height) - 1
+        while pos > mmr_size - 1:
+            height -= 1
+            if height < 0:
+                return (height, None)
+            pos -= 2 << height
+        return (height, pos)
+
+    poss = []
+    height, pos = legacy_left_peak_height_pos(mmr_size)
+    poss.append(pos)
+    while height > 0:
+        height, pos = get_right_peak(height, pos, mmr_size)
+        if height >= 0:
+            poss.append(pos)
+    return poss
+
+
+def legacy_merges_after_leaf(leaf_index: int) -> int:
+    # What MMR.add used to compute : one tree_pos_height call per merge.
+    last_pos, height = leaf_index_to_pos(leaf_index), 0
+    while legacy_tree_pos_height(last_pos + 1) > height:
+        last_pos += 1
+        height += 1
+    return height
+
+
+def merges_after_leaf(leaf_index: int) -> int:
+    # MMR.add tracks its leaf count.
+    return trailing_zeros(leaf_index + 1)
+
+
+def timeit(fn, args) -> float:
+    t0 = time.perf_counter()
+    for arg in args:
+        fn(arg)
+    return time.perf_counter() - t0
+
+
+def bench(name, legacy_fn, fn, args):
+    assert all(
+        legacy_fn(args[i]) == fn(args[i]) for i in range(1000)
+    ), f"{name} mismatch"
+    t_legacy = timeit(legacy_fn, args)
+    t_new = timeit(fn, args)
+    print(
+        f"{name:>22} : legacy {t_legacy:8.2f}s | new {t_new:8.2f}s | speedup {t_legacy / t_new:5.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    n_calls = int(sys.argv[1]) if len(sys.argv) > 1 else N_CALLS
+    leaf_positions = [leaf_index_to_pos(BASE_LEAF_INDEX + i) for i in range(n_calls)]
+    print(f"{n_calls} calls per function around leaf index {BASE_LEAF_INDEX}")
+    bench("tree_pos_height", legacy_tree_pos_height, tree_pos_height, leaf_positions)
+    bench(
+        "left_peak_height_pos",
+        legacy_left_peak_height_pos,
+        left_peak_height_pos,
+        leaf_positions,
+    )
+    # Successive calls on a handful of sizes, as done when computing roots and batch sizes.
+    sizes = [leaf_positions[i % 64] for i in range(n_calls)]
+    bench("get_peaks (repeated)", legacy_get_peaks, get_peaks, sizes)
+    bench("get_peaks (distinct)", legacy_get_peaks, get_peaks, leaf_positions)
+    leaf_indexes = range(BASE_LEAF_INDEX, BASE_LEAF_INDEX + n_calls)
+    bench("merges per add", legacy_merges_after_leaf, merges_after_leaf, leaf_indexes)
+
+    t0 = time.perf_counter()
+    mmr = MMR(MockedHasher())
+    for _ in range(min(n_calls, 10**6)):
+        mmr.add(0)
+    print(
+        f"MMR.add : {(time.perf_counter() - t0) / min(n_calls, 10**6) * 1e6:.3f}us/leaf"
+    )
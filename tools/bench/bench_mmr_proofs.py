@@ -0,0 +1,55 @@
+#!venv/bin/python3
+"""
+Throughput of MMR inclusion proofs generation (get_proof / get_proofs) and verification (verify_proof).
+Usage : python tools/bench/bench_mmr_proofs.py [n_proofs] [n_leaves]
+"""
+
+import sys
+import time
+import random
+from tools.py.mmr import (
+    MMR,
+    CompactNodeStore,
+    PoseidonHasher,
+    KeccakHasher,
+    verify_proof,
+)
+
+N_PROOFS = 100_000
+N_LEAVES = 2**17 + 2**12 + 5
+
+
+def bench(hasher_class, n_proofs: int, n_leaves: int):
+    mmr = MMR(hasher_class(), CompactNodeStore())
+    leaves = [random.getrandbits(250) for _ in range(n_leaves)]
+    mmr.extend(leaves)
+    root, mmr_size = mmr.get_root(), mmr.last_pos + 1
+    indexes = [random.randrange(n_leaves) for _ in range(n_proofs)]
+
+    t0 = time.perf_counter()
+    for i in indexes:
+        mmr.get_proof(i)
+    t_single = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    proofs = mmr.get_proofs(sorted(indexes))
+    t_batch = time.perf_counter() - t0
+
+    hasher = hasher_class()
+    t0 = time.perf_counter()
+    assert all(
+        verify_proof(root, mmr_size, leaves[proof.leaf_index], proof, hasher)
+        for proof in proofs
+    )
+    t_verify = time.perf_counter() - t0
+    print(
+        f"{hasher_class.__name__:>14} : get_proof {n_proofs / t_single:9.0f}/s | get_proofs {n_proofs / t_batch:9.0f}/s | verify_proof {n_proofs / t_verify:9.0f}/s"
+    )
+
+
+if __name__ == "__main__":
+    n_proofs = int(sys.argv[1]) if len(sys.argv) > 1 else N_PROOFS
+    n_leaves = int(sys.argv[2]) if len(sys.argv) > 2 else N_LEAVES
+    print(f"{n_proofs} proofs on an MMR of {n_leaves} leaves")
+    for hasher_class in (KeccakHasher, PoseidonHasher):
+        bench(hasher_class, n_proofs, n_leaves)
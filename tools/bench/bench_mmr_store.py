@@ -0,0 +1,81 @@
+#!venv/bin/python3
+"""
+Benchmark of the MMR node stores : plain dict vs CompactNodeStore.
+Measures the time of MMR.add / MMR.get_peaks and the memory held by the nodes.
+Usage : python tools/bench/bench_mmr_store.py [n_leaves]
+"""
+
+import sys
+import time
+import tracemalloc
+from tools.py.mmr import MMR, CompactNodeStore
+
+N_LEAVES = 1_000_000
+# Arbitrary 256 bits values, representative of block hashes.
+LEAF = (1 << 255) + 0xDEADBEEF
+
+
+class CountingHasher:
+    """
+    Cheap hasher returning distinct 256 bits values, so that the stores hold
+    realistic nodes while the hash function itself stays out of the measure.
+    """
+
+    def __init__(self):
+        self.hash_count = 0
+
+    def update(self, _):
+        pass
+
+    def digest(self) -> int:
+        self.hash_count += 1
+        return LEAF - self.hash_count
+
+
+def build(n_leaves: int, store_factory) -> MMR:
+    mmr = MMR(CountingHasher(), store_factory())
+    for i in range(n_leaves):
+        mmr.add(LEAF + i)
+    return mmr
+
+
+def run(n_leaves: int, store_factory) -> dict:
+    t0 = time.perf_counter()
+    mmr = build(n_leaves, store_factory)
+    t_add = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(10_000):
+        mmr.get_peaks()
+    t_peaks = time.perf_counter() - t0
+    del mmr
+
+    # Memory is measured on a separate build, tracemalloc slows down allocations.
+    tracemalloc.start()
+    mmr = build(n_leaves, store_factory)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "add_us": t_add / n_leaves * 1e6,
+        "get_peaks_us": t_peaks / 10_000 * 1e6,
+        "memory_mb": memory / 2**20,
+        "n_nodes": mmr.last_pos + 1,
+    }
+
+
+if __name__ == "__main__":
+    n_leaves = int(sys.argv[1]) if len(sys.argv) > 1 else N_LEAVES
+    mmr_size = 2 * n_leaves - bin(n_leaves).count("1")
+    results = {
+        "dict": run(n_leaves, dict),
+        "compact": run(n_leaves, CompactNodeStore),
+        "compact (reserved)": run(n_leaves, lambda: CompactNodeStore(mmr_size)),
+    }
+    print(f"{n_leaves} leaves, {results['dict']['n_nodes']} nodes")
+    for name, r in results.items():
+        print(
+            f"{name:>18} : add {r['add_us']:.3f}us/leaf | get_peaks {r['get_peaks_us']:.3f}us | memory {r['memory_mb']:.1f}MB"
+        )
+    print(
+        f"Memory ratio dict/compact (reserved) : {results['dict']['memory_mb'] / results['compact (reserved)']['memory_mb']:.1f}x"
+    )
@@ -0,0 +1,56 @@
+#!venv/bin/python3
+"""
+Benchmark of the installed Poseidon backends (see tools/py/poseidon_backends.py) on block header
+sized inputs (hash_many, as in compute_hashes) and on pairs (hash, as in MMR merges).
+Usage : python tools/bench/bench_poseidon_backends.py [n_headers]
+"""
+
+import sys
+import time
+import random
+from tools.py.poseidon_backends import available_backends
+from tools.py.utils import bytes_to_8_bytes_chunks_little
+
+N_HEADERS = 1000
+# Mainnet RLP encoded headers are between ~500 (pre London) and ~620 bytes.
+HEADER_SIZES = (508, 540, 583, 620)
+STARK_PRIME = (
+    3618502788666131213697322783095070105623107215331596699973092056135872020481
+)
+
+
+def bench(backend, headers: list, pairs: list):
+    t0 = time.perf_counter()
+    for words in headers:
+        backend.hash_many(words)
+    t_headers = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for x, y in pairs:
+        backend.hash(x, y)
+    t_pairs = time.perf_counter() - t0
+    return len(headers) / t_headers, len(pairs) / t_pairs
+
+
+if __name__ == "__main__":
+    n_headers = int(sys.argv[1]) if len(sys.argv) > 1 else N_HEADERS
+    rng = random.Random(0)
+    headers = [
+        bytes_to_8_bytes_chunks_little(
+            rng.randbytes(HEADER_SIZES[i % len(HEADER_SIZES)])
+        )
+        for i in range(n_headers)
+    ]
+    pairs = [
+        (rng.randrange(STARK_PRIME), rng.randrange(STARK_PRIME))
+        for _ in range(n_headers)
+    ]
+    print(f"{n_headers} headers of {HEADER_SIZES} bytes, {n_headers} pairs")
+    results = {
+        backend.name: bench(backend, headers, pairs) for backend in available_backends()
+    }
+    reference = results["starkware"]
+    for name, (headers_per_s, pairs_per_s) in results.items():
+        print(
+            f"{name:>18} : hash_many {headers_per_s:9.0f} headers/s ({headers_per_s / reference[0]:5.1f}x) | hash {pairs_per_s:9.0f} pairs/s ({pairs_per_s / reference[1]:5.1f}x)"
+        )
@@ -0,0 +1,147 @@
+#!venv/bin/python3
+"""
+Benchmark of RpcClient (keep-alive session, orjson if installed) against a requests.post per batch
+(json.dumps and response.json()), fetching batches of eth_getBlockByNumber from a local stand-in server.
+The stand-in server answers with gzip compressed synthetic blocks, and delays each new connection by
+handshake_delay seconds to stand for the TCP and TLS round trips to a remote provider (0 to disable).
+Usage : python tools/bench/bench_rpc_client.py [n_batches] [batch_size] [handshake_delay]
+"""
+
+import sys
+import gzip
+import json
+import time
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tools.py.utils import RpcClient, orjson
+
+N_BATCHES = 50
+BATCH_SIZE = 200
+HANDSHAKE_DELAY = 0.02
+
+
+def rpc_block(number: int) -> dict:
+    word = "0x" + number.to_bytes(32, "big").hex()
+    return {
+        "parentHash": word,
+        "sha3Uncles": word,
+        "miner": "0x" + bytes(20).hex(),
+        "stateRoot": word,
+        "transactionsRoot": word,
+        "receiptsRoot": word,
+        "logsBloom": "0x" + bytes(256).hex(),
+        "difficulty": hex(number),
+        "number": hex(number),
+        "gasLimit": hex(30000000),
+        "gasUsed": hex(number),
+        "timestamp": hex(1438269973 + number * 12),
+        "extraData": "0x",
+        "mixHash": word,
+        "nonce": "0x" + bytes(8).hex(),
+        "baseFeePerGas": hex(number),
+        "hash": word,
+        "size": hex(600),
+        "totalDifficulty": hex(number),
+        "transactions": ["0x" + bytes(32).hex()] * 150,
+        "uncles": [],
+    }
+
+
+class StandInRpcHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    handshake_delay = HANDSHAKE_DELAY
+    connections = 0
+
+    def setup(self):
+        type(self).connections += 1
+        time.sleep(self.handshake_delay)
+        super().setup()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        responses = json.dumps(
+            [
+                {
+                    "jsonrpc": "2.0",
+                    "id": call["id"],
+                    "result": rpc_block(int(call["params"][0], 16)),
+                }
+                for call in json.loads(body)
+            ]
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            responses = gzip.compress(responses, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(responses)))
+        self.end_headers()
+        self.wfile.write(responses)
+
+    def log_message(self, *_):
+        pass
+
+
+def batches(n_batches: int, batch_size: int) -> list:
+    return [
+        [
+            {
+                "jsonrpc": "2.0",
+                "method": "eth_getBlockByNumber",
+                "params": [hex(i * batch_size + j), False],
+                "id": str(j),
+            }
+            for j in range(batch_size)
+        ]
+        for i in range(n_batches)
+    ]
+
+
+def post_per_batch(url: str, calls: list):
+    # rpc_request before RpcClient
+    headers = {"Content-Type": "application/json"}
+    response = requests.post(url=url, headers=headers, data=json.dumps(calls))
+    return response.json()
+
+
+def timed(url: str, call_batches: list, send) -> float:
+    StandInRpcHandler.connections = 0
+    t0 = time.perf_counter()
+    for calls in call_batches:
+        assert len(send(url, calls)) == len(calls)
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    n_batches = int(sys.argv[1]) if len(sys.argv) > 1 else N_BATCHES
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_SIZE
+    if len(sys.argv) > 3:
+        StandInRpcHandler.handshake_delay = float(sys.argv[3])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInRpcHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    call_batches = batches(n_batches, batch_size)
+    print(
+        f"{n_batches} batches of {batch_size} blocks, {StandInRpcHandler.handshake_delay * 1000:.0f} ms per new connection, orjson {'installed' if orjson else 'not installed'}"
+    )
+
+    for name, send in (
+        ("requests.post per batch", post_per_batch),
+        ("RpcClient", lambda url, calls: client.request(calls)),
+        (
+            "RpcClient gzip requests",
+            lambda url, calls: compressing_client.request(calls),
+        ),
+    ):
+        with RpcClient(url) as client, RpcClient(
+            url, compress_requests=True
+        ) as compressing_client:
+            elapsed = timed(url, call_batches, send)
+        print(
+            f"{name:>24} : {elapsed:.3f}s ({elapsed / n_batches * 1000:.1f} ms per batch, {StandInRpcHandler.connections} connections)"
+        )
+    server.shutdown()
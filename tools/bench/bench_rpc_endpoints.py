@@ -0,0 +1,89 @@
+#!venv/bin/python3
+"""
+Benchmark of the block fetcher over a pool of 1 to n_endpoints rate limited endpoints : local stand-in
+servers each allowing rate calls per second (answering HTTP 429 beyond it), with the matching limit
+set on their endpoint. The throughput should grow with the number of endpoints.
+Usage : python tools/bench/bench_rpc_endpoints.py [n_endpoints] [n_blocks] [rate]
+"""
+
+import sys
+import time
+import asyncio
+import threading
+from aiohttp import web
+from tools.bench.bench_rpc_client import rpc_block
+from tools.py.fetch_block_headers_async import AsyncBlockFetcher
+from tools.py.rpc_endpoints import Endpoint, EndpointPool, TokenBucket
+
+N_ENDPOINTS = 3
+N_BLOCKS = 5000
+RATE = 1000  # calls per second of each endpoint
+# Tolerance of the stand-in servers over the rate limit.
+SERVER_BURST_FACTOR = 1.2
+
+
+class RateLimitedServer:
+    def __init__(self, rate: float, loop: asyncio.AbstractEventLoop):
+        self.bucket = TokenBucket(rate, rate * SERVER_BURST_FACTOR)
+        self.loop = loop
+        self.throttled = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        calls = await request.json()
+        if self.bucket.delay(len(calls)) > 0:
+            self.throttled += 1
+            return web.Response(status=429, text="Too many requests")
+        self.bucket.take(len(calls))
+        return web.json_response(
+            [
+                {
+                    "jsonrpc": "2.0",
+                    "id": call["id"],
+                    "result": {
+                        key: value
+                        for key, value in rpc_block(int(call["params"][0], 16)).items()
+                        if key != "transactions"
+                    },
+                }
+                for call in calls
+            ]
+        )
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        return f"http://127.0.0.1:{runner.addresses[0][1]}/"
+
+
+if __name__ == "__main__":
+    n_endpoints = int(sys.argv[1]) if len(sys.argv) > 1 else N_ENDPOINTS
+    n_blocks = int(sys.argv[2]) if len(sys.argv) > 2 else N_BLOCKS
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else RATE
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    servers = [RateLimitedServer(rate, loop) for _ in range(n_endpoints)]
+    urls = [
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+        for server in servers
+    ]
+    print(f"{n_blocks} blocks, {rate:.0f} calls per second per endpoint")
+    for n in range(1, n_endpoints + 1):
+        for server in servers:
+            server.throttled = 0
+        endpoints = EndpointPool([Endpoint(url, rate) for url in urls[:n]])
+        fetcher = AsyncBlockFetcher(endpoints, retry_delay=0.1)
+        n_fetched = []
+        t0 = time.perf_counter()
+        asyncio.run(
+            fetcher.fetch_range(
+                0, n_blocks - 1, lambda rows: n_fetched.append(len(rows))
+            )
+        )
+        elapsed = time.perf_counter() - t0
+        assert sum(n_fetched) == n_blocks
+        print(
+            f"{n} endpoint(s) : {elapsed:.2f}s, {n_blocks / elapsed:.0f} blocks/s, {sum(s.throttled for s in servers)} throttled batches"
+        )
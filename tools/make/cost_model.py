@@ -0,0 +1,233 @@
+#!venv/bin/python3
+"""
+Linear cost model of a chunk processor run, used to size the chunks against MAX_RESOURCES_PER_JOB.
+Each resource (n_steps and the builtin counters) is predicted from features of the block range :
+    constant, n_blocks, header_words (8 bytes words), keccak_blocks (136 bytes keccak blocks),
+    mmr_hashes (hashes of each MMR, see append_hash_count)
+The coefficients are fitted (least squares) on the execution resources of past PIE objects.
+Without a calibration file, only keccak_builtin is predicted, by the exact count used so far.
+Usage : python tools/make/cost_model.py [directories with *_input.json and *_pie.zip files]
+"""
+
+import os
+import sys
+import json
+import zipfile
+from typing import Dict, List, Tuple
+from tools.py.mmr import append_hash_count
+from tools.py.utils import read_json
+from tools.make.sharp_submit_params import INPUT_PATH, MAX_RESOURCES_PER_JOB
+
+CALIBRATION_PATH = "tools/make/cost_model_calibration.json"
+FEATURES = ["constant", "n_blocks", "header_words", "keccak_blocks", "mmr_hashes"]
+KECCAK_FULL_RATE_IN_BYTES = 136
+# Relative margin kept under the limits for fitted resources.
+SAFETY_MARGIN = 0.02
+# Exact keccak_builtin count : one per keccak block of each header, one per Keccak MMR hash.
+KECCAK_ONLY_COEFFICIENTS = {"keccak_builtin": {"keccak_blocks": 1, "mmr_hashes": 1}}
+
+
+def resource_limits(max_resources: dict = MAX_RESOURCES_PER_JOB) -> Dict[str, int]:
+    """
+    Flattens MAX_RESOURCES_PER_JOB into {resource: limit}.
+    """
+    return {
+        "n_steps": max_resources["n_steps"],
+        **max_resources["builtin_instance_counter"],
+    }
+
+
+def header_words(bytes_len: int) -> int:
+    return (bytes_len + 7) // 8
+
+
+def keccak_blocks(bytes_len: int) -> int:
+    return bytes_len // KECCAK_FULL_RATE_IN_BYTES + 1
+
+
+def chunk_features(bytes_lens: List[int], mmr_size: int) -> Dict[str, int]:
+    """
+    Features of a chunk appending the headers of lengths bytes_lens to an MMR of size mmr_size.
+    """
+    return {
+        "constant": 1,
+        "n_blocks": len(bytes_lens),
+        "header_words": sum(header_words(x) for x in bytes_lens),
+        "keccak_blocks": sum(keccak_blocks(x) for x in bytes_lens),
+        "mmr_hashes": append_hash_count(mmr_size, len(bytes_lens)),
+    }
+
+
+class ChunkCostModel:
+    def __init__(self, coefficients: Dict[str, Dict[str, float]], margin: float = 0.0):
+        self.coefficients = coefficients
+        self.margin = margin
+
+    @classmethod
+    def load(cls, path: str = CALIBRATION_PATH) -> "ChunkCostModel":
+        """
+        Loads a calibration file, or falls back to the keccak only model if there is none.
+        """
+        if not os.path.exists(path):
+            return cls(KECCAK_ONLY_COEFFICIENTS)
+        with open(path) as f:
+            calibration = json.load(f)
+        return cls(
+            calibration["coefficients"], calibration.get("margin", SAFETY_MARGIN)
+        )
+
+    def save(self, path: str = CALIBRATION_PATH):
+        with open(path, "w") as f:
+            json.dump(
+                {"coefficients": self.coefficients, "margin": self.margin}, f, indent=4
+            )
+
+    def predict(self, features: Dict[str, int]) -> Dict[str, float]:
+        return {
+            resource: sum(coef * features[name] for name, coef in coefs.items())
+            for resource, coefs in self.coefficients.items()
+        }
+
+    def fits(self, features: Dict[str, int], limits: Dict[str, int] = None) -> bool:
+        limits = limits or resource_limits()
+        return all(
+            value * (1 + self.margin) <= limits[resource]
+            for resource, value in self.predict(features).items()
+            if resource in limits
+        )
+
+    def max_batch_size(
+        self, bytes_lens: List[int], mmr_size: int, limits: Dict[str, int] = None
+    ) -> int:
+        """
+        Largest number of blocks, taken in order from bytes_lens (from the highest block down),
+        that fits within the limits. The features of each candidate come from prefix sums and the
+        candidates are binary searched, all the resources growing with the number of blocks.
+        Raises a ValueError if not even one block fits.
+        """
+        prefix_words, prefix_keccak_blocks = [0], [0]
+        for bytes_len in bytes_lens:
+            prefix_words.append(prefix_words[-1] + header_words(bytes_len))
+            prefix_keccak_blocks.append(
+                prefix_keccak_blocks[-1] + keccak_blocks(bytes_len)
+            )
+
+        def features(n_blocks: int) -> Dict[str, int]:
+            return {
+                "constant": 1,
+                "n_blocks": n_blocks,
+                "header_words": prefix_words[n_blocks],
+                "keccak_blocks": prefix_keccak_blocks[n_blocks],
+                "mmr_hashes": append_hash_count(mmr_size, n_blocks),
+            }
+
+        low, high = 0, len(bytes_lens)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.fits(features(mid), limits):
+                low = mid
+            else:
+                high = mid - 1
+        if low == 0 and bytes_lens:
+            predicted = {
+                name: round(value) for name, value in self.predict(features(1)).items()
+            }
+            raise ValueError(
+                f"A single block does not fit within the limits, predicted resources: {predicted}"
+            )
+        return low
+
+
+def least_squares(rows: List[List[float]], values: List[float]) -> List[float]:
+    """
+    Solves min ||rows . x - values|| through the normal equations, with a tiny ridge term
+    as the features are close to collinear.
+    """
+    n = len(rows[0])
+    a = [[sum(r[i] * r[j] for r in rows) for j in range(n)] for i in range(n)]
+    b = [sum(r[i] * v for r, v in zip(rows, values)) for i in range(n)]
+    for i in range(n):
+        a[i][i] += 1e-9 * (a[i][i] or 1)
+    # Gaussian elimination with partial pivoting.
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        b[col], b[pivot] = b[pivot], b[col]
+        for r in range(col + 1, n):
+            factor = a[r][col] / a[col][col]
+            for c in range(col, n):
+                a[r][c] -= factor * a[col][c]
+            b[r] -= factor * b[col]
+    x = [0.0] * n
+    for i in reversed(range(n)):
+        x[i] = (b[i] - sum(a[i][j] * x[j] for j in range(i + 1, n))) / a[i][i]
+    return x
+
+
+def calibrate(
+    samples: List[Tuple[Dict[str, int], Dict[str, int]]], margin: float = SAFETY_MARGIN
+) -> ChunkCostModel:
+    """
+    Fits a model on (features, execution resources) samples.
+    """
+    rows = [[features[name] for name in FEATURES] for features, _ in samples]
+    coefficients = {}
+    for resource in resource_limits():
+        values = [resources[resource] for _, resources in samples]
+        coefficients[resource] = dict(zip(FEATURES, least_squares(rows, values)))
+    return ChunkCostModel(coefficients, margin)
+
+
+def load_pie_samples(directory: str = INPUT_PATH) -> List[Tuple[dict, dict]]:
+    """
+    (features, execution resources) of the PIE objects of directory having their chunk input (.json or .json.gz)
+    next to them.
+    """
+    samples = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith("_pie.zip"):
+            continue
+        input_paths = [
+            os.path.join(directory, filename.replace("_pie.zip", f"_input{extension}"))
+            for extension in (".json", ".json.gz")
+        ]
+        input_paths = [path for path in input_paths if os.path.exists(path)]
+        if not input_paths:
+            continue
+        chunk_input = read_json(input_paths[0])
+        with zipfile.ZipFile(os.path.join(directory, filename)) as zipf:
+            with zipf.open("execution_resources.json") as f:
+                execution_resources = json.load(f)
+        samples.append(
+            (
+                chunk_features(
+                    chunk_input["bytes_len_array"], chunk_input["mmr_last_len"]
+                ),
+                {
+                    "n_steps": execution_resources["n_steps"],
+                    **execution_resources["builtin_instance_counter"],
+                },
+            )
+        )
+    return samples
+
+
+if __name__ == "__main__":
+    directories = sys.argv[1:] or [INPUT_PATH]
+    samples = [s for directory in directories for s in load_pie_samples(directory)]
+    if len(samples) < len(FEATURES):
+        print(
+            f"Need at least {len(FEATURES)} PIE objects to calibrate, found {len(samples)}"
+        )
+        sys.exit(1)
+    model = calibrate(samples)
+    for resource, limit in resource_limits().items():
+        errors = [
+            model.predict(features)[resource] - resources[resource]
+            for features, resources in samples
+        ]
+        print(
+            f"{resource:>20} : max error {max(abs(e) for e in errors):.0f} ({max(abs(e) for e in errors) / limit:.4%} of the limit)"
+        )
+    model.save()
+    print(f"Calibration of {len(samples)} PIE objects written to {CALIBRATION_PATH}")
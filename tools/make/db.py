@@ -1,23 +1,27 @@
 #!venv/bin/python3
 import sqlite3
 import os, dotenv
+import json
 import time
+import asyncio
 import logging
-from typing import Tuple, List, Union, Optional, Any
-from tools.py.fetch_block_headers import fetch_blocks_from_rpc_no_async
+from typing import Dict, Iterator, Tuple, List, Union, Optional, Any
+from tools.py.fetch_block_headers_async import AsyncBlockFetcher
+from tools.py.rpc_endpoints import Endpoint, EndpointPool
 
 
 # Constants
 DB_PATH = "blocks.db"
 HIGH_BLOCK_NUMBER = 17800000
-CHUNK_SIZE = 1000
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # delay in seconds
+BLOCK_WINDOW_SIZE = 16384  # blocks read at once by BlockWindow (~10MB)
+PROGRESS_LOG_INTERVAL = 10000  # blocks between progress logs
 
 
 # Load environment variables
 dotenv.load_dotenv()
 RPC_URL = os.getenv("RPC_URL_MAINNET")
+# Several endpoints, "url[|calls per second],...", see tools/py/rpc_endpoints.py
+RPC_URLS = os.getenv("RPC_URLS_MAINNET")
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -80,40 +84,466 @@ def fetch_block_range_from_db(
     return c.fetchall()
 
 
-# --------------------- BLOCK FETCHING & INSERTION ---------------------
-def get_block_numbers(start: int, end: int) -> List[Tuple[int, bytes]]:
-    """Fetch block headers within a range, handling retries."""
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            block_headers = fetch_blocks_from_rpc_no_async(
-                range_from=end, range_till=start - 1, rpc_url=RPC_URL, delay=0
-            )
-            return [(x.number, x.raw_rlp()) for x in block_headers][::-1]
-        except Exception as e:
-            if attempt < MAX_RETRIES:
-                logging.warning(
-                    f"Error fetching block headers. Attempt {attempt}/{MAX_RETRIES}. "
-                    f"Retrying in {RETRY_DELAY} seconds. Error: {e}"
-                )
-                time.sleep(RETRY_DELAY)
-            else:
-                logging.error(
-                    f"Failed to fetch block headers after {MAX_RETRIES} attempts. Error: {e}"
-                )
-                raise
-
-
-def insert_block_data(start: int, end: int, conn: sqlite3.Connection) -> None:
-    """Insert fetched block data into the database."""
-    block_headers = get_block_numbers(start, end)
+def iter_block_lengths(start: int, end: int, conn: sqlite3.Connection) -> Iterator[int]:
+    """
+    Yields the lengths of the headers of the blocks from start to end in ascending order, without reading the headers.
+    """
+    c = conn.cursor()
+    c.execute(
+        "SELECT length(blockheader) FROM blocks WHERE block_number BETWEEN ? AND ? ORDER BY block_number ASC",
+        (start, end),
+    )
+    for (length,) in c:
+        yield length
+
+
+class BlockWindow:
+    """
+    Serves block range requests, with the same output as fetch_block_range_from_db, from a window
+    of contiguous blocks kept in memory. A missing range is read together with the window_size
+    blocks below it, as chunks are prepared from the highest block downwards, and the blocks above
+    the requests are evicted beyond max_blocks. Overlapping requests (batch sizing, then the chunk
+    and its next block) are then read from the table once.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        window_size: int = BLOCK_WINDOW_SIZE,
+        max_blocks: int = 2 * BLOCK_WINDOW_SIZE,
+    ):
+        self.conn = conn
+        self.window_size = window_size
+        self.max_blocks = max(max_blocks, window_size)
+        self._headers = {}
+        self._lo, self._hi = 0, -1
+        self.requested = 0
+        self.missed = 0
+        self.rows_read = 0
+
+    def _load(self, start: int, end: int):
+        if start > end:
+            return
+        rows = fetch_block_range_from_db(start, end, self.conn)
+        self.rows_read += len(rows)
+        self._headers.update(rows)
+
+    def _ensure(self, start: int, end: int):
+        if self._lo <= start and end <= self._hi:
+            return
+        self.missed += (end - start + 1) - max(
+            0, min(end, self._hi) - max(start, self._lo) + 1
+        )
+        want_lo, want_hi = min(start, end - self.window_size + 1), end
+        cached = self._lo <= self._hi
+        if cached and want_lo <= self._hi + 1 and want_hi >= self._lo - 1:
+            self._load(want_lo, self._lo - 1)
+            self._load(self._hi + 1, want_hi)
+            self._lo, self._hi = min(self._lo, want_lo), max(self._hi, want_hi)
+        else:
+            self._headers.clear()
+            self._load(want_lo, want_hi)
+            self._lo, self._hi = want_lo, want_hi
+        if self._hi - self._lo + 1 > self.max_blocks:
+            new_hi = max(end, self._lo + self.max_blocks - 1)
+            new_lo = min(want_lo, new_hi - self.max_blocks + 1)
+            for block_number in range(new_hi + 1, self._hi + 1):
+                self._headers.pop(block_number, None)
+            for block_number in range(self._lo, new_lo):
+                self._headers.pop(block_number, None)
+            self._lo, self._hi = max(self._lo, new_lo), new_hi
+
+    def fetch_block_range(self, start: int, end: int) -> List[Tuple[int, bytes]]:
+        """
+        Same as fetch_block_range_from_db(start, end, conn).
+        """
+        if start > end:
+            return []
+        self.requested += end - start + 1
+        self._ensure(start, end)
+        headers = self._headers
+        return [(n, headers[n]) for n in range(start, end + 1) if n in headers]
+
+    def hit_rate(self) -> float:
+        return 1 - self.missed / self.requested if self.requested else 0.0
+
+    def report(self) -> str:
+        return f"Block window: {self.hit_rate():.1%} hit rate, {self.rows_read} rows read for {self.requested} blocks requested"
+
+
+# --------------------- MMR NODE STORE ---------------------
+MMR_TREES = ("poseidon", "keccak")
+
+
+def setup_mmr_tables(conn: sqlite3.Connection) -> None:
+    """
+    Creates the tables holding the MMR nodes, and the committed size of each tree with the next block
+    to append to it.
+    """
+    with conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mmr_nodes (
+                tree TEXT NOT NULL,
+                pos INTEGER NOT NULL,
+                hash BLOB NOT NULL,
+                PRIMARY KEY (tree, pos)
+            ) WITHOUT ROWID;
+        """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mmr_meta (
+                tree TEXT PRIMARY KEY,
+                mmr_size INTEGER NOT NULL,
+                next_block INTEGER NOT NULL
+            );
+        """
+        )
+
+
+class SQLiteNodeStore:
+    """
+    MMR node store persisted in the mmr_nodes table, usable as MMR(hasher, store).
+    Writes are buffered in memory and only persisted, together with the new size of the tree,
+    by commit_node_stores. A store reopened after a crash is back at its last committed size,
+    which is read from mmr_meta without scanning the nodes, as is the next block to append
+    (None until the first commit).
+    Positions may be sparse : a tree can be seeded with its peaks only.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, tree: str):
+        self.conn = conn
+        self.tree = tree
+        c = conn.cursor()
+        c.execute("SELECT mmr_size, next_block FROM mmr_meta WHERE tree = ?", (tree,))
+        row = c.fetchone()
+        self._committed_size, self._committed_next_block = (
+            (0, None) if row is None else row
+        )
+        self._size = self._committed_size
+        self.next_block = self._committed_next_block
+        self._pending = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, pos: int) -> bool:
+        return pos in self._pending or self._fetch(pos) is not None
+
+    def __getitem__(self, pos: int) -> int:
+        value = self._pending.get(pos)
+        if value is None:
+            value = self._fetch(pos)
+            if value is None:
+                raise KeyError(pos)
+        return value
+
+    def __setitem__(self, pos: int, value: Union[bytes, int]):
+        if isinstance(value, bytes) and len(value) == 32:
+            value = int.from_bytes(value, "big")
+        elif not isinstance(value, int):
+            raise TypeError(f"Unsupported node value: {type(value)}, {value}")
+        self._pending[pos] = value
+        if pos >= self._size:
+            self._size = pos + 1
+
+    def _fetch(self, pos: int) -> Optional[int]:
+        c = self.conn.cursor()
+        c.execute(
+            "SELECT hash FROM mmr_nodes WHERE tree = ? AND pos = ?", (self.tree, pos)
+        )
+        row = c.fetchone()
+        return None if row is None else int.from_bytes(row[0], "big")
+
+    def flush(self) -> None:
+        """
+        Writes the pending nodes, the size and the next block in the current transaction, without committing it.
+        """
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO mmr_nodes (tree, pos, hash) VALUES (?, ?, ?)",
+            (
+                (self.tree, pos, value.to_bytes(32, "big"))
+                for pos, value in self._pending.items()
+            ),
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO mmr_meta (tree, mmr_size, next_block) VALUES (?, ?, ?)",
+            (self.tree, self._size, self.next_block),
+        )
+
+    def mark_committed(self) -> None:
+        self._pending.clear()
+        self._committed_size = self._size
+        self._committed_next_block = self.next_block
+
+    def rollback(self) -> None:
+        """
+        Drops the pending nodes, back to the last committed size and next block.
+        """
+        self._pending.clear()
+        self._size = self._committed_size
+        self.next_block = self._committed_next_block
+
+
+def open_mmr_node_stores(conn: sqlite3.Connection) -> dict:
+    """
+    Returns the persisted node stores of both MMRs : {"poseidon": store, "keccak": store}
+    """
+    setup_mmr_tables(conn)
+    # Make sure a commit is on disk before it returns.
+    conn.execute("PRAGMA synchronous = FULL")
+    return {tree: SQLiteNodeStore(conn, tree) for tree in MMR_TREES}
+
+
+def commit_node_stores(
+    conn: sqlite3.Connection, stores: List[SQLiteNodeStore], next_block: int
+) -> None:
+    """
+    Atomically persists the pending nodes of all the stores, so that the trees always
+    stay at the same size on disk, with next_block as the next block to append.
+    """
+    try:
+        with conn:
+            for store in stores:
+                store.next_block = next_block
+            for store in stores:
+                store.flush()
+    except Exception:
+        for store in stores:
+            store.rollback()
+        raise
+    for store in stores:
+        store.mark_committed()
+
+
+# --------------------- MMR CHECKPOINTS ---------------------
+def setup_checkpoints_table(conn: sqlite3.Connection) -> None:
+    """
+    Creates the table of the MMR states reached while preparing inputs, by run origin and next block to append.
+    The origin of a run is its start block and the size and roots of its initial MMR state, so that
+    runs starting from different states do not overwrite each other's checkpoints.
+    Hashes are stored as hex strings, peaks as JSON lists of them.
+    """
+    with conn:
+        c = conn.cursor()
+        columns = [row[1] for row in c.execute("PRAGMA table_info(mmr_checkpoints)")]
+        if columns and "origin_block" not in columns:
+            # Checkpoints recorded without their origin cannot be told apart, they are dropped.
+            c.execute("DROP TABLE mmr_checkpoints")
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mmr_checkpoints (
+                origin_block INTEGER NOT NULL,
+                origin_mmr_size INTEGER NOT NULL,
+                origin_poseidon_root TEXT NOT NULL,
+                origin_keccak_root TEXT NOT NULL,
+                block_number INTEGER NOT NULL,
+                mmr_size INTEGER NOT NULL,
+                poseidon_peaks TEXT NOT NULL,
+                keccak_peaks TEXT NOT NULL,
+                poseidon_root TEXT NOT NULL,
+                keccak_root TEXT NOT NULL,
+                PRIMARY KEY (origin_block, origin_mmr_size, origin_poseidon_root, origin_keccak_root, block_number)
+            );
+        """
+        )
+
+
+def _origin_key(origin: Tuple[int, dict]) -> tuple:
+    block_number, state = origin
+    return (
+        block_number,
+        state["mmr_size"],
+        hex(state["mmr_roots"]["poseidon"]),
+        hex(state["mmr_roots"]["keccak"]),
+    )
+
+
+def save_mmr_checkpoint(
+    conn: sqlite3.Connection,
+    origin: Tuple[int, dict],
+    block_number: int,
+    state: dict,
+) -> None:
+    """
+    Records the MMR state (same structure as initial_params) reached once all the blocks above
+    block_number are appended, block_number being the next one, by the run started at origin :
+    (start block, initial MMR state).
+    """
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO mmr_checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                *_origin_key(origin),
+                block_number,
+                state["mmr_size"],
+                json.dumps([hex(x) for x in state["mmr_peaks"]["poseidon"]]),
+                json.dumps([hex(x) for x in state["mmr_peaks"]["keccak"]]),
+                hex(state["mmr_roots"]["poseidon"]),
+                hex(state["mmr_roots"]["keccak"]),
+            ),
+        )
+
+
+def get_nearest_mmr_checkpoint(
+    conn: sqlite3.Connection, block_number: int, initial_state: dict
+) -> Optional[Tuple[Tuple[int, dict], int, dict]]:
+    """
+    Returns the checkpoint closest to block_number a run starting at block_number from initial_state
+    can resume from, ie the one with the lowest next block greater than or equal to block_number among
+    the runs started from initial_state at or above block_number : (origin, next block number, MMR state),
+    or None if there is no such checkpoint.
+    """
+    _, origin_mmr_size, origin_poseidon_root, origin_keccak_root = _origin_key(
+        (block_number, initial_state)
+    )
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT origin_block, block_number, mmr_size, poseidon_peaks, keccak_peaks, poseidon_root, keccak_root
+        FROM mmr_checkpoints
+        WHERE origin_mmr_size = ? AND origin_poseidon_root = ? AND origin_keccak_root = ?
+            AND origin_block >= ? AND block_number >= ?
+        ORDER BY block_number ASC, origin_block ASC LIMIT 1
+        """,
+        (
+            origin_mmr_size,
+            origin_poseidon_root,
+            origin_keccak_root,
+            block_number,
+            block_number,
+        ),
+    )
+    row = c.fetchone()
+    if row is None:
+        return None
+    (
+        origin_block,
+        next_block,
+        mmr_size,
+        poseidon_peaks,
+        keccak_peaks,
+        poseidon_root,
+        keccak_root,
+    ) = row
+    return (
+        (origin_block, initial_state),
+        next_block,
+        {
+            "mmr_peaks": {
+                "poseidon": [int(x, 16) for x in json.loads(poseidon_peaks)],
+                "keccak": [int(x, 16) for x in json.loads(keccak_peaks)],
+            },
+            "mmr_size": mmr_size,
+            "mmr_roots": {
+                "poseidon": int(poseidon_root, 16),
+                "keccak": int(keccak_root, 16),
+            },
+        },
+    )
+
+
+# --------------------- BLOCK HASHES CACHE ---------------------
+def setup_block_hashes_table(conn: sqlite3.Connection) -> None:
+    """
+    Creates the table caching the Poseidon and Keccak hashes of the headers of the blocks table.
+    """
+    with conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS block_hashes (
+                block_number INTEGER PRIMARY KEY,
+                poseidon BLOB NOT NULL,
+                keccak BLOB NOT NULL
+            );
+        """
+        )
+
+
+def fetch_block_hashes(
+    start: int, end: int, conn: sqlite3.Connection
+) -> Dict[int, Tuple[int, int]]:
+    """
+    Returns the cached (poseidon, keccak) hashes of the blocks from start to end included, by block number.
+    """
+    c = conn.cursor()
+    c.execute(
+        "SELECT block_number, poseidon, keccak FROM block_hashes WHERE block_number BETWEEN ? AND ?",
+        (start, end),
+    )
+    return {
+        block_number: (int.from_bytes(poseidon, "big"), int.from_bytes(keccak, "big"))
+        for block_number, poseidon, keccak in c.fetchall()
+    }
+
+
+def insert_block_hashes(
+    conn: sqlite3.Connection, block_hashes: Dict[int, Tuple[int, int]]
+) -> None:
+    """
+    Caches the (poseidon, keccak) hashes of blocks, by block number.
+    """
     with conn:
-        # Execute the many insertions
         conn.executemany(
-            "INSERT OR IGNORE INTO blocks (block_number, blockheader) VALUES (?, ?)",
-            block_headers,
+            "INSERT OR REPLACE INTO block_hashes VALUES (?, ?, ?)",
+            (
+                (block_number, poseidon.to_bytes(32, "big"), keccak.to_bytes(32, "big"))
+                for block_number, (poseidon, keccak) in block_hashes.items()
+            ),
         )
 
 
+# --------------------- BLOCK FETCHING & INSERTION ---------------------
+def rpc_endpoints() -> EndpointPool:
+    """
+    Endpoints of RPC_URLS_MAINNET if set, RPC_URL_MAINNET otherwise.
+    """
+    if RPC_URLS:
+        return EndpointPool.parse(RPC_URLS)
+    return EndpointPool([Endpoint(RPC_URL)])
+
+
+def fetch_and_insert_blocks(
+    conn: sqlite3.Connection,
+    start: int,
+    end: int,
+    endpoints: Union[str, EndpointPool] = None,
+    **fetcher_kwargs,
+) -> AsyncBlockFetcher:
+    """
+    Fetches the blocks from start to end with several batch requests in flight, spread over the endpoints
+    (rpc_endpoints() by default), and inserts them in ascending order as they come, so that the table
+    always holds contiguous blocks from start.
+    Returns the fetcher, with its statistics.
+    """
+    fetcher = AsyncBlockFetcher(endpoints or rpc_endpoints(), **fetcher_kwargs)
+    t0 = time.time()
+    progress = {"inserted": 0, "logged": 0}
+
+    def insert(block_headers: List[Tuple[int, bytes]]):
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO blocks (block_number, blockheader) VALUES (?, ?)",
+                block_headers,
+            )
+        progress["inserted"] += len(block_headers)
+        if progress["inserted"] - progress["logged"] >= PROGRESS_LOG_INTERVAL:
+            progress["logged"] = progress["inserted"]
+            elapsed = time.time() - t0
+            rate = progress["inserted"] / elapsed
+            remaining = end - block_headers[-1][0]
+            logging.info(
+                f"Fetched and inserted blocks up to {block_headers[-1][0]} ({rate:.0f} blocks/s)."
+                f"\n\tEstimated time remaining: {remaining / rate / 3600:.4f} hours."
+                f"\n\t{fetcher.report()}."
+            )
+
+    asyncio.run(fetcher.fetch_range(start, end, insert))
+    return fetcher
+
+
 # --------------------- INTEGRITY CHECK ---------------------
 def check_db_integrity(conn: sqlite3.Connection) -> None:
     """
@@ -150,42 +580,11 @@ def main() -> None:
 
         _, max_block = get_min_max_block_numbers(conn)
         start_from = 0 if max_block is None else max_block + 1
-        # Tracking fetch statistics
-        total_fetch_time = 0.0
-        total_fetch_count = 0
-
-        # Main fetching loop
         print("\n")
         logging.info(f"Fetching blocks from {start_from} to {HIGH_BLOCK_NUMBER}...\n")
-        while start_from <= HIGH_BLOCK_NUMBER:
-            end_at = min(start_from + CHUNK_SIZE - 1, HIGH_BLOCK_NUMBER)
-
-            t0 = time.time()
-            insert_block_data(start_from, end_at, conn)
-            fetch_duration = time.time() - t0
-
-            total_fetch_time += fetch_duration
-            total_fetch_count += 1
-            # Logging statistics every 8 iterations
-            if total_fetch_count & 7 == 0:
-                average_time_per_fetch = total_fetch_time / total_fetch_count
-                estimated_remaining_fetches = (HIGH_BLOCK_NUMBER - end_at) / CHUNK_SIZE
-                estimated_time_remaining = (
-                    average_time_per_fetch * estimated_remaining_fetches
-                )
-
-                logging.info(
-                    f"Fetched and inserted blocks from {start_from} to {end_at} in {fetch_duration:.4f} seconds."
-                    f"\n\tEstimated time remaining: {estimated_time_remaining/3600:.4f} hours."
-                    f"\n\tAverage time per fetch: {average_time_per_fetch:.4f} seconds."
-                    f"\n\tEstimated remaining fetches: {estimated_remaining_fetches}."
-                )
-            else:
-                logging.info(
-                    f"Fetched and inserted blocks from {start_from} to {end_at} in {fetch_duration:.4f} seconds."
-                )
-
-            start_from = end_at + 1
+        if start_from <= HIGH_BLOCK_NUMBER:
+            fetcher = fetch_and_insert_blocks(conn, start_from, HIGH_BLOCK_NUMBER)
+            logging.info(f"Fetch completed: {fetcher.report()}.")
         # Post-fetching integrity check
         check_db_integrity(conn)
 
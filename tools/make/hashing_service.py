@@ -0,0 +1,129 @@
+#!venv/bin/python3
+"""
+Process pool hashing block headers (Keccak and Poseidon), kept alive for a whole
+prepare_full_chain_inputs run instead of one pool per chunk.
+Every worker is started and warmed up when the service starts (Poseidon backend selected and its
+parameters loaded), and headers are sent in batches to amortize the pickling and inter-process round trips.
+"""
+
+import os
+import time
+import multiprocessing
+import sha3
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Tuple
+from tools.py.utils import bytes_to_8_bytes_chunks_little
+from tools.py.poseidon_backends import get_poseidon_backend
+
+# Batches per worker for each hash_blocks call, to balance the load at the end of the call.
+BATCHES_PER_WORKER = 4
+MAX_BATCH_SIZE = 512
+WARM_UP_TIMEOUT = 120  # seconds
+
+POSEIDON = None
+WARM_UP_BARRIER = None
+
+
+def _init_worker(barrier):
+    global POSEIDON, WARM_UP_BARRIER
+    POSEIDON = get_poseidon_backend()
+    WARM_UP_BARRIER = barrier
+
+
+def _warm_up(_) -> int:
+    # Each worker waits for all the others, so that each warm up task runs on a different worker.
+    WARM_UP_BARRIER.wait(WARM_UP_TIMEOUT)
+    return os.getpid()
+
+
+def compute_hashes(block: bytes) -> Tuple[int, int]:
+    # Compute Keccak hash
+    k = sha3.keccak_256()
+    k.update(block)
+    digest = k.digest()
+    keccak_hash = int.from_bytes(digest, "big")
+
+    # Compute Poseidon hash
+    poseidon = POSEIDON or get_poseidon_backend()
+    poseidon_hash = poseidon.hash_many(bytes_to_8_bytes_chunks_little(block))
+    return keccak_hash, poseidon_hash
+
+
+def _hash_batch(blocks: List[bytes]) -> Tuple[int, float, List[Tuple[int, int]]]:
+    t0 = time.perf_counter()
+    hashes = [compute_hashes(block) for block in blocks]
+    return os.getpid(), time.perf_counter() - t0, hashes
+
+
+class HashingService:
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or os.cpu_count()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(multiprocessing.Barrier(self.max_workers),),
+        )
+        self._started = time.perf_counter()
+        self.workers = list(self._executor.map(_warm_up, range(self.max_workers)))
+        assert len(set(self.workers)) == self.max_workers
+        self._busy = {pid: 0.0 for pid in self.workers}
+
+    def __enter__(self) -> "HashingService":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def batch_size(self, n_blocks: int) -> int:
+        return max(
+            1,
+            min(
+                MAX_BATCH_SIZE,
+                -(-n_blocks // (self.max_workers * BATCHES_PER_WORKER)),
+            ),
+        )
+
+    def submit_blocks(self, blocks: List[bytes]) -> List[Future]:
+        """
+        Submits the blocks in batches, returns the futures to collect.
+        """
+        size = self.batch_size(len(blocks))
+        return [
+            self._executor.submit(_hash_batch, blocks[i : i + size])
+            for i in range(0, len(blocks), size)
+        ]
+
+    def collect(self, futures: List[Future]) -> Tuple[List[int], List[int]]:
+        """
+        Waits for submitted batches and returns the Poseidon and Keccak hashes of their blocks.
+        """
+        poseidon_hashes, keccak_hashes = [], []
+        for future in futures:
+            pid, elapsed, hashes = future.result()
+            self._busy[pid] += elapsed
+            for keccak_hash, poseidon_hash in hashes:
+                keccak_hashes.append(keccak_hash)
+                poseidon_hashes.append(poseidon_hash)
+        return poseidon_hashes, keccak_hashes
+
+    def hash_blocks(self, blocks: List[bytes]) -> Tuple[List[int], List[int]]:
+        """
+        Returns the Poseidon and Keccak hashes of the blocks.
+        """
+        return self.collect(self.submit_blocks(blocks))
+
+    def utilization(self) -> Dict[int, float]:
+        """
+        Fraction of the service lifetime each worker (by pid, all of them) spent hashing.
+        """
+        elapsed = time.perf_counter() - self._started
+        return {pid: busy / elapsed for pid, busy in self._busy.items()}
+
+    def report(self) -> str:
+        utilization = self.utilization()
+        mean = sum(utilization.values()) / len(utilization)
+        per_worker = ", ".join(f"{u:.0%}" for u in utilization.values())
+        return f"Hashing workers utilization: {mean:.0%} on average ({per_worker})"
+
+    def close(self):
+        self._executor.shutdown()
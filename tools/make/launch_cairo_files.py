@@ -3,7 +3,12 @@ import os
 import readline
 import argparse
 import inquirer
-from tools.py.utils import create_directory, get_files_from_folders
+from tools.py.utils import (
+    create_directory,
+    get_files_from_folders,
+    is_json_file,
+    plain_json_file,
+)
 
 # Constants
 CAIRO_PROGRAMS_FOLDERS = ["tests/cairo_programs/", "src/single_chunk_processor"]
@@ -91,7 +96,7 @@ class CairoRunner:
     def _select_input_file(self, json_files_dir):
         """Allow the user to select an input JSON file for the chunk processor."""
         json_files = [
-            f for f in os.listdir(json_files_dir) if f.endswith("_input.json")
+            f for f in os.listdir(json_files_dir) if is_json_file(f, "_input")
         ]
 
         if not json_files:
@@ -121,10 +126,11 @@ class CairoRunner:
             print(f"### Compilation failed. Please fix the errors and try again.")
             self.prompt_for_cairo_file()
 
-    def construct_run_command(self, compiled_path):
+    def construct_run_command(self, compiled_path, program_input=None):
+        """cairo-run command, with program_input (a plain copy of a compressed input) in place of the input if given."""
         cmd_base = f"cairo-run --program={compiled_path} --layout=starknet_with_keccak"
         input_flag = (
-            f" --program_input={self.json_input_path}"
+            f" --program_input={program_input or self.json_input_path}"
             if os.path.exists(self.json_input_path)
             else ""
         )
@@ -146,8 +152,9 @@ class CairoRunner:
         create_directory(f"{PROFILING_DIR}/{self.filename}")
 
         compiled_path = self.compile_cairo_file()
-        run_command = self.construct_run_command(compiled_path)
-        os.system(run_command)
+        with plain_json_file(self.json_input_path) as program_input:
+            run_command = self.construct_run_command(compiled_path, program_input)
+            os.system(run_command)
 
         if self.args.profile:
             self.run_profiling_tool()
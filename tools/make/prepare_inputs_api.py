@@ -1,54 +1,153 @@
 #!venv/bin/python3
 import time
-import sha3
 import sqlite3
-from typing import Tuple, List
+import argparse
+import queue
+import random
+import threading
+from collections import deque
+from functools import partial
 from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
 from tools.py.utils import (
     split_128,
     from_uint256,
-    bytes_to_8_bytes_chunks_little,
-    write_to_json,
+    HeaderWords,
+    write_to_json_streaming,
     create_directory,
     validate_initial_params,
 )
 from tools.py.mmr import (
     MMR,
+    DualMMRFrontier,
     get_peaks,
+    leaf_count_to_mmr_size,
+    mmr_size_to_leaf_count,
     PoseidonHasher,
     KeccakHasher,
-    MockedHasher,
 )
-from starkware.cairo.common.poseidon_hash import poseidon_hash_many, poseidon_hash
+from starkware.cairo.common.poseidon_hash import poseidon_hash
 from starkware.cairo.common.poseidon_utils import PoseidonParams
 
 from tools.make.db import (
+    BlockWindow,
     fetch_block_range_from_db,
+    iter_block_lengths,
     create_connection,
     get_min_max_block_numbers,
+    open_mmr_node_stores,
+    commit_node_stores,
+    setup_checkpoints_table,
+    save_mmr_checkpoint,
+    get_nearest_mmr_checkpoint,
+    setup_block_hashes_table,
+    fetch_block_hashes,
+    insert_block_hashes,
 )
-from tools.make.sharp_submit_params import MAX_RESOURCES_PER_JOB
+from tools.make.cost_model import ChunkCostModel, chunk_features
+from tools.make.hashing_service import HashingService
+from tools.make.run_manifest import MANIFEST_FILENAME, RunManifest
 
 
-MAX_KECCAK_ROUNDS = MAX_RESOURCES_PER_JOB["builtin_instance_counter"]["keccak_builtin"]
 DYNAMIC_BATCH_SIZE_START = 1700
-KECCAK_FULL_RATE_IN_BYTES = 136
+# Chunks read and hashed ahead of the MMR stage in pipelined mode.
+PIPELINE_DEPTH = 2
+# Seconds between checks of the stop request by the pipelined reader thread, while its queue is full.
+PIPELINE_POLL_INTERVAL = 0.1
+# Blocks read and hashed at once by the first phase of the two-phase mode.
+HASH_SLICE_SIZE = 20000
+# Peak memory per block of a slice in streaming mode (header, its words as Python ints, hashes,
+# and the copies sent to the hashing workers, two slices being in flight while hashing).
+# Measured at about 3600 bytes with 500 to 650 bytes headers, see test_streaming_peak_rss_is_bounded.
+STREAMING_BYTES_PER_BLOCK = 4096
+STREAMING_MEMORY_BUDGET = 256 * 2**20
 
 POSEIDON_PARAMS = PoseidonParams.get_default_poseidon_params()
 
 
-def compute_hashes(block: bytes) -> Tuple[int, int]:
-    # Compute Keccak hash
-    k = sha3.keccak_256()
-    k.update(block)
-    digest = k.digest()
-    keccak_hash = int.from_bytes(digest, "big")
+def compute_block_hashes(
+    blocks: List[bytes], hashing: HashingService = None
+) -> Tuple[List[int], List[int]]:
+    """
+    Returns the Poseidon and Keccak hashes of the blocks, computed by hashing or a temporary HashingService.
+    """
+    if hashing is None:
+        with HashingService() as hashing:
+            return hashing.hash_blocks(blocks)
+    return hashing.hash_blocks(blocks)
 
-    # Compute Poseidon hash
-    poseidon_hash = poseidon_hash_many(
-        bytes_to_8_bytes_chunks_little(block), POSEIDON_PARAMS
-    )
-    return keccak_hash, poseidon_hash
+
+class BlockHashCache:
+    """
+    Hashes of the blocks cached in the block_hashes table : only the missing ones are computed, then stored.
+    With verify_sample > 0, that many cached hashes (at random) of each chunk are computed again and checked.
+    """
+
+    def __init__(self, verify_sample: int = 0):
+        self.verify_sample = verify_sample
+
+    def lookup(
+        self, conn: sqlite3.Connection, to_block_number_low: int, n_blocks: int
+    ) -> Tuple[dict, List[int]]:
+        """
+        Returns the cached hashes of the n_blocks blocks from to_block_number_low by block number, and the
+        block numbers to hash : the missing ones and the sample of cached ones to verify.
+        """
+        cached = fetch_block_hashes(
+            to_block_number_low, to_block_number_low + n_blocks - 1, conn
+        )
+        blocks_range = range(to_block_number_low, to_block_number_low + n_blocks)
+        to_hash = [n for n in blocks_range if n not in cached]
+        if self.verify_sample and cached:
+            sample = random.sample(list(cached), min(self.verify_sample, len(cached)))
+            to_hash = sorted(to_hash + sample)
+        return cached, to_hash
+
+    def merge(
+        self,
+        conn: sqlite3.Connection,
+        to_block_number_low: int,
+        n_blocks: int,
+        cached: dict,
+        to_hash: List[int],
+        hashes: Tuple[List[int], List[int]],
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Checks and stores the hashes computed for to_hash, returns the Poseidon and Keccak hashes of all the blocks.
+        """
+        computed = dict(zip(to_hash, zip(*hashes)))
+        for block_number, block_hashes in computed.items():
+            if block_number in cached and cached[block_number] != block_hashes:
+                raise ValueError(
+                    f"Cached hashes of block {block_number} do not match its header: {cached[block_number]} != {block_hashes}"
+                )
+        insert_block_hashes(
+            conn, {n: h for n, h in computed.items() if n not in cached}
+        )
+        all_hashes = {**cached, **computed}
+        blocks_range = range(to_block_number_low, to_block_number_low + n_blocks)
+        return (
+            [all_hashes[block_number][0] for block_number in blocks_range],
+            [all_hashes[block_number][1] for block_number in blocks_range],
+        )
+
+    def block_hashes(
+        self,
+        conn: sqlite3.Connection,
+        to_block_number_low: int,
+        blocks: List[bytes],
+        hashing: HashingService = None,
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Same as compute_block_hashes for the blocks from to_block_number_low, through the cache.
+        """
+        cached, to_hash = self.lookup(conn, to_block_number_low, len(blocks))
+        hashes = compute_block_hashes(
+            [blocks[n - to_block_number_low] for n in to_hash], hashing
+        )
+        return self.merge(
+            conn, to_block_number_low, len(blocks), cached, to_hash, hashes
+        )
 
 
 def prepare_chunk_input(
@@ -58,12 +157,50 @@ def prepare_chunk_input(
     from_block_number_high: int,
     to_block_number_low,
     conn=None,
+    hashing: HashingService = None,
+    hash_cache: BlockHashCache = None,
 ) -> Tuple[dict, dict, Tuple[List[int], List[int]]]:
-    chunk_input = {}
-    chunk_output = {}
+    blocks = fetch_chunk_blocks(from_block_number_high, to_block_number_low, conn)
+    if hash_cache is None:
+        hashes = compute_block_hashes(blocks[:-1], hashing)
+    else:
+        hashes = hash_cache.block_hashes(
+            conn, to_block_number_low, blocks[:-1], hashing
+        )
+    return build_chunk_input(
+        last_peaks,
+        last_mmr_size,
+        last_mmr_root,
+        from_block_number_high,
+        to_block_number_low,
+        blocks,
+        hashes,
+    )
+
+
+def fetch_blocks(
+    start: int, end: int, conn: sqlite3.Connection, window: BlockWindow = None
+) -> List[Tuple[int, bytes]]:
+    """
+    fetch_block_range_from_db, through window if given.
+    """
+    if window is None:
+        return fetch_block_range_from_db(start=start, end=end, conn=conn)
+    return window.fetch_block_range(start, end)
+
+
+def fetch_chunk_blocks(
+    from_block_number_high: int,
+    to_block_number_low: int,
+    conn: sqlite3.Connection,
+    window: BlockWindow = None,
+) -> List[bytes]:
+    """
+    Headers of the blocks of a chunk, from to_block_number_low to from_block_number_high + 1 included.
+    """
     t0_db = time.time()
-    blocks_data = fetch_block_range_from_db(
-        end=from_block_number_high + 1, start=to_block_number_low, conn=conn
+    blocks_data = fetch_blocks(
+        to_block_number_low, from_block_number_high + 1, conn, window
     )
     assert (
         len(blocks_data) == from_block_number_high - to_block_number_low + 2
@@ -75,29 +212,31 @@ def prepare_chunk_input(
     blocks = [block[1] for block in blocks_data]
     t1_db = time.time()
     print(f"\t\tFetched {len(blocks)} blocks from DB in {t1_db-t0_db}s")
+    return blocks
 
+
+def chunk_fields(
+    last_peaks: dict,
+    last_mmr_size: int,
+    last_mmr_root: dict,
+    from_block_number_high: int,
+    to_block_number_low: int,
+    first_block: bytes,
+    next_block: bytes,
+) -> Tuple[dict, dict]:
+    """
+    Chunk input, without the headers arrays, and (partial) output from the headers of the lowest block
+    of the chunk and of the block above it.
+    """
     block_n_plus_one_parent_hash_little = split_128(
-        int.from_bytes(blocks[-1][4:36], "little")
+        int.from_bytes(next_block[4:36], "little")
     )
     block_n_plus_one_parent_hash_big = split_128(
-        int.from_bytes(blocks[-1][4:36], "big")
+        int.from_bytes(next_block[4:36], "big")
     )
     block_n_minus_r_plus_one_parent_hash_big = split_128(
-        int.from_bytes(blocks[0][4:36], "big")
+        int.from_bytes(first_block[4:36], "big")
     )
-    blocks = blocks[:-1]
-    assert len(blocks) == from_block_number_high - to_block_number_low + 1
-
-    keccak_hashes = []
-    poseidon_hashes = []
-
-    with ProcessPoolExecutor() as executor:
-        for keccak_result, poseidon_result in executor.map(compute_hashes, blocks):
-            keccak_hashes.append(keccak_result)
-            poseidon_hashes.append(poseidon_result)
-
-    blocks_len = [len(block) for block in blocks]
-    blocks = [bytes_to_8_bytes_chunks_little(block) for block in blocks]
 
     chunk_input = {
         "mmr_last_root_poseidon": last_mmr_root["poseidon"],
@@ -114,8 +253,6 @@ def prepare_chunk_input(
         "block_n_plus_one_parent_hash_little_high": block_n_plus_one_parent_hash_little[
             1
         ],
-        "block_headers_array": blocks,
-        "bytes_len_array": blocks_len,
     }
 
     chunk_output = {
@@ -134,131 +271,791 @@ def prepare_chunk_input(
         "mmr_last_root_keccak_high": split_128(last_mmr_root["keccak"])[1],
         "mmr_last_len": last_mmr_size,
     }
+    return chunk_input, chunk_output
 
-    t1 = time.time()
-    print(f"\t\tPrepared chunk input in {t1-t0_db}s")
-    return chunk_input, chunk_output, (poseidon_hashes, keccak_hashes)
 
+def build_chunk_input(
+    last_peaks: dict,
+    last_mmr_size: int,
+    last_mmr_root: dict,
+    from_block_number_high: int,
+    to_block_number_low: int,
+    blocks: List[bytes],
+    hashes: Tuple[List[int], List[int]],
+) -> Tuple[dict, dict, Tuple[List[int], List[int]]]:
+    """
+    Chunk input and (partial) output from the headers returned by fetch_chunk_blocks and their hashes.
+    """
+    t0 = time.time()
+    chunk_input, chunk_output = chunk_fields(
+        last_peaks,
+        last_mmr_size,
+        last_mmr_root,
+        from_block_number_high,
+        to_block_number_low,
+        blocks[0],
+        blocks[-1],
+    )
+    blocks = blocks[:-1]
+    assert len(blocks) == from_block_number_high - to_block_number_low + 1
 
-def extend_mmr_poseidon(
-    hashes: list, peaks_positions: list, peaks: list, last_pos: int
-):
-    mmr = MMR(PoseidonHasher())
-    for i, pos in enumerate(peaks_positions):
-        mmr.pos_hash[pos] = peaks[i]
+    chunk_input["block_headers_array"] = HeaderWords(blocks)
+    chunk_input["bytes_len_array"] = [len(block) for block in blocks]
+
+    t1 = time.time()
+    print(f"\t\tPrepared chunk input in {t1-t0}s")
+    return chunk_input, chunk_output, hashes
 
-    mmr.last_pos = last_pos
 
-    for hash_val in reversed(hashes):
-        mmr.add(hash_val)
+def process_chunk(
+    chunk_input,
+    poseidon_block_hashes: list,
+    keccak_block_hashes: list,
+    keccak_thread: bool = False,
+) -> dict:
+    assert len(poseidon_block_hashes) == len(keccak_block_hashes)
+    mmr = DualMMRFrontier(
+        chunk_input["poseidon_mmr_last_peaks"],
+        [from_uint256(val) for val in chunk_input["keccak_mmr_last_peaks"]],
+        chunk_input["mmr_last_len"],
+        keccak_thread=keccak_thread,
+    )
+    mmr.extend(poseidon_block_hashes[::-1], keccak_block_hashes[::-1])
+    return frontier_data(mmr)
 
-    return (mmr.get_peaks(), mmr.get_root(), mmr.last_pos + 1)
 
+def frontier_data(mmr: DualMMRFrontier) -> dict:
+    poseidon_peaks, keccak_peaks = mmr.get_peaks()
+    poseidon_root, keccak_root = mmr.get_roots()
 
-def extend_mmr_keccak(hashes: list, peaks_positions: list, peaks: list, last_pos: int):
-    mmr = MMR(KeccakHasher())
-    for i, pos in enumerate(peaks_positions):
-        mmr.pos_hash[pos] = peaks[i]
+    return {
+        "last_peaks": {
+            "poseidon": poseidon_peaks,
+            "keccak": keccak_peaks,
+        },
+        "last_mmr_size": mmr.mmr_size,
+        "last_mmr_root": {
+            "poseidon": poseidon_root,
+            "keccak": keccak_root,
+        },
+    }
 
-    mmr.last_pos = last_pos
 
-    for hash_val in reversed(hashes):
-        mmr.add(hash_val)
+def load_persistent_mmrs(
+    conn: sqlite3.Connection,
+    initial_state: dict,
+    use_stored_state: bool,
+    from_block_number_high: int,
+) -> Tuple[dict, dict]:
+    """
+    Opens the Poseidon and Keccak MMRs persisted in the database, which must be waiting for
+    from_block_number_high as their next block.
+    Empty trees are seeded with the peaks of initial_state. Otherwise the stored trees are either
+    used as the initial state (use_stored_state) or checked against initial_state.
+    Returns the MMRs and the MMR state they hold, with the same structure as initial_params.
+    """
+    stores = open_mmr_node_stores(conn)
+    if len(stores["poseidon"]) != len(stores["keccak"]):
+        raise ValueError(
+            f"Persisted MMRs have different sizes: {len(stores['poseidon'])} (poseidon) and {len(stores['keccak'])} (keccak)"
+        )
+    if len(stores["poseidon"]) == 0:
+        peaks_positions = get_peaks(initial_state["mmr_size"])
+        for tree, store in stores.items():
+            for pos, peak in zip(peaks_positions, initial_state["mmr_peaks"][tree]):
+                store[pos] = peak
+        commit_node_stores(conn, list(stores.values()), from_block_number_high)
+    next_block = stores["poseidon"].next_block
+    if (
+        next_block != from_block_number_high
+        or stores["keccak"].next_block != next_block
+    ):
+        raise ValueError(
+            f"Persisted MMRs are waiting for block {next_block} (poseidon) and {stores['keccak'].next_block} (keccak), not for the start block {from_block_number_high}"
+        )
 
-    return (mmr.get_peaks(), mmr.get_root(), mmr.last_pos + 1)
+    mmrs = {
+        "poseidon": MMR(PoseidonHasher(), stores["poseidon"]),
+        "keccak": MMR(KeccakHasher(), stores["keccak"]),
+    }
+    state = {
+        "mmr_peaks": {tree: mmr.get_peaks() for tree, mmr in mmrs.items()},
+        "mmr_size": mmrs["poseidon"].last_pos + 1,
+        "mmr_roots": {tree: mmr.get_root() for tree, mmr in mmrs.items()},
+    }
+    if not use_stored_state and state != initial_state:
+        raise ValueError(
+            f"Persisted MMRs do not match the initial MMR state. Stored state: {state}"
+        )
+    return mmrs, state
 
 
-def process_chunk(
-    chunk_input, poseidon_block_hashes: list, keccak_block_hashes: list
+def extend_persistent_mmrs(
+    conn: sqlite3.Connection,
+    mmrs: dict,
+    poseidon_block_hashes: list,
+    keccak_block_hashes: list,
+    next_block: int,
 ) -> dict:
-    peaks_positions = get_peaks(chunk_input["mmr_last_len"])
+    """
+    Same as process_chunk, on the persisted MMRs. The new nodes of both trees are committed together,
+    with next_block, the next block to append once these ones are.
+    """
     assert len(poseidon_block_hashes) == len(keccak_block_hashes)
-    assert (
-        len(peaks_positions)
-        == len(chunk_input["poseidon_mmr_last_peaks"])
-        == len(chunk_input["keccak_mmr_last_peaks"])
+    mmrs["poseidon"].extend(poseidon_block_hashes[::-1])
+    mmrs["keccak"].extend(keccak_block_hashes[::-1])
+    commit_node_stores(conn, [mmr.pos_hash for mmr in mmrs.values()], next_block)
+    return {
+        "last_peaks": {tree: mmr.get_peaks() for tree, mmr in mmrs.items()},
+        "last_mmr_size": mmrs["poseidon"].last_pos + 1,
+        "last_mmr_root": {tree: mmr.get_root() for tree, mmr in mmrs.items()},
+    }
+
+
+def checkpoint_segments(
+    from_block_number_high: int, to_block_number_low: int, checkpoint_interval: int
+) -> List[Tuple[int, int]]:
+    """
+    Splits the blocks from from_block_number_high down to to_block_number_low into (high, low) segments
+    ending before each multiple of checkpoint_interval, so that the next block to append after
+    a segment is either a multiple of checkpoint_interval or the one below to_block_number_low.
+    """
+    segments = []
+    high = from_block_number_high
+    while high >= to_block_number_low:
+        low = to_block_number_low
+        if checkpoint_interval:
+            low = max(low, (high - 1) // checkpoint_interval * checkpoint_interval + 1)
+        segments.append((high, low))
+        high = low - 1
+    return segments
+
+
+def extend_with_checkpoints(
+    conn: sqlite3.Connection,
+    extend: Callable[[list, list], dict],
+    from_block_number_high: int,
+    poseidon_block_hashes: list,
+    keccak_block_hashes: list,
+    checkpoint_interval: int,
+    origin: Tuple[int, dict],
+) -> dict:
+    """
+    Appends the hashes of the blocks from from_block_number_high downwards (hashes in ascending
+    block order) with extend, which takes and returns the same as process_chunk without chunk_input.
+    A checkpoint of the run started at origin (start block, initial MMR state) is recorded after the last
+    block and each time the next block to append is a multiple of checkpoint_interval.
+    """
+    to_block_number_low = from_block_number_high - len(poseidon_block_hashes) + 1
+    for high, low in checkpoint_segments(
+        from_block_number_high, to_block_number_low, checkpoint_interval
+    ):
+        start, end = low - to_block_number_low, high - to_block_number_low + 1
+        data = extend(poseidon_block_hashes[start:end], keccak_block_hashes[start:end])
+        save_checkpoint(conn, origin, low - 1, data)
+    return data
+
+
+def save_checkpoint(
+    conn: sqlite3.Connection, origin: Tuple[int, dict], next_block: int, data: dict
+):
+    """
+    Records the MMR state of data (as returned by process_chunk) as a checkpoint of the run started at origin.
+    """
+    save_mmr_checkpoint(
+        conn,
+        origin,
+        next_block,
+        {
+            "mmr_peaks": data["last_peaks"],
+            "mmr_size": data["last_mmr_size"],
+            "mmr_roots": data["last_mmr_root"],
+        },
     )
 
-    with ProcessPoolExecutor(max_workers=2) as executor:
-        future_poseidon = executor.submit(
-            extend_mmr_poseidon,
-            poseidon_block_hashes,
-            peaks_positions,
-            chunk_input["poseidon_mmr_last_peaks"],
-            chunk_input["mmr_last_len"] - 1,
-        )
 
-        future_keccak = executor.submit(
-            extend_mmr_keccak,
-            keccak_block_hashes,
-            peaks_positions,
-            [from_uint256(val) for val in chunk_input["keccak_mmr_last_peaks"]],
-            chunk_input["mmr_last_len"] - 1,
+def persistent_extender(
+    conn: sqlite3.Connection, mmrs: dict, from_block_number_high: int
+) -> Callable:
+    """
+    Returns an extend function for extend_with_checkpoints over the persisted MMRs, appending the blocks
+    from from_block_number_high downwards.
+    """
+    next_block = from_block_number_high
+
+    def extend(poseidon_block_hashes: list, keccak_block_hashes: list) -> dict:
+        nonlocal next_block
+        next_block -= len(poseidon_block_hashes)
+        return extend_persistent_mmrs(
+            conn, mmrs, poseidon_block_hashes, keccak_block_hashes, next_block
         )
 
-        poseidon_result = future_poseidon.result()
-        keccak_result = future_keccak.result()
+    return extend
 
-    return {
-        "last_peaks": {
-            "poseidon": poseidon_result[0],
-            "keccak": keccak_result[0],
-        },
-        "last_mmr_size": poseidon_result[2],
-        "last_mmr_root": {
-            "poseidon": poseidon_result[1],
-            "keccak": keccak_result[1],
-        },
-    }
+
+def frontier_extender(last_peaks: dict, last_mmr_size: int) -> Callable:
+    """
+    Returns an extend function for extend_with_checkpoints over an in-memory DualMMRFrontier.
+    """
+    mmr = DualMMRFrontier(last_peaks["poseidon"], last_peaks["keccak"], last_mmr_size)
+
+    def extend(poseidon_block_hashes: list, keccak_block_hashes: list) -> dict:
+        mmr.extend(poseidon_block_hashes[::-1], keccak_block_hashes[::-1])
+        return frontier_data(mmr)
+
+    return extend
+
+
+def resume_from_checkpoint(
+    conn: sqlite3.Connection,
+    from_block_number_high: int,
+    initial_state: dict,
+    batch_size: int,
+    checkpoint_interval: int = None,
+    hashing: HashingService = None,
+    hash_cache: BlockHashCache = None,
+) -> Optional[Tuple[Tuple[int, dict], dict]]:
+    """
+    Returns the origin of the resumed run and the MMR state once all the blocks above from_block_number_high
+    are appended, starting from the nearest checkpoint of a run started from initial_state and replaying
+    the blocks between it and from_block_number_high, or None if there is no checkpoint to start from.
+    """
+    checkpoint = get_nearest_mmr_checkpoint(conn, from_block_number_high, initial_state)
+    if checkpoint is None:
+        return None
+    origin, next_block, state = checkpoint
+    print(
+        f"Resuming from the checkpoint at block {next_block}, MMR size {state['mmr_size']}"
+    )
+    extend = frontier_extender(state["mmr_peaks"], state["mmr_size"])
+    data = None
+    while next_block > from_block_number_high:
+        low = max(next_block - batch_size + 1, from_block_number_high + 1)
+        blocks = fetch_block_range_from_db(start=low, end=next_block, conn=conn)
+        assert (
+            len(blocks) == next_block - low + 1
+        ), f"Missing blocks between {low} and {next_block}"
+        if hash_cache is None:
+            poseidon_hashes, keccak_hashes = compute_block_hashes(
+                [b[1] for b in blocks], hashing
+            )
+        else:
+            poseidon_hashes, keccak_hashes = hash_cache.block_hashes(
+                conn, low, [b[1] for b in blocks], hashing
+            )
+        data = extend_with_checkpoints(
+            conn,
+            extend,
+            next_block,
+            poseidon_hashes,
+            keccak_hashes,
+            checkpoint_interval,
+            origin,
+        )
+        print(f"\tReplayed blocks from {next_block} to {low}")
+        next_block = low - 1
+    if data is not None:
+        state = {
+            "mmr_peaks": data["last_peaks"],
+            "mmr_size": data["last_mmr_size"],
+            "mmr_roots": data["last_mmr_root"],
+        }
+    return origin, state
 
 
 def compute_dynamic_batch_size(
-    from_block_number_high, initial_mmr_size: int, conn: sqlite3.Connection
+    from_block_number_high,
+    initial_mmr_size: int,
+    conn: sqlite3.Connection,
+    cost_model: ChunkCostModel = None,
+    window: BlockWindow = None,
 ) -> int:
     t0 = time.time()
-    keccak_rounds = MAX_KECCAK_ROUNDS + 1
-    batch_size = DYNAMIC_BATCH_SIZE_START
-    blocks = fetch_block_range_from_db(
-        end=from_block_number_high,
-        start=from_block_number_high - batch_size + 1,
-        conn=conn,
+    cost_model = cost_model or ChunkCostModel.load()
+    blocks = fetch_blocks(
+        from_block_number_high - DYNAMIC_BATCH_SIZE_START + 1,
+        from_block_number_high,
+        conn,
+        window,
     )
     bytes_lens = [len(block[1]) for block in blocks]
     bytes_lens.reverse()
-    keccaks_per_block = [
-        ((bytes_len // KECCAK_FULL_RATE_IN_BYTES) + 1) for bytes_len in bytes_lens
-    ]
-    peaks_positions = get_peaks(initial_mmr_size)
-    initial_pos = {}
-    for pos in peaks_positions:
-        initial_pos[pos] = pos
-
-    while keccak_rounds > MAX_KECCAK_ROUNDS:
-        mocked_mmr = MMR(MockedHasher())
-        mocked_mmr.last_pos = initial_mmr_size - 1
-        mocked_mmr.pos_hash = initial_pos
-        mocked_mmr.get_root()  # Initial root verification
-        for _ in range(batch_size):
-            mocked_mmr.add(0)
-        mocked_mmr.get_root()  # New root computation
-
-        keccak_rounds = sum(keccaks_per_block) + mocked_mmr._hasher.hash_count
-        if keccak_rounds > MAX_KECCAK_ROUNDS:
-            keccaks_per_block.pop()
-            batch_size = batch_size - 1
-            bytes_lens.pop()
+    batch_size = cost_model.max_batch_size(bytes_lens, initial_mmr_size)
 
     print(f"Computed batch size: {batch_size} in {time.time()-t0}s")
-    print(f"Predicted # keccak rounds: {keccak_rounds}")
+    predicted = cost_model.predict(
+        chunk_features(bytes_lens[:batch_size], initial_mmr_size)
+    )
+    print(
+        f"Predicted resources: { {name: round(value) for name, value in predicted.items()} }"
+    )
     return batch_size
 
 
+def plan_chunks(
+    conn: sqlite3.Connection,
+    from_block_number_high: int,
+    to_block_number_low: int,
+    batch_size: int,
+    mmr_size: int,
+    cost_model: ChunkCostModel = None,
+    window: BlockWindow = None,
+) -> Iterator[Tuple[int, int]]:
+    """
+    Yields the (from_block_number_high, to_block_number_low) ranges of the chunks of a run, with dynamic
+    batch sizes if a cost_model is given. The MMR size before each chunk only depends on the number of
+    blocks appended so far, so the ranges are known before any block is hashed.
+    """
+    leaf_count = mmr_size_to_leaf_count(mmr_size)
+    while from_block_number_high >= to_block_number_low:
+        if cost_model is not None:
+            batch_size = compute_dynamic_batch_size(
+                from_block_number_high,
+                leaf_count_to_mmr_size(leaf_count),
+                conn,
+                cost_model,
+                window,
+            )
+        if batch_size < 1:
+            raise ValueError(
+                f"Batch size {batch_size} for the chunk from block {from_block_number_high}"
+            )
+        to_block_number_batch_low = max(
+            from_block_number_high - batch_size + 1, to_block_number_low
+        )
+        yield from_block_number_high, to_block_number_batch_low
+        leaf_count += from_block_number_high - to_block_number_batch_low + 1
+        from_block_number_high = from_block_number_high - batch_size
+
+
+def read_chunks(
+    conn: sqlite3.Connection,
+    plan: dict,
+    hashing: HashingService,
+    hash_cache: BlockHashCache = None,
+) -> Iterator[Tuple[int, int, List[bytes], Tuple[List[int], List[int]]]]:
+    """
+    Yields (from_block_number_high, to_block_number_low, headers, hashes) for each chunk of plan
+    (plan_chunks arguments), one stage after the other. Batch sizing and chunks read the blocks table
+    through the same BlockWindow.
+    """
+    window = BlockWindow(conn)
+    for high, low in plan_chunks(conn, window=window, **plan):
+        blocks = fetch_chunk_blocks(high, low, conn, window)
+        if hash_cache is None:
+            hashes = compute_block_hashes(blocks[:-1], hashing)
+        else:
+            hashes = hash_cache.block_hashes(conn, low, blocks[:-1], hashing)
+        yield high, low, blocks, hashes
+    print(window.report())
+
+
+def read_chunks_pipelined(
+    conn: sqlite3.Connection,
+    plan: dict,
+    hashing: HashingService,
+    hash_cache: BlockHashCache = None,
+    depth: int = PIPELINE_DEPTH,
+) -> Iterator[Tuple[int, int, List[bytes], Tuple[List[int], List[int]]]]:
+    """
+    Same as read_chunks, the next chunks being read from the database by a thread (with its own connection)
+    and hashed by the hashing service while the current one goes through the MMR stage.
+    Up to depth chunks are read or hashed ahead. The cached hashes are looked up by the reader thread
+    and the new ones stored from conn.
+    If the caller stops early (error or generator closed), the reader thread is stopped and the hashing
+    of the chunks read ahead is cancelled.
+    """
+    chunks = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        """
+        Queues item unless the consumer is gone, returns False in that case.
+        """
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=PIPELINE_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            conn = create_connection()  # The caller's connection belongs to its thread.
+            window = BlockWindow(conn)
+            try:
+                for high, low in plan_chunks(conn, window=window, **plan):
+                    blocks = fetch_chunk_blocks(high, low, conn, window)
+                    if hash_cache is None:
+                        cached, to_hash = {}, list(range(low, high + 1))
+                    else:
+                        cached, to_hash = hash_cache.lookup(conn, low, len(blocks) - 1)
+                    if not put((high, low, blocks, cached, to_hash)):
+                        return
+            finally:
+                conn.close()
+            print(window.report())
+            put(None)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    in_flight = deque()
+    done = False
+    try:
+        while True:
+            while not done and len(in_flight) <= depth:
+                item = chunks.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item is None:
+                    done = True
+                    break
+                high, low, blocks, cached, to_hash = item
+                futures = hashing.submit_blocks([blocks[n - low] for n in to_hash])
+                in_flight.append((high, low, blocks, cached, to_hash, futures))
+            if not in_flight:
+                return
+            high, low, blocks, cached, to_hash, futures = in_flight.popleft()
+            hashes = hashing.collect(futures)
+            if hash_cache is not None:
+                hashes = hash_cache.merge(
+                    conn, low, len(blocks) - 1, cached, to_hash, hashes
+                )
+            yield high, low, blocks, hashes
+    finally:
+        stop.set()
+        for *_, futures in in_flight:
+            for future in futures:
+                future.cancel()
+        thread.join()
+
+
+class ChunkFiles:
+    """
+    Input and output files of the chunks in directory : blocks_{high}_{low}_{input|output}.json,
+    compact (no whitespace) or indented as json.dump(indent=4), with a .gz extension if compressed.
+    """
+
+    def __init__(self, directory: str, compact: bool = True, compress: bool = False):
+        self.directory = directory
+        self.compact = compact
+        self.compress = compress
+
+    def path(
+        self, from_block_number_high: int, to_block_number_low: int, kind: str
+    ) -> str:
+        extension = ".json.gz" if self.compress else ".json"
+        return f"{self.directory}blocks_{from_block_number_high}_{to_block_number_low}_{kind}{extension}"
+
+    def paths(self, from_block_number_high: int, to_block_number_low: int) -> dict:
+        return {
+            kind: self.path(from_block_number_high, to_block_number_low, kind)
+            for kind in ("input", "output")
+        }
+
+    def write(
+        self,
+        from_block_number_high: int,
+        to_block_number_low: int,
+        kind: str,
+        data: dict,
+    ):
+        write_to_json_streaming(
+            self.path(from_block_number_high, to_block_number_low, kind),
+            data,
+            self.compact,
+        )
+
+
+class JsonWriter:
+    """
+    Writes JSON files with write (ChunkFiles.write) in a thread, in submission order. Other calls
+    (such as manifest updates) can be queued after the writes with submit.
+    close waits for the pending writes and raises the first write error, if any, or only prints it
+    if raise_errors is False.
+    """
+
+    def __init__(
+        self, write: Callable[..., None], max_pending: int = 2 * PIPELINE_DEPTH
+    ):
+        self._write = write
+        self._writes = queue.Queue(maxsize=max_pending)
+        self._errors = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._writes.get()
+            if item is None:
+                return
+            if self._errors:
+                continue
+            try:
+                fn, args = item
+                fn(*args)
+            except Exception as e:
+                self._errors.append(e)
+
+    def write(self, *args):
+        self.submit(self._write, *args)
+
+    def submit(self, fn: Callable, *args):
+        if self._errors:
+            raise self._errors[0]
+        self._writes.put((fn, args))
+
+    def close(self, raise_errors: bool = True):
+        self._writes.put(None)
+        self._thread.join()
+        if self._errors:
+            if raise_errors:
+                raise self._errors[0]
+            print(f"Failed to write a chunk file: {self._errors[0]!r}")
+
+
+def cached_block_hashes(
+    conn: sqlite3.Connection, to_block_number_low: int, from_block_number_high: int
+) -> Tuple[List[int], List[int]]:
+    """
+    Poseidon and Keccak hashes of the blocks from to_block_number_low to from_block_number_high,
+    all of them being in the block_hashes table.
+    """
+    cached = fetch_block_hashes(to_block_number_low, from_block_number_high, conn)
+    blocks_range = range(to_block_number_low, from_block_number_high + 1)
+    assert len(cached) == len(
+        blocks_range
+    ), f"Missing block hashes between {to_block_number_low} and {from_block_number_high}"
+    return (
+        [cached[block_number][0] for block_number in blocks_range],
+        [cached[block_number][1] for block_number in blocks_range],
+    )
+
+
+def set_new_mmr_state(chunk_output: dict, data: dict):
+    """
+    Completes chunk_output with the MMR state after the chunk (process_chunk output).
+    """
+    chunk_output["new_mmr_root_poseidon"] = data["last_mmr_root"]["poseidon"]
+    (
+        chunk_output["new_mmr_root_keccak_low"],
+        chunk_output["new_mmr_root_keccak_high"],
+    ) = split_128(data["last_mmr_root"]["keccak"])
+    chunk_output["new_mmr_len"] = data["last_mmr_size"]
+
+
+def hash_block_range(
+    conn: sqlite3.Connection,
+    start: int,
+    end: int,
+    hashing: HashingService,
+    hash_cache: BlockHashCache,
+    slice_size: int = HASH_SLICE_SIZE,
+):
+    """
+    Makes sure the hashes of the blocks from start to end are in the cache, streaming the blocks
+    by slices. The next slice is read and submitted while the workers hash the current one.
+    """
+    pending = None
+    for low in range(start, end + 1, slice_size):
+        high = min(low + slice_size - 1, end)
+        blocks = fetch_block_range_from_db(start=low, end=high, conn=conn)
+        assert len(blocks) == high - low + 1, f"Missing blocks between {low} and {high}"
+        cached, to_hash = hash_cache.lookup(conn, low, len(blocks))
+        futures = hashing.submit_blocks([blocks[n - low][1] for n in to_hash])
+        if pending is not None:
+            hash_cache.merge(conn, *pending[:-1], hashing.collect(pending[-1]))
+        pending = (low, len(blocks), cached, to_hash, futures)
+        print(f"\tHashing blocks from {high} to {low}")
+    if pending is not None:
+        hash_cache.merge(conn, *pending[:-1], hashing.collect(pending[-1]))
+
+
+def write_chunk_files(
+    from_block_number_high: int,
+    to_block_number_low: int,
+    last_data: dict,
+    data: dict,
+    files: ChunkFiles,
+):
+    """
+    Writes the input and output files of a chunk from the MMR states before (last_data) and
+    after it (data), with the same structure as the process_chunk output.
+    """
+    conn = create_connection()
+    try:
+        blocks = fetch_chunk_blocks(from_block_number_high, to_block_number_low, conn)
+    finally:
+        conn.close()
+    chunk_input, chunk_output, _ = build_chunk_input(
+        last_data["last_peaks"],
+        last_data["last_mmr_size"],
+        last_data["last_mmr_root"],
+        from_block_number_high,
+        to_block_number_low,
+        blocks,
+        None,
+    )
+    set_new_mmr_state(chunk_output, data)
+    files.write(from_block_number_high, to_block_number_low, "input", chunk_input)
+    files.write(from_block_number_high, to_block_number_low, "output", chunk_output)
+
+
+def _write_chunk_files_task(args: tuple):
+    return write_chunk_files(*args)
+
+
+def prepare_two_phase(
+    conn: sqlite3.Connection,
+    plan: dict,
+    hashing: HashingService,
+    hash_cache: BlockHashCache,
+    extend: Callable[[list, list], dict],
+    state: tuple,
+    checkpoint_interval: int,
+    origin: Tuple[int, dict],
+    files: ChunkFiles,
+    record: Callable[[int, int, dict], None],
+) -> tuple:
+    """
+    Two-phase preparation of the chunks of plan (plan_chunks arguments) :
+        1. all the blocks of the range are hashed in one pass into the hashes cache,
+        2. one MMR sweep over the cached hashes records the MMR state at each chunk boundary,
+        3. the input and output files of the chunks are written in parallel.
+    state is (last_peaks, last_mmr_size, last_mmr_roots) before the first chunk, the state after
+    the last one is returned. record(high, low, data) is called in order once the files of a chunk are written.
+    """
+    t0 = time.time()
+    hash_block_range(
+        conn,
+        plan["to_block_number_low"],
+        plan["from_block_number_high"],
+        hashing,
+        hash_cache,
+    )
+    t1 = time.time()
+    print(f"\tHashed the blocks in {t1-t0}s")
+
+    last_peaks, last_mmr_size, last_mmr_roots = state
+    last_data = {
+        "last_peaks": last_peaks,
+        "last_mmr_size": last_mmr_size,
+        "last_mmr_root": last_mmr_roots,
+    }
+    boundaries = []
+    window = BlockWindow(conn)
+    for high, low in plan_chunks(conn, window=window, **plan):
+        poseidon_hashes, keccak_hashes = cached_block_hashes(conn, low, high)
+        data = extend_with_checkpoints(
+            conn,
+            extend,
+            high,
+            poseidon_hashes,
+            keccak_hashes,
+            checkpoint_interval,
+            origin,
+        )
+        boundaries.append((high, low, last_data, data, files))
+        last_data = data
+    t2 = time.time()
+    print(f"\tSwept the MMRs over {len(boundaries)} chunks in {t2-t1}s")
+
+    with ProcessPoolExecutor() as executor:
+        for boundary, _ in zip(
+            boundaries, executor.map(_write_chunk_files_task, boundaries)
+        ):
+            high, low, _, data, _ = boundary
+            record(high, low, data)
+    print(f"\tWrote the chunk files in {time.time()-t2}s")
+    return (
+        last_data["last_peaks"],
+        last_data["last_mmr_size"],
+        last_data["last_mmr_root"],
+    )
+
+
+def iter_header_words(
+    conn: sqlite3.Connection, start: int, end: int, slice_size: int
+) -> Iterator[HeaderWords]:
+    """
+    Yields the HeaderWords of the blocks from start to end, by slices of slice_size blocks.
+    """
+    for low in range(start, end + 1, slice_size):
+        high = min(low + slice_size - 1, end)
+        blocks = fetch_block_range_from_db(start=low, end=high, conn=conn)
+        assert len(blocks) == high - low + 1, f"Missing blocks between {low} and {high}"
+        yield HeaderWords(block[1] for block in blocks)
+
+
+def fetch_block(conn: sqlite3.Connection, block_number: int) -> bytes:
+    blocks = fetch_block_range_from_db(start=block_number, end=block_number, conn=conn)
+    assert len(blocks) == 1, f"Block {block_number} is not in the database"
+    return blocks[0][1]
+
+
+def stream_chunk(
+    conn: sqlite3.Connection,
+    state: tuple,
+    from_block_number_high: int,
+    to_block_number_low: int,
+    hashing: HashingService,
+    hash_cache: BlockHashCache,
+    extend: Callable[[list, list], dict],
+    checkpoint_interval: int,
+    origin: Tuple[int, dict],
+    slice_size: int,
+    files: ChunkFiles,
+) -> dict:
+    """
+    Writes the files of a chunk holding at most about slice_size blocks in memory, whatever the chunk size :
+    the blocks are hashed into the hashes cache by slices, the input file is written while the headers
+    are read by slices, then the MMRs are extended with the cached hashes by slices, from the highest
+    block down. The checkpoints are recorded at the same blocks as in the other modes, whatever slice_size.
+    state is (last_peaks, last_mmr_size, last_mmr_roots), returns the same as process_chunk.
+    """
+    high, low = from_block_number_high, to_block_number_low
+    hash_block_range(conn, low, high, hashing, hash_cache, slice_size)
+
+    chunk_input, chunk_output = chunk_fields(
+        *state, high, low, fetch_block(conn, low), fetch_block(conn, high + 1)
+    )
+    chunk_input["block_headers_array"] = iter_header_words(conn, low, high, slice_size)
+    chunk_input["bytes_len_array"] = iter_block_lengths(low, high, conn)
+    files.write(high, low, "input", chunk_input)
+
+    for segment_high, segment_low in checkpoint_segments(
+        high, low, checkpoint_interval
+    ):
+        for slice_high in range(segment_high, segment_low - 1, -slice_size):
+            slice_low = max(slice_high - slice_size + 1, segment_low)
+            data = extend(*cached_block_hashes(conn, slice_low, slice_high))
+        save_checkpoint(conn, origin, segment_low - 1, data)
+    set_new_mmr_state(chunk_output, data)
+    files.write(high, low, "output", chunk_output)
+    return data
+
+
 def prepare_full_chain_inputs(
     from_block_number_high: int,
     to_block_number_low: int = 0,
     batch_size: int = 50,
     dynamic: bool = False,
     initial_params: dict = None,
+    persistent_mmr: bool = False,
+    checkpoint_interval: int = None,
+    resume: bool = False,
+    resume_manifest: bool = False,
+    pipelined: bool = False,
+    two_phase: bool = False,
+    streaming: bool = False,
+    memory_budget: int = STREAMING_MEMORY_BUDGET,
+    compact_json: bool = True,
+    compress_json: bool = False,
+    cache_hashes: bool = True,
+    verify_hash_sample: int = 0,
 ):
     t0 = time.time()
     """Main function to prepare the full chain inputs."""
@@ -269,6 +1066,21 @@ def prepare_full_chain_inputs(
     if batch_size <= 0:
         raise ValueError("Batch size should be greater than 0")
 
+    if streaming and (pipelined or two_phase):
+        raise ValueError(
+            "The streaming mode cannot be combined with the pipelined or two-phase modes"
+        )
+
+    if (streaming or two_phase) and not cache_hashes:
+        raise ValueError(
+            "The streaming and two-phase modes go through the hashes cache, they cannot be used with cache_hashes=False"
+        )
+
+    if resume_manifest and (resume or persistent_mmr):
+        raise ValueError(
+            "Resuming from the manifest cannot be combined with checkpoints resuming or persistent MMRs"
+        )
+
     # Default initialization values
     if initial_params is None:
         initial_peaks = {
@@ -300,81 +1112,210 @@ def prepare_full_chain_inputs(
 
     PATH = "src/single_chunk_processor/data/"
     create_directory(PATH)
+    files = ChunkFiles(PATH, compact_json, compress_json)
 
-    with create_connection() as conn:
+    with create_connection() as conn, HashingService() as hashing:
         (_, max_block) = get_min_max_block_numbers(conn)
         if from_block_number_high > max_block - 1:
             raise ValueError(
                 f"Start block {from_block_number_high} is not in the database. Max block number supported is {max_block-1}\n"
                 f"Consider updating the database with 'make db-update'",
             )
-        if dynamic:
-            batch_size = compute_dynamic_batch_size(
-                from_block_number_high, initial_mmr_size, conn
+        setup_checkpoints_table(conn)
+        setup_block_hashes_table(conn)
+        hash_cache = BlockHashCache(verify_hash_sample) if cache_hashes else None
+        origin = None
+        if resume:
+            if persistent_mmr:
+                raise ValueError(
+                    "Resuming from a checkpoint is not supported with persistent MMRs, which resume by themselves"
+                )
+            resumed = resume_from_checkpoint(
+                conn,
+                from_block_number_high,
+                {"mmr_size": initial_mmr_size, "mmr_roots": initial_mmr_roots},
+                batch_size,
+                checkpoint_interval,
+                hashing,
+                hash_cache,
+            )
+            if resumed is not None:
+                origin, state = resumed
+                last_peaks = state["mmr_peaks"]
+                last_mmr_size = state["mmr_size"]
+                last_mmr_roots = state["mmr_roots"]
+            else:
+                print("No checkpoint to resume from, using the initial MMR state")
+        if persistent_mmr:
+            mmrs, state = load_persistent_mmrs(
+                conn,
+                {
+                    "mmr_peaks": initial_peaks,
+                    "mmr_size": initial_mmr_size,
+                    "mmr_roots": initial_mmr_roots,
+                },
+                use_stored_state=initial_params is None,
+                from_block_number_high=from_block_number_high,
             )
+            last_peaks = state["mmr_peaks"]
+            last_mmr_size = state["mmr_size"]
+            last_mmr_roots = state["mmr_roots"]
+            print(f"Using the MMRs persisted in the database, size {last_mmr_size}")
+        run = {
+            "from_block_number_high": from_block_number_high,
+            "to_block_number_low": to_block_number_low,
+            "batch_size": batch_size,
+            "dynamic": dynamic,
+            "compact_json": compact_json,
+            "compress_json": compress_json,
+            "initial_state": {
+                "mmr_peaks": last_peaks,
+                "mmr_size": last_mmr_size,
+                "mmr_roots": last_mmr_roots,
+            },
+        }
+        # The checkpoints are recorded under the run they continue, so that runs from
+        # other start blocks or initial states can neither overwrite nor resume from them.
+        if origin is None:
+            origin = (from_block_number_high, run["initial_state"])
+        if resume_manifest:
+            manifest = RunManifest.resume(PATH + MANIFEST_FILENAME, run)
+            state = manifest.last_state()
+            if state is not None:
+                last_peaks = state["mmr_peaks"]
+                last_mmr_size = state["mmr_size"]
+                last_mmr_roots = state["mmr_roots"]
+            from_block_number_high = manifest.next_block()
+        else:
+            manifest = RunManifest.create(PATH + MANIFEST_FILENAME, run)
 
-        to_block_number_batch_low = max(
-            from_block_number_high - batch_size + 1, to_block_number_low
-        )
+        def record(high: int, low: int, data: dict):
+            manifest.record_chunk(
+                high,
+                low,
+                {
+                    "mmr_peaks": data["last_peaks"],
+                    "mmr_size": data["last_mmr_size"],
+                    "mmr_roots": data["last_mmr_root"],
+                },
+                files.paths(high, low),
+            )
+
+        if persistent_mmr:
+            extend = persistent_extender(conn, mmrs, from_block_number_high)
+        else:
+            extend = frontier_extender(last_peaks, last_mmr_size)
+        plan = {
+            "from_block_number_high": from_block_number_high,
+            "to_block_number_low": to_block_number_low,
+            "batch_size": batch_size,
+            "mmr_size": last_mmr_size,
+            "cost_model": ChunkCostModel.load() if dynamic else None,
+        }
 
         print(
             f"Preparing inputs and precomputing outputs for blocks from {from_block_number_high} to {to_block_number_low} with batch size {batch_size if not dynamic else 'dynamic'}"
         )
 
-        while from_block_number_high >= to_block_number_low:
-            print(
-                f"\tPreparing input and pre-computing output for blocks from {from_block_number_high} to {to_block_number_batch_low}"
-            )
-
-            (chunk_input, chunk_output, hashes) = prepare_chunk_input(
-                last_peaks,
-                last_mmr_size,
-                last_mmr_roots,
-                from_block_number_high,
-                to_block_number_batch_low,
-                conn=conn,
-            )
-
-            # Save the chunk input data
-            write_to_json(
-                f"{PATH}blocks_{from_block_number_high}_{to_block_number_batch_low}_input.json",
-                chunk_input,
+        if streaming:
+            slice_size = max(1, memory_budget // STREAMING_BYTES_PER_BLOCK)
+            for high, low in plan_chunks(conn, **plan):
+                print(
+                    f"\tStreaming input and pre-computing output for blocks from {high} to {low}"
+                )
+                data = stream_chunk(
+                    conn,
+                    (last_peaks, last_mmr_size, last_mmr_roots),
+                    high,
+                    low,
+                    hashing,
+                    hash_cache,
+                    extend,
+                    checkpoint_interval,
+                    origin,
+                    slice_size,
+                    files,
+                )
+                record(high, low, data)
+                last_peaks = data["last_peaks"]
+                last_mmr_size = data["last_mmr_size"]
+                last_mmr_roots = data["last_mmr_root"]
+        elif two_phase:
+            last_peaks, last_mmr_size, last_mmr_roots = prepare_two_phase(
+                conn,
+                plan,
+                hashing,
+                hash_cache,
+                extend,
+                (last_peaks, last_mmr_size, last_mmr_roots),
+                checkpoint_interval,
+                origin,
+                files,
+                record,
             )
+        else:
+            if pipelined:
+                chunks = read_chunks_pipelined(conn, plan, hashing, hash_cache)
+                writer = JsonWriter(files.write)
+                write = writer.write
+                record_written = partial(writer.submit, record)
+            else:
+                chunks = read_chunks(conn, plan, hashing, hash_cache)
+                writer = None
+                write = files.write
+                record_written = record
 
             try:
-                data = process_chunk(chunk_input, hashes[0], hashes[1])
-            except Exception as e:
-                print(f"Failed to process chunk: {e}")
-                raise
+                for high, low, blocks, hashes in chunks:
+                    print(
+                        f"\tPreparing input and pre-computing output for blocks from {high} to {low}"
+                    )
+                    chunk_input, chunk_output, hashes = build_chunk_input(
+                        last_peaks,
+                        last_mmr_size,
+                        last_mmr_roots,
+                        high,
+                        low,
+                        blocks,
+                        hashes,
+                    )
 
-            last_peaks = data["last_peaks"]
-            last_mmr_size = data["last_mmr_size"]
-            last_mmr_roots = data["last_mmr_root"]
-
-            chunk_output["new_mmr_root_poseidon"] = last_mmr_roots["poseidon"]
-            (
-                chunk_output["new_mmr_root_keccak_low"],
-                chunk_output["new_mmr_root_keccak_high"],
-            ) = split_128(last_mmr_roots["keccak"])
-            chunk_output["new_mmr_len"] = last_mmr_size
-
-            # Save the chunk output data
-            write_to_json(
-                f"{PATH}blocks_{from_block_number_high}_{to_block_number_batch_low}_output.json",
-                chunk_output,
-            )
+                    # Save the chunk input data
+                    write(high, low, "input", chunk_input)
 
-            from_block_number_high = from_block_number_high - batch_size
+                    try:
+                        data = extend_with_checkpoints(
+                            conn,
+                            extend,
+                            high,
+                            hashes[0],
+                            hashes[1],
+                            checkpoint_interval,
+                            origin,
+                        )
+                    except Exception as e:
+                        print(f"Failed to process chunk: {e}")
+                        raise
 
-            if dynamic:
-                batch_size = compute_dynamic_batch_size(
-                    from_block_number_high, last_mmr_size, conn
-                )
+                    last_peaks = data["last_peaks"]
+                    last_mmr_size = data["last_mmr_size"]
+                    last_mmr_roots = data["last_mmr_root"]
+                    set_new_mmr_state(chunk_output, data)
 
-            to_block_number_batch_low = max(
-                from_block_number_high - batch_size + 1, to_block_number_low
-            )
-            print(to_block_number_batch_low)
+                    # Save the chunk output data
+                    write(high, low, "output", chunk_output)
+                    record_written(high, low, data)
+            except BaseException:
+                # The error of the MMR stage is the one raised, a write error is only reported.
+                if writer is not None:
+                    writer.close(raise_errors=False)
+                raise
+            finally:
+                chunks.close()
+            if writer is not None:
+                writer.close()
+
+        print(hashing.report())
 
     print(f"Inputs and outputs for requested blocks are ready and saved to {PATH}\n")
     print(f"Time taken : {time.time() - t0}s")
@@ -387,9 +1328,23 @@ def prepare_full_chain_inputs(
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prepares the chunk processor inputs and outputs for a range of blocks."
+    )
+    parser.add_argument("--from-block-number-high", type=int, default=99999)
+    parser.add_argument("--to-block-number-low", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=100000)
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"continue an interrupted run from the last chunk completed in {MANIFEST_FILENAME}",
+    )
+    args = parser.parse_args()
     output = prepare_full_chain_inputs(
-        from_block_number_high=99999,
-        to_block_number_low=0,
-        batch_size=100000,
+        from_block_number_high=args.from_block_number_high,
+        to_block_number_low=args.to_block_number_low,
+        batch_size=args.batch_size,
         dynamic=False,
+        streaming=True,
+        resume_manifest=args.resume,
     )
@@ -0,0 +1,149 @@
+#!venv/bin/python3
+"""
+Manifest of a prepare_full_chain_inputs run, written next to the chunk files, so that an interrupted
+run can be resumed from its last completed chunk instead of from scratch.
+It is a JSON lines file : the first line holds the run parameters and its initial MMR state, then a line
+is appended, and flushed to disk, once the files of each chunk are written : the range of the chunk,
+the MMR state after it and the sha256 of its files.
+"""
+
+import os
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+MANIFEST_FILENAME = "manifest.jsonl"
+
+
+def file_sha256(path: str) -> str:
+    """
+    Hex sha256 of the file at path, read by blocks of 1 MiB.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class RunManifest:
+    """
+    Manifest of the run (its parameters, a dict) at path, with the chunks completed so far.
+    """
+
+    def __init__(self, path: str, run: dict, chunks: List[dict] = None):
+        self.path = path
+        self.run = run
+        self.chunks = chunks or []
+
+    @classmethod
+    def create(cls, path: str, run: dict) -> "RunManifest":
+        """
+        Starts the manifest of a new run, replacing any previous one.
+        """
+        manifest = cls(path, run)
+        manifest._rewrite()
+        return manifest
+
+    @classmethod
+    def resume(cls, path: str, run: dict) -> "RunManifest":
+        """
+        Loads the manifest of an interrupted run, which must have the same parameters as run.
+        Only its chunks following each other from the start of the run and whose files are unchanged
+        are kept, the manifest is rewritten without the others. A missing manifest starts a new run.
+        """
+        if not os.path.exists(path):
+            print(f"No manifest at {path}, starting a new run")
+            return cls.create(path, run)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        recorded_run = json.loads(lines[0])
+        if recorded_run != json.loads(json.dumps(run)):
+            raise ValueError(
+                f"The manifest at {path} is for another run: {recorded_run} != {run}"
+            )
+        manifest = cls(path, run)
+        for line in lines[1:]:
+            try:
+                chunk = json.loads(line)
+            except json.JSONDecodeError:
+                # Line torn by the interruption
+                break
+            if not manifest._is_next_valid_chunk(chunk):
+                break
+            manifest.chunks.append(chunk)
+        manifest._rewrite()
+        print(
+            f"Resuming from the manifest at {path}: {len(manifest.chunks)} chunks already prepared"
+        )
+        return manifest
+
+    def _is_next_valid_chunk(self, chunk: dict) -> bool:
+        expected_high = (
+            self.chunks[-1]["to_block_number_low"] - 1
+            if self.chunks
+            else self.run["from_block_number_high"]
+        )
+        if chunk["from_block_number_high"] != expected_high:
+            return False
+        directory = os.path.dirname(self.path)
+        for kind, file in chunk["files"].items():
+            path = os.path.join(directory, file["name"])
+            if not os.path.exists(path) or file_sha256(path) != file["sha256"]:
+                print(f"\tThe {kind} file {path} is missing or was modified")
+                return False
+        return True
+
+    def _rewrite(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for line in [self.run] + self.chunks:
+                f.write(json.dumps(line) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def record_chunk(
+        self,
+        from_block_number_high: int,
+        to_block_number_low: int,
+        state: dict,
+        files: Dict[str, str],
+    ):
+        """
+        Appends a chunk, once its files (paths by kind) are written. state is the MMR state after the chunk
+        (mmr_peaks, mmr_size, mmr_roots).
+        """
+        chunk = {
+            "from_block_number_high": from_block_number_high,
+            "to_block_number_low": to_block_number_low,
+            "batch_size": from_block_number_high - to_block_number_low + 1,
+            **state,
+            "files": {
+                kind: {"name": os.path.basename(path), "sha256": file_sha256(path)}
+                for kind, path in files.items()
+            },
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(chunk) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.chunks.append(chunk)
+
+    def last_state(self) -> Optional[dict]:
+        """
+        MMR state after the last completed chunk, None if there is none.
+        """
+        if not self.chunks:
+            return None
+        return {
+            key: self.chunks[-1][key] for key in ("mmr_peaks", "mmr_size", "mmr_roots")
+        }
+
+    def next_block(self) -> int:
+        """
+        Highest block of the next chunk to prepare.
+        """
+        if not self.chunks:
+            return self.run["from_block_number_high"]
+        return self.chunks[-1]["to_block_number_low"] - 1
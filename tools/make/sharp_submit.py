@@ -15,7 +15,14 @@ from tools.make.sharp_submit_params import (
     FILENAME_DOT_CAIRO_PATH,
     COMPILED_CAIRO_FILE_PATH,
 )
-from tools.py.utils import write_to_json, clear_directory
+from tools.py.utils import (
+    write_to_json,
+    clear_directory,
+    is_json_file,
+    json_file_stem,
+    plain_json_file,
+    read_json,
+)
 
 N_CORES = os.cpu_count()
 
@@ -61,7 +68,7 @@ PROGRAM_HASH = int(
 )
 
 
-input_files = [f for f in os.listdir(INPUT_PATH) if f.endswith("_input.json")]
+input_files = [f for f in os.listdir(INPUT_PATH) if is_json_file(f, "_input")]
 input_files_paths = [INPUT_PATH + f for f in input_files]
 
 
@@ -78,7 +85,7 @@ def split_inputs_evenly():
 
     # List all _input.json files and sort them based on the main number
     all_input_files = sorted(
-        [f for f in os.listdir(INPUT_PATH) if f.endswith("_input.json")],
+        [f for f in os.listdir(INPUT_PATH) if is_json_file(f, "_input")],
         key=get_sort_key,
         reverse=True,  # Descending order
     )
@@ -126,17 +133,28 @@ def split_inputs_evenly():
                 )
 
 
+def get_pie_path(input_file_path) -> str:
+    """Path of the pie object of an input file (.json or .json.gz), <input_filename>_pie.zip"""
+    return json_file_stem(input_file_path).removesuffix("_input") + "_pie.zip"
+
+
+def get_expected_output(input_file_path) -> dict:
+    """Precomputed output of an input file, in its _output file."""
+    return read_json(input_file_path.replace("_input.json", "_output.json"))
+
+
 def run_cairo_program(input_file_path) -> dict:
     """
     Run the cairo program on the given input file and return the program's output
     as a dictionary.
     Write the pie object to a file named <input_filename>_pie.zip to the same directory as the input file.
     """
-    pie_output_path = input_file_path.replace("_input.json", "_pie.zip")
-    cmd = f"cairo-run --program={COMPILED_CAIRO_FILE_PATH} --program_input={input_file_path} --layout=starknet_with_keccak --print_output"
-    cmd += f" --cairo_pie_output {pie_output_path}"
-    stream = os.popen(cmd)
-    output = stream.read()
+    pie_output_path = get_pie_path(input_file_path)
+    with plain_json_file(input_file_path) as program_input:
+        cmd = f"cairo-run --program={COMPILED_CAIRO_FILE_PATH} --program_input={program_input} --layout=starknet_with_keccak --print_output"
+        cmd += f" --cairo_pie_output {pie_output_path}"
+        stream = os.popen(cmd)
+        output = stream.read()
 
     return parse_cairo_output(output)
 
@@ -190,7 +208,7 @@ def submit_pie_to_sharp(filename):
             "cairo-sharp",
             "submit",
             "--cairo_pie",
-            f"{INPUT_PATH}{filename.removesuffix('_input.json')}_pie.zip",
+            get_pie_path(f"{INPUT_PATH}{filename}"),
         ],
         text=True,
         capture_output=True,
@@ -234,7 +252,7 @@ if __name__ == "__main__":
         def run_for_core(core_num):
             core_input_path = f"{INPUT_PATH}{core_num}/"
             core_input_files = sorted(
-                [f for f in os.listdir(core_input_path) if f.endswith("_input.json")],
+                [f for f in os.listdir(core_input_path) if is_json_file(f, "_input")],
                 key=get_sort_key,
                 reverse=True,
             )
@@ -258,10 +276,8 @@ if __name__ == "__main__":
                 )
 
                 # Check the output right inside this core
-                expected_output = json.load(
-                    open(input_filepath.replace("_input", "_output"))
-                )
-                pie_path = input_filepath.replace("_input.json", "_pie.zip")
+                expected_output = get_expected_output(input_filepath)
+                pie_path = get_pie_path(input_filepath)
                 assert (
                     output == expected_output
                 ), f"[Core {core_num}] Output mismatch for {input_filename}.Expected: \n {expected_output}\n got: \n{output}"
@@ -289,19 +305,13 @@ if __name__ == "__main__":
                 output = run_cairo_program(input_filepath)
                 t1 = time.time()
                 print(f"\t ==> Run successful. Time taken: {t1-t0} seconds.")
-                expected_output = json.load(
-                    open(input_filepath.replace("_input", "_output"))
-                )
+                expected_output = get_expected_output(input_filepath)
                 assert (
                     output == expected_output
                 ), f"Output mismatch for {input_filename}.Expected: \n {expected_output}\n got: \n{output}"
-                assert_execution_resources_under_limits(
-                    input_filepath.replace("_input.json", "_pie.zip")
-                )
+                assert_execution_resources_under_limits(get_pie_path(input_filepath))
                 print(f"\t ==> Run is correct. Output matches precomputed output.")
-                print(
-                    f"\t ==> PIE Object written to {INPUT_PATH}{input_filename.removesuffix('_input.json')}_pie.zip \n"
-                )
+                print(f"\t ==> PIE Object written to {get_pie_path(input_filepath)} \n")
 
             if args.sharp:
                 print(f"Submitting job for {input_filename} to SHARP ...")
@@ -1,5 +1,5 @@
-import json
 import argparse
+from tools.py.utils import read_json, write_to_json_streaming
 
 
 def convert_numbers_to_hex_strings(data):
@@ -21,17 +21,15 @@ def convert_numbers_to_hex_strings(data):
         return data
 
 
-def main(input_file, output_file):
-    # Load JSON data from input file
-    with open(input_file, "r") as f:
-        json_data = json.load(f)
+def main(input_file, output_file, compact=False):
+    # Load JSON data from input file (.json or .json.gz)
+    json_data = read_json(input_file)
 
     # Convert integers in JSON to hexadecimal strings
     converted_data = convert_numbers_to_hex_strings(json_data)
 
-    # Save the converted JSON data to output file
-    with open(output_file, "w") as f:
-        json.dump(converted_data, f, indent=4)
+    # Save the converted JSON data to output file, compressed if it ends with .gz
+    write_to_json_streaming(output_file, converted_data, compact)
 
     print(f"Converted numbers to hexadecimal strings in '{output_file}'")
 
@@ -43,7 +41,10 @@ if __name__ == "__main__":
     )
     parser.add_argument("input_file", help="Path to the input JSON file")
     parser.add_argument("output_file", help="Path to save the output JSON file")
+    parser.add_argument(
+        "--compact", action="store_true", help="Write the JSON without whitespace"
+    )
 
     # Parse arguments and run the main function
     args = parser.parse_args()
-    main(args.input_file, args.output_file)
+    main(args.input_file, args.output_file, args.compact)
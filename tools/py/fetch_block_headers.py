@@ -2,7 +2,7 @@ import time
 import math
 import json
 from typing import Union, List
-from tools.py.utils import rpc_request
+from tools.py.utils import RpcClient, get_rpc_client
 
 from tools.py.block_header import (
     build_block_header,
@@ -15,7 +15,11 @@ RPC_BATCH_MAX_SIZE = 1450
 
 
 def fetch_blocks_from_rpc_no_async(
-    range_from: int, range_till: int, rpc_url: str, delay=0.1
+    range_from: int,
+    range_till: int,
+    rpc_url: str,
+    delay=0.1,
+    client: RpcClient = None,
 ) -> List[Union[BlockHeader, BlockHeaderEIP1559, BlockHeaderShangai]]:
     """
     # Fetches blocks from RPC in batches of RPC_BATCH_MAX_SIZE
@@ -25,6 +29,7 @@ def fetch_blocks_from_rpc_no_async(
     #   range_till: int - the block number to stop fetching at
     #   rpc_url: str - the RPC url to fetch from
     #   delay: float - delay between RPC requests (in seconds)
+    #   client: RpcClient - client to send the requests with, the one shared for rpc_url by default
     # Returns:
     #   list - a list of block headers of type BlockHeader, BlockHeaderEIP1559 or BlockHeaderShangai
     """
@@ -33,6 +38,7 @@ def fetch_blocks_from_rpc_no_async(
     rpc_batches_amount = math.ceil(number_of_blocks / RPC_BATCH_MAX_SIZE)
     last_batch_size = number_of_blocks % RPC_BATCH_MAX_SIZE
 
+    client = client or get_rpc_client(rpc_url)
     all_results = []
 
     for i in range(1, rpc_batches_amount + 1):
@@ -57,7 +63,7 @@ def fetch_blocks_from_rpc_no_async(
         )
 
         # Send all requests in the current batch in a single HTTP request
-        results = rpc_request(rpc_url, requests)
+        results = client.request(requests)
         # print(results)
         for result in results:
             block_header: Union[BlockHeader, BlockHeaderEIP1559, BlockHeaderShangai] = (
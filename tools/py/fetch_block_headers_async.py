@@ -0,0 +1,255 @@
+"""
+Asynchronous JSON-RPC block headers fetcher.
+Several batches of eth_getBlockByNumber calls are kept in flight, spread over a pool of endpoints
+(see rpc_endpoints.py), the batch size of each endpoint adapting to its latency and errors.
+The responses are matched to the blocks by their JSON-RPC id, in whatever order they come.
+The blocks are handed over in ascending order, so that they can be written as they come.
+"""
+
+import gzip
+import time
+import asyncio
+import logging
+import aiohttp
+from typing import Callable, Dict, List, Tuple, Union
+from tools.py.block_header import build_block_header
+from tools.py.rpc_endpoints import Endpoint, EndpointPool
+from tools.py.utils import RPC_CONNECT_TIMEOUT, json_decode, json_encode
+
+RPC_CONCURRENCY = 8  # batch requests in flight per endpoint
+MAX_RETRIES = 5
+RETRY_DELAY = 1.0  # seconds, doubled on each retry of a batch on the same endpoint
+REQUEST_TIMEOUT = 60.0  # seconds
+
+
+class RpcError(Exception):
+    pass
+
+
+class RateLimited(RpcError):
+    pass
+
+
+async def fetch_batch(
+    session: aiohttp.ClientSession,
+    rpc_url: str,
+    block_numbers: List[int],
+    compress_request: bool = False,
+) -> List[Tuple[int, bytes]]:
+    """
+    (block number, RLP encoded header) of each block, from a single batch request.
+    The request body is gzip compressed if compress_request is set (not all providers accept it).
+    Any unexpected answer (HTTP or JSON-RPC error, invalid JSON, calls or blocks of the wrong shape)
+    raises an RpcError.
+    """
+    calls = [
+        {
+            "jsonrpc": "2.0",
+            "method": "eth_getBlockByNumber",
+            "params": [hex(block_number), False],
+            "id": block_number,
+        }
+        for block_number in block_numbers
+    ]
+    body = json_encode(calls)
+    headers = {"Content-Type": "application/json"}
+    if compress_request:
+        body = gzip.compress(body, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+    async with session.post(rpc_url, data=body, headers=headers) as response:
+        if response.status == 429:
+            raise RateLimited(f"HTTP 429: {await response.text()}")
+        if response.status != 200:
+            raise RpcError(f"HTTP {response.status}: {await response.text()}")
+        body = await response.read()
+    try:
+        results = json_decode(body)
+    except ValueError as e:
+        raise RpcError(f"Invalid JSON response: {body[:200]!r}") from e
+    if not isinstance(results, list):
+        raise RpcError(f"Unexpected batch response: {results}")
+
+    blocks = {}
+    for result in results:
+        if not isinstance(result, dict):
+            raise RpcError(f"Unexpected call response: {result}")
+        if result.get("result") is None:
+            raise RpcError(f"Call {result.get('id')} failed: {result.get('error')}")
+        try:
+            blocks[int(result["id"])] = result["result"]
+        except (KeyError, TypeError, ValueError) as e:
+            raise RpcError(f"Unexpected call response: {result}") from e
+
+    rows = []
+    for block_number in block_numbers:
+        if block_number not in blocks:
+            raise RpcError(f"No response for block {block_number}")
+        try:
+            header = build_block_header(blocks[block_number])
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise RpcError(f"Invalid block {block_number}: {e!r}") from e
+        if header.number != block_number:
+            raise RpcError(f"Got block {header.number} for block {block_number}")
+        rows.append((block_number, header.raw_rlp()))
+    return rows
+
+
+class AsyncBlockFetcher:
+    """
+    Fetches block ranges with up to concurrency batches in flight (RPC_CONCURRENCY per endpoint by default),
+    each batch going to the best endpoint of the pool. Batches failing (HTTP or JSON-RPC errors, timeouts)
+    are split to the reduced batch size of their endpoint, and the parts are sent to other endpoints,
+    or retried with a backoff if there is no other one.
+    At most max_pending_blocks blocks are fetched ahead of the ones handed over.
+    As with RpcClient (utils.py), the connections are kept alive, responses are requested gzip compressed,
+    request bodies are compressed if compress_requests is set and JSON goes through orjson when it is installed.
+    timeout is the limit of a whole batch request, connect_timeout of establishing its connection, in seconds.
+    """
+
+    def __init__(
+        self,
+        endpoints: Union[str, EndpointPool],
+        concurrency: int = None,
+        max_retries: int = MAX_RETRIES,
+        retry_delay: float = RETRY_DELAY,
+        timeout: float = REQUEST_TIMEOUT,
+        max_pending_blocks: int = None,
+        connect_timeout: float = RPC_CONNECT_TIMEOUT,
+        compress_requests: bool = False,
+    ):
+        if isinstance(endpoints, str):
+            endpoints = EndpointPool([Endpoint(endpoints)])
+        self.endpoints = endpoints
+        self.concurrency = concurrency or RPC_CONCURRENCY * len(endpoints)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.compress_requests = compress_requests
+        self.max_pending_blocks = max_pending_blocks or (
+            2
+            * self.concurrency
+            * max(e.batch_size.maximum for e in endpoints.endpoints)
+        )
+        self.requests = 0
+        self.errors = 0
+
+    async def fetch_range(
+        self,
+        start: int,
+        end: int,
+        on_blocks: Callable[[List[Tuple[int, bytes]]], None],
+    ):
+        """
+        Fetches the blocks from start to end included. on_blocks is called with the (block number, header)
+        of consecutive blocks, in ascending order from start.
+        """
+        self._next = start
+        self._next_handed_over = start
+        self._fetched: Dict[int, List[Tuple[int, bytes]]] = {}
+        self._progress = asyncio.Condition()
+        async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(
+                total=self.timeout, sock_connect=self.connect_timeout
+            ),
+            headers={"Accept-Encoding": "gzip"},
+        ) as session:
+            workers = [
+                asyncio.create_task(self._worker(session, end, on_blocks))
+                for _ in range(self.concurrency)
+            ]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(
+        self,
+        session: aiohttp.ClientSession,
+        end: int,
+        on_blocks: Callable[[List[Tuple[int, bytes]]], None],
+    ):
+        while True:
+            async with self._progress:
+                await self._progress.wait_for(
+                    lambda: self._next > end
+                    or self._next - self._next_handed_over < self.max_pending_blocks
+                )
+            if self._next > end:
+                return
+            endpoint = await self.endpoints.choose()
+            if self._next > end:
+                endpoint.release()
+                return
+            first = self._next
+            self._next = min(first + endpoint.batch_size.size, end + 1)
+
+            rows = await self._fetch(session, list(range(first, self._next)), endpoint)
+
+            async with self._progress:
+                self._fetched[first] = rows
+                while self._next_handed_over in self._fetched:
+                    rows = self._fetched.pop(self._next_handed_over)
+                    on_blocks(rows)
+                    self._next_handed_over += len(rows)
+                self._progress.notify_all()
+
+    async def _fetch(
+        self,
+        session: aiohttp.ClientSession,
+        block_numbers: List[int],
+        endpoint: Endpoint = None,
+        attempt: int = 0,
+        failed: List[Endpoint] = (),
+    ) -> List[Tuple[int, bytes]]:
+        """
+        Fetches block_numbers from endpoint, reserved by the caller, or from the best endpoint
+        which has not failed them yet.
+        """
+        if endpoint is None:
+            endpoint = await self.endpoints.choose(len(block_numbers), failed)
+        try:
+            if endpoint in failed:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            await endpoint.bucket.acquire(len(block_numbers))
+            t0 = time.perf_counter()
+            self.requests += 1
+            try:
+                rows = await fetch_batch(
+                    session, endpoint.url, block_numbers, self.compress_requests
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError, RpcError) as e:
+                self.errors += 1
+                if isinstance(e, RateLimited):
+                    endpoint.on_rate_limited()
+                else:
+                    endpoint.on_failure()
+                if attempt >= self.max_retries:
+                    raise
+                logging.warning(
+                    f"Fetching blocks {block_numbers[0]} to {block_numbers[-1]} from {endpoint.name} failed, retrying. Error: {e!r}"
+                )
+            else:
+                endpoint.on_success(len(block_numbers), time.perf_counter() - t0)
+                return rows
+        finally:
+            endpoint.release()
+
+        size = endpoint.batch_size.size
+        parts = await asyncio.gather(
+            *(
+                self._fetch(
+                    session,
+                    block_numbers[i : i + size],
+                    attempt=attempt + 1,
+                    failed=[*failed, endpoint],
+                )
+                for i in range(0, len(block_numbers), size)
+            )
+        )
+        return [row for part in parts for row in part]
+
+    def report(self) -> str:
+        return f"{self.requests} batch requests, {self.errors} failed\n\t{self.endpoints.report()}"
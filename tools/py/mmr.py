@@ -7,18 +7,23 @@ Replicates the MMR behavior of the chunk processor, ie :
     - the root is computed by bagging the peaks and hashing the result with the size of the MMR
 """
 
-from typing import List, Tuple, Union
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Union
 import sha3
-from starkware.cairo.common.poseidon_hash import (
-    poseidon_hash,
-    poseidon_hash_single,
-    poseidon_hash_many,
-)
+from tools.py.poseidon_backends import get_poseidon_backend
 
 
 class PoseidonHasher:
+    """
+    Poseidon hasher, using the fastest Poseidon backend available (see tools/py/poseidon_backends.py)
+    """
+
     def __init__(self):
         self.items = []
+        self._poseidon = get_poseidon_backend()
 
     def update(self, item: Union[int, bytes]):
         if isinstance(item, int):
@@ -32,17 +37,23 @@ class PoseidonHasher:
         num_items = len(self.items)
 
         if num_items == 1:
-            result = poseidon_hash_single(self.items[0])
+            result = self._poseidon.hash_single(self.items[0])
         elif num_items == 2:
-            result = poseidon_hash(self.items[0], self.items[1])
+            result = self._poseidon.hash(self.items[0], self.items[1])
         elif num_items > 2:
-            result = poseidon_hash_many(self.items)
+            result = self._poseidon.hash_many(self.items)
         else:
             raise ValueError("No item to digest")
 
         self.items.clear()
         return result
 
+    def hash_pairs(self, lefts: list, rights: list) -> List[int]:
+        """
+        Hashes of each (left, right) pair, ie [hash(l, r) for l, r in zip(lefts, rights)]
+        """
+        return list(map(self._poseidon.hash, _as_ints(lefts), _as_ints(rights)))
+
 
 class KeccakHasher:
     def __init__(self):
@@ -61,6 +72,25 @@ class KeccakHasher:
         self.keccak = sha3.keccak_256()
         return result
 
+    def hash_pairs(self, lefts: list, rights: list) -> List[int]:
+        """
+        Hashes of each (left, right) pair, ie [hash(l, r) for l, r in zip(lefts, rights)]
+        Both 32 bytes words are written in a single preallocated buffer hashed in one call.
+        """
+        keccak_256 = sha3.keccak_256
+        buffer = bytearray(64)
+        results = []
+        for left, right in zip(lefts, rights):
+            if type(left) is int and type(right) is int:
+                buffer[:32] = left.to_bytes(32, "big")
+                buffer[32:] = right.to_bytes(32, "big")
+                results.append(int.from_bytes(keccak_256(buffer).digest(), "big"))
+            else:
+                self.update(left)
+                self.update(right)
+                results.append(self.digest())
+        return results
+
 
 class MockedHasher:
     def __init__(self):
@@ -73,20 +103,114 @@ class MockedHasher:
         self.hash_count += 1
         return 0
 
+    def hash_pairs(self, lefts: list, rights: list) -> List[int]:
+        n_pairs = min(len(lefts), len(rights))
+        self.hash_count += n_pairs
+        return [0] * n_pairs
+
+
+def _as_int(item: Union[bytes, int]) -> int:
+    return int.from_bytes(item, "big") if isinstance(item, bytes) else item
+
+
+def _as_ints(items: list) -> list:
+    return [_as_int(item) for item in items]
+
+
+def popcount(n: int) -> int:
+    return bin(n).count("1")
+
+
+def trailing_zeros(n: int) -> int:
+    """
+    Number of trailing zero bits of n > 0
+    """
+    return (n & -n).bit_length() - 1
+
+
+def leaf_count_to_mmr_size(leaf_count: int) -> int:
+    """
+    Size (number of nodes) of an MMR containing leaf_count leaves.
+    Each of the leaf_count - popcount(leaf_count) merges adds one node.
+    """
+    return 2 * leaf_count - popcount(leaf_count)
+
+
+def mmr_size_to_leaf_count(mmr_size: int) -> int:
+    """
+    Number of leaves of an MMR of size mmr_size (assumed valid).
+    An MMR is a sequence of perfect trees of decreasing heights, with 2**h - 1 nodes and
+    2**(h-1) leaves each : peel them from the left, one iteration per peak.
+    """
+    leaf_count = 0
+    while mmr_size:
+        height = (mmr_size + 1).bit_length() - 1
+        leaf_count += 1 << (height - 1)
+        mmr_size -= (1 << height) - 1
+    return leaf_count
+
+
+def merge_count(leaf_count: int, n_leaves: int) -> int:
+    """
+    Number of merges (internal nodes) created by appending n_leaves leaves to an MMR of leaf_count leaves.
+    """
+    return (
+        leaf_count_to_mmr_size(leaf_count + n_leaves)
+        - leaf_count_to_mmr_size(leaf_count)
+        - n_leaves
+    )
+
+
+def root_hash_count(leaf_count: int) -> int:
+    """
+    Number of hashes of get_root on an MMR of leaf_count > 0 leaves :
+    bagging its popcount(leaf_count) peaks, then hashing the size with the bag.
+    """
+    return popcount(leaf_count)
+
+
+def append_hash_count(mmr_size: int, n_leaves: int) -> int:
+    """
+    Number of hashes of the MMR part of a chunk appending n_leaves leaves to an MMR of size mmr_size :
+    initial root verification, merges and new root.
+    Simplifies to n_leaves + 2 * popcount(leaf_count).
+    """
+    leaf_count = mmr_size_to_leaf_count(mmr_size)
+    return (
+        root_hash_count(leaf_count)
+        + merge_count(leaf_count, n_leaves)
+        + root_hash_count(leaf_count + n_leaves)
+    )
+
+
+def leaf_index_to_pos(leaf_index: int) -> int:
+    """
+    0-based position of the leaf_index-th leaf (0-based), ie the size of the MMR before its insertion.
+    """
+    return 2 * leaf_index - popcount(leaf_index)
+
+
+def node_index_to_pos(height: int, node_index: int) -> int:
+    """
+    0-based position of the node_index-th node (0-based, from left to right) at the given height.
+    A node is stored right after the rightmost leaf of its sub tree and the nodes above that leaf.
+    """
+    return leaf_index_to_pos(((node_index + 1) << height) - 1) + height
+
+
+def pos_to_leaf_index(pos: int) -> int:
+    """
+    0-based leaf index of the leaf at 0-based position pos.
+    Raises ValueError if pos is not the position of a leaf.
+    """
+    leaf_index = mmr_size_to_leaf_count(pos)
+    if leaf_index_to_pos(leaf_index) != pos:
+        raise ValueError(f"Position {pos} is not a leaf")
+    return leaf_index
+
 
 def is_valid_mmr_size(n):
-    prev_peak = 0
-    while n > 0:
-        i = n.bit_length()
-        peak = 2**i - 1
-        if peak > n:
-            i -= 1
-            peak = 2**i - 1
-        if peak == prev_peak:
-            return False
-        prev_peak = peak
-        n -= peak
-    return n == 0
+    return n >= 0 and leaf_count_to_mmr_size(mmr_size_to_leaf_count(n)) == n
 
 
 def tree_pos_height(pos: int) -> int:
@@ -95,17 +219,15 @@ def tree_pos_height(pos: int) -> int:
     Explains:
     https://github.com/mimblewimble/grin/blob/0ff6763ee64e5a14e70ddd4642b99789a1648a32/core/src/core/pmmr.rs#L606
     use binary expression to find tree height(all one position number)
+    jump to the left sibling subtree (drop the most significant bit and add 1) until the 1-based
+    position is all ones, ie at most one jump per bit set.
     return pos height
     """
     # convert from 0-based to 1-based position, see document
     pos += 1
-    bit_length = pos.bit_length()
-    while not (1 << bit_length) - 1 == pos:
-        most_significant_bits = 1 << bit_length - 1
-        pos -= most_significant_bits - 1
-        bit_length = pos.bit_length()
-
-    return bit_length - 1
+    while pos & (pos + 1):
+        pos -= (1 << (pos.bit_length() - 1)) - 1
+    return pos.bit_length() - 1
 
 
 # get left or right sibling offset by height
@@ -113,120 +235,327 @@ def sibling_offset(height) -> int:
     return (2 << height) - 1
 
 
+@lru_cache(maxsize=4096)
+def _peaks_positions(mmr_size: int) -> Tuple[int, ...]:
+    poss = []
+    offset = 0
+    while mmr_size:
+        tree_size = (1 << ((mmr_size + 1).bit_length() - 1)) - 1
+        offset += tree_size
+        poss.append(offset - 1)
+        mmr_size -= tree_size
+    return tuple(poss)
+
+
 def get_peaks(mmr_size) -> List[int]:
     """
     return peaks positions from left to right, 0-index based.
+    Each peak closes a perfect tree of 2**h - 1 nodes, peeled from the left of the MMR.
+    Results are memoized, the returned list is a fresh copy.
     """
+    return list(_peaks_positions(mmr_size))
 
-    def get_right_peak(height, pos, mmr_size):
-        """
-        find next right peak
-        peak not exsits if height is -1
-        """
-        # jump to right sibling
-        pos += sibling_offset(height)
-        # jump to left child
-        while pos > mmr_size - 1:
-            height -= 1
-            if height < 0:
-                # no right peak exists
-                return (height, None)
-            pos -= 2 << height
-        return (height, pos)
 
-    poss = []
-    height, pos = left_peak_height_pos(mmr_size)
-    poss.append(pos)
-    while height > 0:
-        height, pos = get_right_peak(height, pos, mmr_size)
-        if height >= 0:
-            poss.append(pos)
-    return poss
+def get_peaks_heights(mmr_size: int) -> List[int]:
+    """
+    return peaks heights from left to right, ie the bits set in the leaf count from the most significant one.
+    """
+    leaf_count = mmr_size_to_leaf_count(mmr_size)
+    return [h for h in reversed(range(leaf_count.bit_length())) if leaf_count >> h & 1]
 
 
 def left_peak_height_pos(mmr_size: int) -> Tuple[int, int]:
     """
-    find left peak
+    find left peak, ie the root of the highest perfect tree of 2**(h+1) - 1 <= mmr_size nodes
     return (left peak height, pos)
     """
+    if mmr_size <= 0:
+        return (-1, 0)
+    height = (mmr_size + 1).bit_length() - 2
+    return (height, (2 << height) - 2)
+
+
+class CompactNodeStore:
+    """
+    Node store keeping every MMR node in a contiguous buffer of fixed-width 32 bytes slots,
+    indexed by position. Can be used in place of the default dict store :
+        mmr = MMR(PoseidonHasher(), CompactNodeStore())
+    Values are stored as 256 bits big endian integers and are always read back as int.
+    The last TAIL_SIZE nodes are kept as int and packed into the buffer by batches, and the
+    packed nodes read back (ie the peaks) are cached as int, so that MMR.add and get_peaks
+    mostly avoid the int/bytes conversions. Reads and writes still go through Python methods
+    though : MMR.add and get_peaks remain about 1.5x to 2x slower than with a dict, for about
+    4x less memory (see tools/bench/bench_mmr_store.py). Only use it when memory matters.
+    The buffer is grown geometrically and can be pre-grown with `reserve` when the final
+    size of the MMR is known in advance.
+    """
 
-    def get_left_pos(height):
+    SLOT_SIZE = 32
+    TAIL_SIZE = 4096
+    CACHE_SIZE = 256
+
+    def __init__(self, capacity: int = 0):
+        self._buffer = bytearray(capacity * self.SLOT_SIZE)
+        self._capacity = capacity
+        # Nodes below _packed are in the buffer, the following ones in _tail.
+        self._packed = 0
+        self._tail = []
+        self._cache = {}
+
+    def reserve(self, capacity: int):
         """
-        convert height to binary express, then minus 1 to get 0 based pos
-        explain:
-        https://github.com/mimblewimble/grin/blob/master/doc/mmr.md#structure
-        https://github.com/mimblewimble/grin/blob/0ff6763ee64e5a14e70ddd4642b99789a1648a32/core/src/core/pmmr.rs#L606
-        For example:
-        height = 2
-        # use one-based encoding, mean that left node is all one-bits
-        # 0b1 is 0 pos, 0b11 is 2 pos 0b111 is 6 pos
-        one_based_binary_encoding = 0b111
-        pos = 0b111 - 1 = 6
+        Grow the buffer so that it can hold at least `capacity` nodes without reallocation.
         """
-        return (1 << height + 1) - 2
+        if capacity > self._capacity:
+            self._buffer.extend(bytes((capacity - self._capacity) * self.SLOT_SIZE))
+            self._capacity = capacity
+
+    def __len__(self) -> int:
+        return self._packed + len(self._tail)
+
+    def __contains__(self, pos: int) -> bool:
+        return 0 <= pos < len(self)
+
+    def __getitem__(self, pos: int) -> int:
+        index = pos - self._packed
+        if index >= 0:
+            try:
+                return self._tail[index]
+            except IndexError:
+                raise KeyError(pos) from None
+        value = self._cache.get(pos)
+        if value is None:
+            if pos < 0:
+                raise KeyError(pos)
+            offset = pos * self.SLOT_SIZE
+            value = int.from_bytes(
+                self._buffer[offset : offset + self.SLOT_SIZE], "big"
+            )
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            self._cache[pos] = value
+        return value
+
+    def __setitem__(self, pos: int, value: Union[bytes, int]):
+        tail = self._tail
+        # Fast path of MMR.add : appending an int.
+        if pos == self._packed + len(tail) and type(value) is int:
+            tail.append(value)
+            if len(tail) >= self.TAIL_SIZE:
+                self._pack()
+            return
+        if type(value) is not int:
+            if isinstance(value, int):
+                value = int(value)
+            elif isinstance(value, bytes) and len(value) == self.SLOT_SIZE:
+                value = int.from_bytes(value, "big")
+            else:
+                raise TypeError(f"Unsupported node value: {type(value)}, {value}")
+        index = pos - self._packed
+        if index >= 0:
+            if index >= len(tail):
+                # Positions may be written out of order (ie MMR.extend), gaps are zeroed.
+                tail.extend([0] * (index - len(tail)))
+                tail.append(value)
+                if len(tail) >= self.TAIL_SIZE:
+                    self._pack()
+            else:
+                tail[index] = value
+        else:
+            offset = pos * self.SLOT_SIZE
+            self._buffer[offset : offset + self.SLOT_SIZE] = value.to_bytes(
+                self.SLOT_SIZE, "big"
+            )
+            self._cache.pop(pos, None)
 
-    height = 0
-    prev_pos = 0
-    pos = get_left_pos(height)
-    # increase height and get most left pos of tree
-    # once pos is out of mmr_size we consider previous pos is left peak
-    while pos < mmr_size:
-        height += 1
-        prev_pos = pos
-        pos = get_left_pos(height)
-    return (height - 1, prev_pos)
+    def _pack(self):
+        """
+        Move the tail nodes to the buffer, converted in a single batch.
+        """
+        size = len(self)
+        if size > self._capacity:
+            self.reserve(max(size, 2 * self._capacity, 1024))
+        n = len(self._tail)
+        self._buffer[self._packed * self.SLOT_SIZE : size * self.SLOT_SIZE] = b"".join(
+            map(int.to_bytes, self._tail, repeat(self.SLOT_SIZE, n), repeat("big", n))
+        )
+        self._packed = size
+        self._tail = []
+
+    def nbytes(self) -> int:
+        """
+        Memory held by the buffer, in bytes, without the TAIL_SIZE nodes at most kept as int.
+        """
+        return len(self._buffer)
+
+
+class MMRProof(NamedTuple):
+    """
+    Inclusion proof of the leaf at leaf_index (0-based) :
+        - siblings : sibling hashes from the leaf up to its peak (excluded)
+        - peaks : all the peaks values of the MMR, from left to right
+    """
+
+    leaf_index: int
+    siblings: List[int]
+    peaks: List[int]
+
+
+def _peak_height_of_leaf(leaf_count: int, leaf_index: int) -> int:
+    """
+    Height of the peak whose sub tree contains the leaf_index-th leaf, in an MMR of leaf_count leaves.
+    Peaks are perfect trees of 2**h leaves, h being the bits set in leaf_count from the most significant one.
+    The leaf belongs to the first peak for which the leaf indexes above it differ from leaf_count.
+    """
+    return (leaf_count ^ leaf_index).bit_length() - 1
+
+
+def verify_proof(
+    root: int,
+    mmr_size: int,
+    leaf: Union[bytes, int],
+    proof: MMRProof,
+    hasher: Union[PoseidonHasher, KeccakHasher] = None,
+) -> bool:
+    """
+    Check that leaf is the proof.leaf_index-th leaf of the MMR of size mmr_size and root `root`.
+    The peaks are bagged and hashed with the size exactly as in MMR.get_root (Poseidon by default).
+    """
+    hasher = hasher or PoseidonHasher()
+    if not is_valid_mmr_size(mmr_size) or mmr_size == 0:
+        return False
+    leaf_count = mmr_size_to_leaf_count(mmr_size)
+    if not 0 <= proof.leaf_index < leaf_count:
+        return False
+    peaks_heights = get_peaks_heights(mmr_size)
+    peak_height = _peak_height_of_leaf(leaf_count, proof.leaf_index)
+    if len(proof.siblings) != peak_height or len(proof.peaks) != len(peaks_heights):
+        return False
+
+    value = leaf
+    for height, sibling in enumerate(proof.siblings):
+        if (proof.leaf_index >> height) & 1:
+            hasher.update(sibling)
+            hasher.update(value)
+        else:
+            hasher.update(value)
+            hasher.update(sibling)
+        value = hasher.digest()
+
+    if _as_int(value) != _as_int(proof.peaks[peaks_heights.index(peak_height)]):
+        return False
+    return root_from_peaks(hasher, mmr_size, proof.peaks) == root
 
 
 class MMR(object):
     """
     MMR
+    Nodes are kept in `pos_hash`, a plain dict by default. Any mapping-like store indexed by
+    position (ie CompactNodeStore) can be passed instead, the MMR then resumes from its size.
     """
 
     def __init__(
         self,
-        hasher: Union[PoseidonHasher, KeccakHasher, MockedHasher] = PoseidonHasher(),
+        hasher: Union[PoseidonHasher, KeccakHasher, MockedHasher] = None,
+        store=None,
     ):
-        self.last_pos = -1
-        self.pos_hash = {}
-        self._hasher = hasher
+        self.pos_hash = {} if store is None else store
+        self.last_pos = len(self.pos_hash) - 1
+        self._hasher = hasher or PoseidonHasher()
+        self._leaf_count = 0
+        self._leaf_count_size = 0
 
     def add(self, elem: Union[bytes, int]) -> int:
         """
         Insert a new leaf, v is a binary value
         """
+        # last_pos can be set from outside, only trust the cached leaf count if the size matches
+        if self._leaf_count_size != self.last_pos + 1:
+            self._leaf_count = mmr_size_to_leaf_count(self.last_pos + 1)
+        self._leaf_count += 1
         self.last_pos += 1
 
         # store hash
         self.pos_hash[self.last_pos] = elem
-        height = 0
         pos = self.last_pos
         # merge same sub trees
-        # if next pos height is higher implies we are in right children
-        # and sub trees can be merge
-        while tree_pos_height(self.last_pos + 1) > height:
+        # the n-th leaf closes as many perfect sub trees as n has trailing zeros
+        for height in range(trailing_zeros(self._leaf_count)):
             # increase pos cursor
             self.last_pos += 1
-            # calculate pos of left child and right child
+            # calculate pos of left child
             left_pos = self.last_pos - (2 << height)
-            right_pos = left_pos + sibling_offset(height)
             # calculate parent hash
+            # the right child is the node that was just stored, no need to read it back
             self._hasher.update(self.pos_hash[left_pos])
-            self._hasher.update(self.pos_hash[right_pos])
-            self.pos_hash[self.last_pos] = self._hasher.digest()
-            height += 1
+            self._hasher.update(elem)
+            elem = self._hasher.digest()
+            self.pos_hash[self.last_pos] = elem
+        self._leaf_count_size = self.last_pos + 1
         return pos
 
+    def extend(self, leaves: list):
+        """
+        Insert several leaves, with the same result as calling add on each of them.
+        Parent nodes are computed level by level, each level being hashed in a single batch.
+        """
+        leaf_count = mmr_size_to_leaf_count(self.last_pos + 1)
+        new_leaf_count = leaf_count + len(leaves)
+        level = list(leaves)
+        height = 0
+        while level:
+            first_index = leaf_count >> height
+            for i, value in enumerate(level):
+                self.pos_hash[node_index_to_pos(height, first_index + i)] = value
+            if first_index & 1:
+                # the first node is a right child, its left sibling is an existing peak
+                left_sibling_pos = node_index_to_pos(height, first_index - 1)
+                level.insert(0, self.pos_hash[left_sibling_pos])
+            n_parents = (new_leaf_count >> (height + 1)) - (leaf_count >> (height + 1))
+            level = self._hasher.hash_pairs(
+                level[0 : 2 * n_parents : 2], level[1 : 2 * n_parents : 2]
+            )
+            height += 1
+        self.last_pos = leaf_count_to_mmr_size(new_leaf_count) - 1
+        self._leaf_count = new_leaf_count
+        self._leaf_count_size = self.last_pos + 1
+
+    def _append_subtree(self, nodes: list, height: int):
+        """
+        Append the nodes (in position order) of a perfect sub tree of the given height, aligned on
+        the current leaf count, and merge its root with the peaks of the same height.
+        """
+        if self._leaf_count_size != self.last_pos + 1:
+            self._leaf_count = mmr_size_to_leaf_count(self.last_pos + 1)
+        self._leaf_count += 1 << height
+        for elem in nodes:
+            self.last_pos += 1
+            self.pos_hash[self.last_pos] = elem
+        for merge_height in range(height, trailing_zeros(self._leaf_count)):
+            self.last_pos += 1
+            left_pos = self.last_pos - (2 << merge_height)
+            self._hasher.update(self.pos_hash[left_pos])
+            self._hasher.update(elem)
+            elem = self._hasher.digest()
+            self.pos_hash[self.last_pos] = elem
+        self._leaf_count_size = self.last_pos + 1
+
+    def extend_parallel(self, leaves: list, max_workers: int = None):
+        """
+        Same as extend, the perfect sub trees of the new leaves being built in a process pool.
+        See split_perfect_subtrees.
+        """
+        leaf_count = mmr_size_to_leaf_count(self.last_pos + 1)
+        for nodes, height in build_perfect_subtrees(
+            type(self._hasher), leaf_count, leaves, True, max_workers
+        ):
+            self._append_subtree(nodes, height)
+
     def get_root(self) -> int:
         """
         MMR root
         """
-        peaks = get_peaks(self.last_pos + 1)
-        peaks_values = [self.pos_hash[p] for p in peaks]
-        bagged = self.bag_peaks(peaks_values)
-        self._hasher.update(self.last_pos + 1)
-        self._hasher.update(bagged)
-        root = self._hasher.digest()
-        return root
+        return root_from_peaks(self._hasher, self.last_pos + 1, self.get_peaks())
 
     def get_peaks(self) -> list:
         peaks = get_peaks(self.last_pos + 1)
@@ -235,14 +564,361 @@ class MMR(object):
         return peaks_values
 
     def bag_peaks(self, peaks: List[int]) -> int:
-        bags = peaks[-1]
-        for peak in reversed(peaks[:-1]):
-            self._hasher.update(peak)
-            self._hasher.update(bags)
+        return bag_peaks(self._hasher, peaks)
+
+    def get_proof(self, leaf_index: int) -> MMRProof:
+        """
+        Inclusion proof of the leaf_index-th leaf (0-based) against the current root.
+        """
+        return self.get_proofs([leaf_index])[0]
+
+    def get_proofs(self, leaf_indexes: Iterable[int]) -> List[MMRProof]:
+        """
+        Inclusion proofs of several leaves against the current root.
+        The peaks are read once and the sibling nodes shared by several paths are read only once.
+        """
+        mmr_size = self.last_pos + 1
+        leaf_count = mmr_size_to_leaf_count(mmr_size)
+        peaks = self.get_peaks()
+        nodes: Dict[int, int] = {}
+        proofs = []
+        for leaf_index in leaf_indexes:
+            if not 0 <= leaf_index < leaf_count:
+                raise IndexError(
+                    f"Leaf index {leaf_index} out of range for an MMR of {leaf_count} leaves"
+                )
+            siblings = []
+            for height in range(_peak_height_of_leaf(leaf_count, leaf_index)):
+                pos = node_index_to_pos(height, (leaf_index >> height) ^ 1)
+                if pos not in nodes:
+                    nodes[pos] = self.pos_hash[pos]
+                siblings.append(nodes[pos])
+            proofs.append(MMRProof(leaf_index, siblings, peaks))
+        return proofs
+
+
+class MMRFrontier(object):
+    """
+    Peaks-only MMR accumulator.
+    Only keeps the peaks of the MMR (and their heights), ie O(log n) values instead of every node.
+    Appending a leaf pushes it on the peaks stack and merges the two top peaks as long as they have
+    the same height, which yields exactly the same peaks and root as MMR.add.
+    """
+
+    def __init__(
+        self,
+        hasher: Union[PoseidonHasher, KeccakHasher, MockedHasher] = None,
+        peaks: List[int] = None,
+        mmr_size: int = 0,
+    ):
+        """
+        Optionally resume from the peaks values (left to right) of an MMR of size mmr_size.
+        """
+        peaks = [] if peaks is None else list(peaks)
+        if not is_valid_mmr_size(mmr_size):
+            raise ValueError(f"Invalid MMR size: {mmr_size}")
+        heights = get_peaks_heights(mmr_size)
+        if len(heights) != len(peaks):
+            raise ValueError(
+                f"MMR of size {mmr_size} has {len(heights)} peaks. Got {len(peaks)} instead"
+            )
+        self.peaks = peaks
+        self.heights = heights
+        self.mmr_size = mmr_size
+        self._hasher = hasher or PoseidonHasher()
+
+    def add(self, elem: Union[bytes, int]) -> int:
+        """
+        Insert a new leaf, returns its position in the MMR
+        """
+        pos = self.mmr_size
+        self._push(elem, 0)
+        return pos
+
+    def _push(self, elem: Union[bytes, int], height: int):
+        """
+        Push the root of a perfect sub tree of the given height, aligned on the current leaf count,
+        and merge it with the peaks of the same height.
+        """
+        self.mmr_size += (2 << height) - 1
+        while self.heights and self.heights[-1] == height:
+            self.heights.pop()
+            self._hasher.update(self.peaks.pop())
+            self._hasher.update(elem)
+            elem = self._hasher.digest()
+            self.mmr_size += 1
+            height += 1
+        self.peaks.append(elem)
+        self.heights.append(height)
+
+    def extend_parallel(self, leaves: list, max_workers: int = None):
+        """
+        Same as extend, the perfect sub trees of the new leaves being built in a process pool.
+        See split_perfect_subtrees.
+        """
+        leaf_count = sum(1 << height for height in self.heights)
+        for root, height in build_perfect_subtrees(
+            type(self._hasher), leaf_count, leaves, False, max_workers
+        ):
+            self._push(root, height)
+
+    def extend(self, leaves: list):
+        """
+        Insert several leaves, with the same result as calling add on each of them.
+        Parent nodes are computed level by level, each level being hashed in a single batch.
+        """
+        leaf_count = sum(1 << height for height in self.heights)
+        level = list(leaves)
+        new_peaks = []
+        height = 0
+        while level:
+            if self.heights and self.heights[-1] == height:
+                # the first node is a right child, its left sibling is the top peak
+                self.heights.pop()
+                level.insert(0, self.peaks.pop())
+            if len(level) & 1:
+                new_peaks.append((level.pop(), height))
+            level = self._hasher.hash_pairs(level[0::2], level[1::2])
+            height += 1
+        for peak, peak_height in reversed(new_peaks):
+            self.peaks.append(peak)
+            self.heights.append(peak_height)
+        self.mmr_size = leaf_count_to_mmr_size(leaf_count + len(leaves))
+
+    def get_root(self) -> int:
+        """
+        MMR root
+        """
+        return root_from_peaks(self._hasher, self.mmr_size, self.peaks)
+
+    def get_peaks(self) -> list:
+        return list(self.peaks)
+
+
+# Smallest sub tree built by a worker, smaller ones are not worth the inter-process round trip.
+MIN_PARALLEL_SUBTREE_HEIGHT = 8
+# Sub trees per worker, to balance the load when their sizes differ.
+SUBTREES_PER_WORKER = 4
+
+
+def split_perfect_subtrees(
+    leaf_count: int, n_leaves: int, max_height: int
+) -> List[Tuple[int, int]]:
+    """
+    Split the insertion of n_leaves leaves in an MMR of leaf_count leaves into perfect sub trees
+    of at most 2**max_height leaves, each one aligned on the leaf count it is inserted at.
+    Returns (offset in the new leaves, height) for each sub tree, from left to right.
+    The sub trees are independent, their roots are then merged with the peaks in order.
+    """
+    subtrees = []
+    offset = 0
+    while offset < n_leaves:
+        height = min(max_height, (n_leaves - offset).bit_length() - 1)
+        if leaf_count + offset:
+            height = min(height, trailing_zeros(leaf_count + offset))
+        subtrees.append((offset, height))
+        offset += 1 << height
+    return subtrees
+
+
+def build_perfect_subtree(hasher_class, leaves: list, keep_nodes: bool):
+    """
+    Builds the perfect tree over leaves (a power of 2 of them) level by level.
+    Returns its root, or all its nodes in position order if keep_nodes is set.
+    """
+    hasher = hasher_class()
+    level = list(leaves)
+    nodes = [None] * (2 * len(leaves) - 1) if keep_nodes else None
+    height = 0
+    while True:
+        if keep_nodes:
+            for i, value in enumerate(level):
+                nodes[node_index_to_pos(height, i)] = value
+        if len(level) == 1:
+            return nodes if keep_nodes else level[0]
+        level = hasher.hash_pairs(level[0::2], level[1::2])
+        height += 1
+
+
+def _build_perfect_subtree_task(args: tuple):
+    return build_perfect_subtree(*args)
+
+
+def build_perfect_subtrees(
+    hasher_class,
+    leaf_count: int,
+    leaves: list,
+    keep_nodes: bool,
+    max_workers: int = None,
+):
+    """
+    Builds the perfect sub trees of an insertion of leaves in an MMR of leaf_count leaves in a process pool.
+    Yields (root or nodes, height) for each sub tree, in insertion order.
+    """
+    max_workers = max_workers or os.cpu_count()
+    max_height = max(
+        MIN_PARALLEL_SUBTREE_HEIGHT,
+        (len(leaves) // (max_workers * SUBTREES_PER_WORKER)).bit_length() - 1,
+    )
+    subtrees = split_perfect_subtrees(leaf_count, len(leaves), max_height)
+    tasks = (
+        (hasher_class, leaves[offset : offset + (1 << height)], keep_nodes)
+        for offset, height in subtrees
+    )
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_build_perfect_subtree_task, tasks)
+        for result, (_, height) in zip(results, subtrees):
+            yield result, height
+
+
+class DualMMRFrontier(object):
+    """
+    Peaks-only Poseidon and Keccak MMRs built together.
+    Both trees have the same shape : the merges of an extension are planned once from the peaks heights,
+    then each side is hashed following that plan. Peaks are kept as (poseidon, keccak) pairs.
+    With keccak_thread, the Keccak side is hashed in a thread while the Poseidon side is hashed.
+    """
 
-            bags = self._hasher.digest()
+    def __init__(
+        self,
+        poseidon_peaks: List[int] = None,
+        keccak_peaks: List[int] = None,
+        mmr_size: int = 0,
+        keccak_thread: bool = False,
+    ):
+        poseidon_peaks = [] if poseidon_peaks is None else poseidon_peaks
+        keccak_peaks = [] if keccak_peaks is None else keccak_peaks
+        if not is_valid_mmr_size(mmr_size):
+            raise ValueError(f"Invalid MMR size: {mmr_size}")
+        heights = get_peaks_heights(mmr_size)
+        if not len(heights) == len(poseidon_peaks) == len(keccak_peaks):
+            raise ValueError(
+                f"MMR of size {mmr_size} has {len(heights)} peaks. Got {len(poseidon_peaks)} (poseidon) and {len(keccak_peaks)} (keccak) instead"
+            )
+        self.peaks = list(zip(poseidon_peaks, keccak_peaks))
+        self.heights = heights
+        self.mmr_size = mmr_size
+        self.keccak_thread = keccak_thread
+        self._poseidon_hasher = PoseidonHasher()
+        self._keccak_hasher = KeccakHasher()
+
+    def _plan_extension(self, n_leaves: int) -> List[Tuple[bool, bool]]:
+        """
+        For each level of an extension by n_leaves, whether the top peak is the left sibling
+        of the first node of the level and whether the last node of the level becomes a peak.
+        """
+        plan = []
+        heights = list(self.heights)
+        level_len = n_leaves
+        height = 0
+        while level_len:
+            take_peak = bool(heights) and heights[-1] == height
+            if take_peak:
+                heights.pop()
+                level_len += 1
+            plan.append((take_peak, bool(level_len & 1)))
+            level_len >>= 1
+            height += 1
+        return plan
+
+    @staticmethod
+    def _extend_side(
+        hasher: Union[PoseidonHasher, KeccakHasher],
+        peaks: List[int],
+        leaves: list,
+        plan: List[Tuple[bool, bool]],
+    ) -> List[int]:
+        level = list(leaves)
+        new_peaks = []
+        for take_peak, keep_last in plan:
+            if take_peak:
+                level.insert(0, peaks.pop())
+            if keep_last:
+                new_peaks.append(level.pop())
+            level = hasher.hash_pairs(level[0::2], level[1::2])
+        return peaks + new_peaks[::-1]
+
+    def extend(self, poseidon_leaves: list, keccak_leaves: list):
+        """
+        Insert several leaves, given by their Poseidon and Keccak values.
+        """
+        if len(poseidon_leaves) != len(keccak_leaves):
+            raise ValueError(
+                f"Got {len(poseidon_leaves)} Poseidon leaves and {len(keccak_leaves)} Keccak leaves"
+            )
+        plan = self._plan_extension(len(poseidon_leaves))
+        poseidon_peaks = [peak[0] for peak in self.peaks]
+        keccak_peaks = [peak[1] for peak in self.peaks]
+        args = (self._keccak_hasher, keccak_peaks, keccak_leaves, plan)
+        if self.keccak_thread:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future_keccak = executor.submit(self._extend_side, *args)
+                poseidon_peaks = self._extend_side(
+                    self._poseidon_hasher, poseidon_peaks, poseidon_leaves, plan
+                )
+                keccak_peaks = future_keccak.result()
+        else:
+            poseidon_peaks = self._extend_side(
+                self._poseidon_hasher, poseidon_peaks, poseidon_leaves, plan
+            )
+            keccak_peaks = self._extend_side(*args)
+
+        for take_peak, _ in plan:
+            if take_peak:
+                self.heights.pop()
+        for height, (_, keep_last) in reversed(list(enumerate(plan))):
+            if keep_last:
+                self.heights.append(height)
+        self.peaks = list(zip(poseidon_peaks, keccak_peaks))
+        self.mmr_size = leaf_count_to_mmr_size(
+            mmr_size_to_leaf_count(self.mmr_size) + len(poseidon_leaves)
+        )
+
+    def add(self, poseidon_leaf: Union[bytes, int], keccak_leaf: Union[bytes, int]):
+        self.extend([poseidon_leaf], [keccak_leaf])
+
+    def get_peaks(self) -> Tuple[List[int], List[int]]:
+        """
+        Poseidon peaks and Keccak peaks, from left to right
+        """
+        return [peak[0] for peak in self.peaks], [peak[1] for peak in self.peaks]
+
+    def get_roots(self) -> Tuple[int, int]:
+        """
+        Poseidon root and Keccak root
+        """
+        poseidon_peaks, keccak_peaks = self.get_peaks()
+        return (
+            root_from_peaks(self._poseidon_hasher, self.mmr_size, poseidon_peaks),
+            root_from_peaks(self._keccak_hasher, self.mmr_size, keccak_peaks),
+        )
+
+
+def bag_peaks(
+    hasher: Union[PoseidonHasher, KeccakHasher, MockedHasher], peaks: List[int]
+) -> int:
+    bags = peaks[-1]
+    for peak in reversed(peaks[:-1]):
+        hasher.update(peak)
+        hasher.update(bags)
 
-        return bags
+        bags = hasher.digest()
+
+    return bags
+
+
+def root_from_peaks(
+    hasher: Union[PoseidonHasher, KeccakHasher, MockedHasher],
+    mmr_size: int,
+    peaks: List[int],
+) -> int:
+    """
+    Root of an MMR from its size and its peaks values : hash(mmr_size, bag_peaks(peaks))
+    """
+    bagged = bag_peaks(hasher, peaks)
+    hasher.update(mmr_size)
+    hasher.update(bagged)
+    return hasher.digest()
 
 
 if __name__ == "__main__":
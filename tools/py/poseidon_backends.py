@@ -0,0 +1,168 @@
+"""
+Poseidon backends registry.
+The reference implementation is the (pure Python) one of cairo-lang. Native implementations
+exposing the same functions can be used instead when they are installed and pass a self-test
+against the reference, the first one in this order of preference being selected :
+    - poseidon_py : C implementation (pip install poseidon-py)
+    - starknet_crypto_py : Rust implementation (pip install starknet-crypto-py)
+The POSEIDON_BACKEND environment variable forces a given backend by name.
+The choice is the same in every process of a run. Compare the backends with tools/bench/bench_poseidon_backends.py.
+"""
+
+import os
+import random
+from functools import lru_cache
+from typing import Callable, List, NamedTuple, Sequence
+
+POSEIDON_BACKEND_ENV = "POSEIDON_BACKEND"
+REFERENCE_BACKEND = "starkware"
+# Number of 8 bytes words of a ~600 bytes block header, the typical input of hash_many.
+SELF_TEST_HEADER_WORDS = 76
+STARK_PRIME = (
+    3618502788666131213697322783095070105623107215331596699973092056135872020481
+)
+
+
+class PoseidonBackend(NamedTuple):
+    name: str
+    hash: Callable[[int, int], int]
+    hash_single: Callable[[int], int]
+    hash_many: Callable[[Sequence[int]], int]
+
+
+def _load_starkware() -> PoseidonBackend:
+    from starkware.cairo.common.poseidon_hash import (
+        poseidon_hash,
+        poseidon_hash_single,
+        poseidon_hash_many,
+    )
+    from starkware.cairo.common.poseidon_utils import PoseidonParams
+
+    params = PoseidonParams.get_default_poseidon_params()
+    return PoseidonBackend(
+        REFERENCE_BACKEND,
+        lambda x, y: poseidon_hash(x, y, params),
+        lambda x: poseidon_hash_single(x, params),
+        lambda values: poseidon_hash_many(values, params),
+    )
+
+
+def _load_poseidon_py() -> PoseidonBackend:
+    from poseidon_py.poseidon_hash import (
+        poseidon_hash,
+        poseidon_hash_single,
+        poseidon_hash_many,
+    )
+
+    return PoseidonBackend(
+        "poseidon_py", poseidon_hash, poseidon_hash_single, poseidon_hash_many
+    )
+
+
+def _load_starknet_crypto_py() -> PoseidonBackend:
+    from starknet_crypto_py import (
+        poseidon_hash,
+        poseidon_hash_single,
+        poseidon_hash_many,
+    )
+
+    return PoseidonBackend(
+        "starknet_crypto_py",
+        poseidon_hash,
+        poseidon_hash_single,
+        lambda values: poseidon_hash_many(list(values)),
+    )
+
+
+# Backends by order of preference, the reference one last.
+BACKEND_LOADERS = {
+    "poseidon_py": _load_poseidon_py,
+    "starknet_crypto_py": _load_starknet_crypto_py,
+    REFERENCE_BACKEND: _load_starkware,
+}
+
+
+@lru_cache(maxsize=None)
+def _self_test_vectors() -> List[tuple]:
+    rng = random.Random(0)
+
+    def felt() -> int:
+        return rng.randrange(STARK_PRIME)
+
+    return [
+        ("hash", (0, 0)),
+        ("hash", (felt(), felt())),
+        ("hash_single", (felt(),)),
+        ("hash_many", ([],)),
+        ("hash_many", ([felt()],)),
+        ("hash_many", ([felt() for _ in range(3)],)),
+        ("hash_many", ([rng.getrandbits(64) for _ in range(SELF_TEST_HEADER_WORDS)],)),
+    ]
+
+
+def _run_self_test_vectors(backend: PoseidonBackend) -> list:
+    """
+    Returns the outputs of backend on the self-test vectors.
+    """
+    return [getattr(backend, fn)(*args) for fn, args in _self_test_vectors()]
+
+
+@lru_cache(maxsize=None)
+def _reference_outputs() -> list:
+    return _run_self_test_vectors(load_backend(REFERENCE_BACKEND))
+
+
+def self_test(backend: PoseidonBackend) -> bool:
+    """
+    Whether backend gives the same outputs as the reference backend on the self-test vectors.
+    """
+    expected = _reference_outputs()
+    if backend.name == REFERENCE_BACKEND:
+        return True
+    try:
+        return _run_self_test_vectors(backend) == expected
+    except Exception:
+        return False
+
+
+def load_backend(name: str) -> PoseidonBackend:
+    """
+    Loads a backend by name, raises ImportError if it is not installed.
+    """
+    if name not in BACKEND_LOADERS:
+        raise ValueError(
+            f"Unknown Poseidon backend {name}. Available: {list(BACKEND_LOADERS)}"
+        )
+    return BACKEND_LOADERS[name]()
+
+
+def available_backends() -> List[PoseidonBackend]:
+    """
+    Installed backends passing the self-test, by order of preference.
+    """
+    backends = []
+    for name in BACKEND_LOADERS:
+        try:
+            backend = load_backend(name)
+        except ImportError:
+            continue
+        if self_test(backend):
+            backends.append(backend)
+    return backends
+
+
+@lru_cache(maxsize=None)
+def get_poseidon_backend(name: str = None) -> PoseidonBackend:
+    """
+    Returns the requested backend (argument or POSEIDON_BACKEND environment variable),
+    or the first installed one passing the self-test, by order of preference.
+    """
+    name = name or os.getenv(POSEIDON_BACKEND_ENV)
+    if name is None:
+        return available_backends()[0]
+    backend = load_backend(name)
+    if not self_test(backend):
+        raise ValueError(
+            f"Poseidon backend {name} does not match the reference implementation"
+        )
+    return backend
@@ -0,0 +1,274 @@
+"""
+Pool of JSON-RPC endpoints the block fetcher spreads its batches over. Each endpoint has :
+    - a token bucket, limiting the calls per second sent to it to the rate limit of its provider,
+    - an EWMA of its latency per block,
+    - a circuit breaker : after BREAKER_FAILURE_THRESHOLD consecutive failures, no batch is sent to it
+      for a cooldown, doubled each time the trial batch sent after the cooldown fails. Rate limited
+      batches (HTTP 429) do not count, they empty its token bucket instead,
+    - its own adaptive batch size.
+Batches go to the endpoint expected to answer them the soonest, given its latency, its batches in flight
+and its rate limit.
+The endpoints are given by the RPC_URLS_MAINNET environment variable : comma separated urls, each optionally
+followed by |<calls per second>, eg "https://provider-a/key|100,https://provider-b/key|25".
+"""
+
+import time
+import asyncio
+from urllib.parse import urlparse
+from typing import Callable, Iterable, List, Optional
+from tools.py.fetch_block_headers import RPC_BATCH_MAX_SIZE
+
+INITIAL_BATCH_SIZE = 100
+BATCH_SIZE_STEP = 50
+# Batches answered slower than this (in seconds) halve the batch size.
+TARGET_LATENCY = 2.0
+# Weight of the last batch in the latency EWMA.
+LATENCY_EWMA_ALPHA = 0.2
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN = 5.0  # seconds
+BREAKER_MAX_COOLDOWN = 300.0  # seconds
+# Polling delay while every endpoint is waiting for its trial batch.
+PROBE_POLL_DELAY = 0.1  # seconds
+
+
+class AdaptiveBatchSize:
+    """
+    Batch size tuned from the outcome of each batch (additive increase, multiplicative decrease) :
+    it grows by step after full batches answered within target_latency, and is halved after errors
+    or slower answers.
+    """
+
+    def __init__(
+        self,
+        initial: int = INITIAL_BATCH_SIZE,
+        minimum: int = 1,
+        maximum: int = RPC_BATCH_MAX_SIZE,
+        step: int = BATCH_SIZE_STEP,
+        target_latency: float = TARGET_LATENCY,
+    ):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.target_latency = target_latency
+
+    def on_success(self, batch_size: int, latency: float):
+        if latency > self.target_latency:
+            self.size = max(self.minimum, self.size // 2)
+        elif batch_size >= self.size:
+            self.size = min(self.maximum, self.size + self.step)
+
+    def on_error(self):
+        self.size = max(self.minimum, self.size // 2)
+
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average, in bursts of up to burst calls (rate by default).
+    Batches larger than burst wait for a full bucket and leave it in debt. No limit if rate is None.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float],
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst or rate
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, n_calls: int) -> float:
+        """
+        Seconds to wait before n_calls can be sent.
+        """
+        if self.rate is None:
+            return 0.0
+        self._refill()
+        return max(0.0, min(n_calls, self.burst) - self.tokens) / self.rate
+
+    def take(self, n_calls: int):
+        if self.rate is not None:
+            self._refill()
+            self.tokens -= n_calls
+
+    def drain(self):
+        if self.rate is not None:
+            self._refill()
+            self.tokens = min(self.tokens, 0)
+
+    async def acquire(self, n_calls: int):
+        delay = self.delay(n_calls)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay(n_calls)
+        self.take(n_calls)
+
+
+class Endpoint:
+    def __init__(
+        self,
+        url: str,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        batch_size: AdaptiveBatchSize = None,
+        cooldown: float = BREAKER_COOLDOWN,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.url = url
+        # Host only, the url may hold an API key.
+        self.name = urlparse(url).netloc or url
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.batch_size = batch_size or AdaptiveBatchSize()
+        self.clock = clock
+        self.latency_per_block: Optional[float] = None
+        self.in_flight = 0
+        self.failures = 0
+        self.initial_cooldown = cooldown
+        self.cooldown = cooldown
+        self.open_until: Optional[float] = None
+        self.probing = False
+        self.requests = 0
+        self.errors = 0
+
+    def is_available(self) -> bool:
+        """
+        False while the circuit is open, and while the trial batch sent after the cooldown is in flight.
+        """
+        if self.open_until is None:
+            return True
+        return not self.probing and self.clock() >= self.open_until
+
+    def time_per_block(self, n_blocks: int) -> float:
+        """
+        Expected seconds per block of a batch of n_blocks sent now, waiting for the rate limit
+        and sharing the endpoint with the batches in flight.
+        Endpoints without latency measurement yet come first.
+        """
+        latency = (self.latency_per_block or 0.0) * n_blocks * (1 + self.in_flight)
+        return (self.bucket.delay(n_blocks) + latency) / n_blocks
+
+    def reserve(self):
+        self.in_flight += 1
+        if self.open_until is not None:
+            self.probing = True
+
+    def release(self):
+        """
+        Ends a batch, whatever its outcome : a trial batch ending without on_success or on_failure
+        (eg cancelled) does not leave the endpoint waiting for it forever.
+        """
+        self.in_flight -= 1
+        self.probing = False
+
+    def on_success(self, n_blocks: int, latency: float):
+        self.requests += 1
+        per_block = latency / n_blocks
+        if self.latency_per_block is None:
+            self.latency_per_block = per_block
+        else:
+            self.latency_per_block += LATENCY_EWMA_ALPHA * (
+                per_block - self.latency_per_block
+            )
+        self.batch_size.on_success(n_blocks, latency)
+        self.failures = 0
+        self.cooldown = self.initial_cooldown
+        self.open_until = None
+        self.probing = False
+
+    def on_failure(self):
+        self.requests += 1
+        self.errors += 1
+        self.failures += 1
+        self.batch_size.on_error()
+        if self.probing:
+            self.cooldown = min(2 * self.cooldown, BREAKER_MAX_COOLDOWN)
+        if self.probing or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            self.open_until = self.clock() + self.cooldown
+            self.probing = False
+
+    def on_rate_limited(self):
+        """
+        The provider answered HTTP 429 : its bucket is emptied, without counting a failure
+        for the circuit breaker (nor ending the cooldown of an open circuit).
+        """
+        self.requests += 1
+        self.errors += 1
+        self.probing = False
+        self.bucket.drain()
+
+    def report(self) -> str:
+        latency = (
+            "-"
+            if self.latency_per_block is None
+            else f"{self.latency_per_block * 1000:.2f} ms/block"
+        )
+        state = "open" if self.open_until is not None else "closed"
+        return f"{self.name}: {self.requests} batches, {self.errors} failed, {latency}, batch size {self.batch_size.size}, circuit {state}"
+
+
+class EndpointPool:
+    def __init__(self, endpoints: List[Endpoint]):
+        if not endpoints:
+            raise ValueError("No RPC endpoint")
+        self.endpoints = endpoints
+
+    @classmethod
+    def parse(cls, value: str, **endpoint_kwargs) -> "EndpointPool":
+        """
+        Pool of the endpoints of an RPC_URLS_MAINNET value : "url[|calls per second],...".
+        """
+        endpoints = []
+        for entry in value.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            url, _, rate = entry.partition("|")
+            endpoints.append(
+                Endpoint(url.strip(), float(rate) if rate else None, **endpoint_kwargs)
+            )
+        return cls(endpoints)
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def best(
+        self, n_blocks: int = None, exclude: Iterable[Endpoint] = ()
+    ) -> Optional[Endpoint]:
+        """
+        Available endpoint with the lowest expected time per block, for a batch of n_blocks (by default
+        its own batch size). The excluded endpoints are only considered if no other one is available.
+        """
+        available = [e for e in self.endpoints if e.is_available()]
+        candidates = [e for e in available if e not in exclude] or available
+        if not candidates:
+            return None
+        return min(
+            candidates, key=lambda e: e.time_per_block(n_blocks or e.batch_size.size)
+        )
+
+    async def choose(
+        self, n_blocks: int = None, exclude: Iterable[Endpoint] = ()
+    ) -> Endpoint:
+        """
+        Reserves the best endpoint, to be released once its batch is answered. Waits for the first
+        cooldown to end if every circuit is open.
+        """
+        while True:
+            endpoint = self.best(n_blocks, exclude)
+            if endpoint is not None:
+                endpoint.reserve()
+                return endpoint
+            now = self.endpoints[0].clock()
+            waits = [e.open_until - now for e in self.endpoints if not e.probing]
+            await asyncio.sleep(max(min(waits, default=PROBE_POLL_DELAY), 0.001))
+
+    def report(self) -> str:
+        return "\n\t".join(endpoint.report() for endpoint in self.endpoints)
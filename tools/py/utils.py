@@ -2,10 +2,29 @@
 
 import json
 import os
+import sys
+import gzip
 import shutil
+import struct
+import tempfile
 import requests
+from requests.adapters import HTTPAdapter
+from array import array
+from contextlib import contextmanager
+from typing import IO, Iterable, Iterator, List, Optional
 from tools.py.mmr import is_valid_mmr_size
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# gzip level of compressed JSON files, most of the size reduction for a fraction of the level 9 time.
+GZIP_COMPRESS_LEVEL = 6
+RPC_CONNECT_TIMEOUT = 10  # seconds
+RPC_READ_TIMEOUT = 120  # seconds, a full batch of blocks can take a while
+RPC_POOL_SIZE = 10  # connections kept alive per host
+
 
 def split_128(a):
     """Takes in value, returns uint256-ish tuple."""
@@ -17,30 +36,234 @@ def from_uint256(a):
     return a[0] + (a[1] << 128)
 
 
+def json_encode(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def json_decode(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class RpcClient:
+    """
+    JSON-RPC client reusing its connections (keep-alive, pool of a requests.Session) across requests,
+    instead of a new connection and TLS handshake per request.
+    Responses are requested gzip compressed, request bodies are compressed if compress_requests is set
+    (not all providers accept it), and JSON goes through orjson when it is installed.
+    timeout is (connect, read) in seconds.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: tuple = (RPC_CONNECT_TIMEOUT, RPC_READ_TIMEOUT),
+        compress_requests: bool = False,
+        pool_size: int = RPC_POOL_SIZE,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.compress_requests = compress_requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+        )
+
+    def __enter__(self) -> "RpcClient":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def request(self, payload):
+        """
+        Sends a call or a batch of calls, returns the decoded response.
+        """
+        body = json_encode(payload)
+        headers = None
+        if self.compress_requests:
+            body = gzip.compress(body, compresslevel=1)
+            headers = {"Content-Encoding": "gzip"}
+        response = self.session.post(
+            self.url, data=body, headers=headers, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return json_decode(response.content)
+
+    def close(self):
+        self.session.close()
+
+
+_RPC_CLIENTS = {}
+
+
+def get_rpc_client(url: str) -> RpcClient:
+    """
+    Client shared by all the requests to url.
+    """
+    if url not in _RPC_CLIENTS:
+        _RPC_CLIENTS[url] = RpcClient(url)
+    return _RPC_CLIENTS[url]
+
+
 def rpc_request(url, rpc_request):
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(url=url, headers=headers, data=json.dumps(rpc_request))
-    # print(f"Status code: {response.status_code}")
-    # print(f"Response content: {response.content}")
-    return response.json()
-
-
-def bytes_to_8_bytes_chunks_little(input_bytes):
-    # Split the input_bytes into 8-byte chunks
-    byte_chunks = [input_bytes[i : i + 8] for i in range(0, len(input_bytes), 8)]
-    # Convert each chunk to little-endian integers
-    little_endian_ints = [
-        int.from_bytes(chunk, byteorder="little") for chunk in byte_chunks
-    ]
-    return little_endian_ints
+    return get_rpc_client(url).request(rpc_request)
+
+
+def _bytes_to_8_bytes_chunks(input_bytes, byteorder: str) -> List[int]:
+    # Read the full 8-byte words in place, as an array of unsigned 64-bit integers
+    view = memoryview(input_bytes)
+    n_words, tail = divmod(len(view), 8)
+    endianness = "<" if byteorder == "little" else ">"
+    words = list(struct.unpack_from(f"{endianness}{n_words}Q", view))
+    # The last chunk may be shorter than 8 bytes and is converted as is
+    if tail:
+        words.append(int.from_bytes(view[n_words * 8 :], byteorder=byteorder))
+    return words
+
+
+def bytes_to_8_bytes_chunks_little(input_bytes) -> List[int]:
+    """Splits input_bytes into 8-byte chunks converted to little-endian integers."""
+    return _bytes_to_8_bytes_chunks(input_bytes, "little")
+
+
+def bytes_to_8_bytes_chunks(input_bytes) -> List[int]:
+    """Splits input_bytes into 8-byte chunks converted to big-endian integers."""
+    return _bytes_to_8_bytes_chunks(input_bytes, "big")
 
 
-def bytes_to_8_bytes_chunks(input_bytes):
-    # Split the input_bytes into 8-byte chunks
-    byte_chunks = [input_bytes[i : i + 8] for i in range(0, len(input_bytes), 8)]
-    # Convert each chunk to big-endian integers
-    big_endian_ints = [int.from_bytes(chunk, byteorder="big") for chunk in byte_chunks]
-    return big_endian_ints
+def headers_to_8_bytes_chunks_little(headers: Iterable[bytes]) -> List[List[int]]:
+    """bytes_to_8_bytes_chunks_little of each header."""
+    return [_bytes_to_8_bytes_chunks(header, "little") for header in headers]
+
+
+class HeaderWords:
+    """
+    headers_to_8_bytes_chunks_little of block headers, kept as one flat array('Q') of words plus the offset
+    of the words of each header : 8 bytes per word instead of a Python int and a list slot.
+    Indexing and iterating give the words of a header as a list, write_to_json_streaming serializes
+    them straight from the array.
+    """
+
+    def __init__(self, headers: Iterable[bytes] = ()):
+        self.words = array("Q")
+        self.offsets = array("Q", [0])
+        self.extend(headers)
+
+    def extend(self, headers: Iterable[bytes]):
+        words = array("Q")
+        offsets = self.offsets
+        n_words = len(self.words)
+        for header in headers:
+            # Zero padding to a full word leaves the value of the (little endian) tail word unchanged
+            words.frombytes(bytes(header) + bytes(-len(header) % 8))
+            offsets.append(n_words + len(words))
+        if sys.byteorder == "big":
+            words.byteswap()
+        self.words.extend(words)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> List[int]:
+        index = range(len(self))[index]
+        return self.words[self.offsets[index] : self.offsets[index + 1]].tolist()
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return (self[i] for i in range(len(self)))
+
+    def json_elements(self, indent: Optional[str]) -> Iterator[str]:
+        """
+        _json_dumps(words, indent) of each header.
+        """
+        words, offsets = self.words, self.offsets
+        if indent is None:
+            for i in range(len(self)):
+                yield f"[{','.join(map(str, words[offsets[i] : offsets[i + 1]]))}]"
+            return
+        separator = ",\n" + indent + "    "
+        for i in range(len(self)):
+            start, end = offsets[i], offsets[i + 1]
+            if start == end:
+                yield "[]"
+            else:
+                yield f"[{separator[1:]}{separator.join(map(str, words[start:end]))}\n{indent}]"
+
+
+def _json_dumps(value, indent: Optional[str]) -> str:
+    """
+    json.dumps(value, indent=4) with indent before each line but the first, or without any whitespace
+    if indent is None.
+    """
+    if indent is None:
+        return json.dumps(value, separators=(",", ":"))
+    return json.dumps(value, indent=4).replace("\n", "\n" + indent)
+
+
+def _json_list_elements(value, indent: Optional[str]) -> Iterator[str]:
+    """
+    _json_dumps(element, indent) of each element of value.
+    HeaderWords, as value or as elements of value, stand for their list of headers words.
+    """
+    if isinstance(value, HeaderWords):
+        yield from value.json_elements(indent)
+        return
+    for element in value:
+        if isinstance(element, HeaderWords):
+            yield from element.json_elements(indent)
+        else:
+            yield _json_dumps(element, indent)
+
+
+def open_json_file(filename, mode: str = "r") -> IO[str]:
+    """
+    Opens a JSON file in text mode, gzip compressed if its name ends with .gz.
+    """
+    if str(filename).endswith(".gz"):
+        return gzip.open(filename, mode + "t", compresslevel=GZIP_COMPRESS_LEVEL)
+    return open(filename, mode)
+
+
+def read_json(filename):
+    """Reads a JSON file, compressed or not (see open_json_file)."""
+    with open_json_file(filename) as f:
+        return json.load(f)
+
+
+def is_json_file(filename: str, suffix: str = "") -> bool:
+    """Whether filename ends with suffix followed by .json or .json.gz"""
+    return filename.endswith(suffix + ".json") or filename.endswith(suffix + ".json.gz")
+
+
+def json_file_stem(filename: str) -> str:
+    """filename without its .json or .json.gz extension."""
+    return filename.removesuffix(".gz").removesuffix(".json")
+
+
+@contextmanager
+def plain_json_file(filename: str) -> Iterator[str]:
+    """
+    Path of a plain copy of a compressed JSON file, for programs reading JSON files themselves (cairo-run),
+    removed on exit. Other files are used as they are.
+    """
+    if not filename.endswith(".gz"):
+        yield filename
+        return
+    with tempfile.NamedTemporaryFile(
+        "wb", suffix=".json", dir=os.path.dirname(filename) or None, delete=False
+    ) as plain:
+        with gzip.open(filename, "rb") as compressed:
+            shutil.copyfileobj(compressed, plain)
+    try:
+        yield plain.name
+    finally:
+        os.remove(plain.name)
 
 
 def write_to_json(filename, data):
@@ -49,6 +272,34 @@ def write_to_json(filename, data):
         json.dump(data, f, indent=4)
 
 
+def write_to_json_streaming(filename, data: dict, compact: bool = False):
+    """
+    Same output as write_to_json, but the values of data which are iterators are written as lists
+    one element at a time, so that they never have to be held in memory, and HeaderWords (or iterators
+    of HeaderWords, concatenated) are written as lists of headers words straight from their array.
+    With compact, the JSON is written without any whitespace. Files named *.gz are gzip compressed.
+    """
+    indent = None if compact else "    "
+    element_indent = None if compact else 2 * indent
+    key_start = "" if compact else "\n" + indent
+    element_start = "" if compact else "\n" + element_indent
+    colon = ":" if compact else ": "
+    with open_json_file(filename, "w") as f:
+        f.write("{")
+        for i, (key, value) in enumerate(data.items()):
+            f.write(f"{',' if i else ''}{key_start}{json.dumps(key)}{colon}")
+            if not isinstance(value, (Iterator, HeaderWords)):
+                f.write(_json_dumps(value, indent))
+                continue
+            empty = True
+            for element in _json_list_elements(value, element_indent):
+                f.write(f"{'[' if empty else ','}{element_start}")
+                f.write(element)
+                empty = False
+            f.write("[]" if empty else f"{key_start}]")
+        f.write("\n}" if data and not compact else "}")
+
+
 def create_directory(path: str):
     if not os.path.exists(path):
         os.makedirs(path)